@@ -14,9 +14,13 @@ from AR.models.utils import (
     get_batch_logps,
     make_pad_mask,
     make_pad_mask_left,
+    logits_to_probs,
     make_reject_y,
-    sample,
+    make_token_counts,
+    multinomial_sample_one_no_sync,
+    sample_top_k_first,
     topk_sampling,
+    update_token_counts,
 )
 from AR.modules.embedding import SinePositionalEmbedding, TokenEmbedding
 from AR.modules.transformer import LayerNorm, TransformerEncoder, TransformerEncoderLayer
@@ -173,6 +177,42 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def process_prompt_packed(
+        self,
+        x: torch.Tensor,
+        cu_seqlens: List[int],
+        attn_masks: List[torch.Tensor],
+        torch_sdpa: bool = True,
+    ):
+        # x: (total_len, hidden_dim), 各序列首尾相接; 第i个序列为 x[cu_seqlens[i]:cu_seqlens[i+1]], 其mask为 attn_masks[i]
+        q, k_cache, v_cache = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        attn_list: List[torch.Tensor] = []
+        for i in range(len(attn_masks)):
+            start = cu_seqlens[i]
+            seq_len = cu_seqlens[i + 1] - start
+            q_i = q[start : start + seq_len].view(1, seq_len, self.num_heads, -1).transpose(1, 2)
+            k_i = k_cache[start : start + seq_len].view(1, seq_len, self.num_heads, -1).transpose(1, 2)
+            v_i = v_cache[start : start + seq_len].view(1, seq_len, self.num_heads, -1).transpose(1, 2)
+            if torch_sdpa:
+                attn_i = F.scaled_dot_product_attention(q_i, k_i, v_i, ~attn_masks[i])
+            else:
+                attn_i = scaled_dot_product_attention(q_i, k_i, v_i, attn_masks[i])
+            attn_list.append(attn_i.transpose(1, 2).reshape(seq_len, -1))
+        attn = F.linear(torch.cat(attn_list, dim=0), self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(x, [self.hidden_dim], self.norm_w1, self.norm_b1, self.norm_eps1)
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x, k_cache, v_cache
+
     def decode_next_token(
         self,
         x: torch.Tensor,
@@ -220,6 +260,55 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        cache_pos: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = cache_pos + q_len
+
+        # 原地写入预分配的cache, 不再每个token都torch.cat整个cache; 一次可写入多个token(投机解码的验证)
+        k_cache.narrow(1, cache_pos, q_len).copy_(k)
+        v_cache.narrow(1, cache_pos, q_len).copy_(v)
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, (~attn_mask) if attn_mask is not None else None)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = F.linear(attn, self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
 
 @torch.jit.script
 class T2STransformer:
@@ -242,6 +331,21 @@ class T2STransformer:
             v_cache.append(v_cache_)
         return x, k_cache, v_cache
 
+    def process_prompt_packed(
+        self,
+        x: torch.Tensor,
+        cu_seqlens: List[int],
+        attn_masks: List[torch.Tensor],
+        torch_sdpa: bool = True,
+    ):
+        k_cache: List[torch.Tensor] = []
+        v_cache: List[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            x, k_cache_, v_cache_ = self.blocks[i].process_prompt_packed(x, cu_seqlens, attn_masks, torch_sdpa)
+            k_cache.append(k_cache_)
+            v_cache.append(v_cache_)
+        return x, k_cache, v_cache
+
     def decode_next_token(
         self,
         x: torch.Tensor,
@@ -256,6 +360,271 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        cache_pos: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], cache_pos, attn_mask, torch_sdpa)
+        return x
+
+
+class T2SKVCache:
+    """
+    Preallocated kv cache with a write cursor for the decode loop.
+
+    `decode_next_token_static` writes the new token at position `length` in place, instead of
+    re-concatenating the whole cache for every layer and every token. The buffers grow geometrically
+    (at most up to `max_len`), so only a few reallocations happen for a whole sentence.
+
+    Args:
+        k_cache (List[torch.Tensor]): the per-layer cache returned by `process_prompt`, (bsz, src_len, hidden_dim).
+        v_cache (List[torch.Tensor]): same as k_cache.
+        padding_mask (torch.Tensor): (bsz, src_len), True for the masked positions, or None.
+        max_len (int): the largest kv length the decode loop can reach.
+        block_size (int): the minimum number of positions added when the buffers grow.
+    """
+
+    def __init__(
+        self,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        padding_mask: Optional[torch.Tensor],
+        max_len: int,
+        block_size: int = 256,
+    ):
+        self.k_cache = k_cache
+        self.v_cache = v_cache
+        self.padding_mask = padding_mask
+        self.length: int = k_cache[0].shape[1]
+        self.capacity: int = self.length
+        self.max_len: int = max(max_len, self.length + 1)
+        self.block_size = block_size
+
+    def _resize(self, capacity: int):
+        pad = capacity - self.capacity
+        self.k_cache = [F.pad(item, (0, 0, 0, pad), value=0) for item in self.k_cache]
+        self.v_cache = [F.pad(item, (0, 0, 0, pad), value=0) for item in self.v_cache]
+        if self.padding_mask is not None:
+            self.padding_mask = F.pad(self.padding_mask, (0, pad), value=False)
+        self.capacity = capacity
+
+    def reserve(self, n: int = 1):
+        if self.length + n <= self.capacity:
+            return
+        capacity = max(self.capacity * 2, self.length + self.block_size)
+        capacity = max(min(capacity, self.max_len), self.length + n)
+        self._resize(capacity)
+
+    def attn_mask(self, n: int = 1) -> Optional[torch.Tensor]:
+        """
+        The (bsz, 1, n, length + n) mask of the n tokens being written at the cursor,
+        causal among themselves.
+        """
+        if n == 1:
+            if self.padding_mask is None:
+                return None
+            return self.padding_mask[:, : self.length + 1].unsqueeze(1).unsqueeze(1)
+        device = self.k_cache[0].device
+        causal_mask = F.pad(
+            torch.triu(torch.ones(n, n, dtype=torch.bool, device=device), diagonal=1), (self.length, 0), value=False
+        )
+        if self.padding_mask is None:
+            return causal_mask.view(1, 1, n, self.length + n)
+        padding_mask = self.padding_mask[:, : self.length + n].unsqueeze(1).unsqueeze(1)
+        return padding_mask.logical_or(causal_mask)
+
+    def advance(self, n: int = 1):
+        self.length += n
+
+    def mask_tail(self, start: int, valid_lens: torch.LongTensor):
+        """
+        Mask the positions from `start + valid_lens[i]` to the cursor of row i, e.g. the kv of rejected draft tokens.
+        The positions stay in the cache as holes, so that the rows of a batch can advance by different amounts.
+        """
+        if self.padding_mask is None:
+            self.padding_mask = torch.zeros(
+                self.k_cache[0].shape[0], self.capacity, dtype=torch.bool, device=self.k_cache[0].device
+            )
+        positions = torch.arange(self.length - start, device=self.padding_mask.device)
+        tail = positions.unsqueeze(0) >= valid_lens.to(self.padding_mask.device).unsqueeze(1)
+        self.padding_mask[:, start : self.length] |= tail
+
+    def index_select(self, index: torch.LongTensor):
+        self.k_cache = [torch.index_select(item, dim=0, index=index) for item in self.k_cache]
+        self.v_cache = [torch.index_select(item, dim=0, index=index) for item in self.v_cache]
+        if self.padding_mask is not None:
+            self.padding_mask = torch.index_select(self.padding_mask, dim=0, index=index)
+
+    def left_pad(self, n: int):
+        self.k_cache = [F.pad(item, (0, 0, n, 0), value=0) for item in self.k_cache]
+        self.v_cache = [F.pad(item, (0, 0, n, 0), value=0) for item in self.v_cache]
+        self.padding_mask = F.pad(self.padding_mask, (n, 0), value=True)
+        self.length += n
+        self.capacity += n
+        self.max_len += n
+
+    def trim_left(self, n: int):
+        self.k_cache = [item[:, n:] for item in self.k_cache]
+        self.v_cache = [item[:, n:] for item in self.v_cache]
+        self.padding_mask = self.padding_mask[:, n:]
+        self.length -= n
+        self.capacity -= n
+        self.max_len -= n
+
+    def concat(self, other: "T2SKVCache"):
+        """
+        Append the rows of another cache with the same length along the batch dim.
+        """
+        assert self.length == other.length
+        self.max_len = max(self.max_len, other.max_len)
+        if self.capacity < other.capacity:
+            self._resize(other.capacity)
+        elif other.capacity < self.capacity:
+            other._resize(self.capacity)
+        for i in range(len(self.k_cache)):
+            self.k_cache[i] = torch.concat([self.k_cache[i], other.k_cache[i]], dim=0)
+            self.v_cache[i] = torch.concat([self.v_cache[i], other.v_cache[i]], dim=0)
+        self.padding_mask = torch.concat([self.padding_mask, other.padding_mask], dim=0)
+
+
+class T2SLoopDetector:
+    """
+    Online check of the semantic tokens generated by every row of a decode loop, so that a row which
+    runs away (never emits EOS) is stopped long before `early_stop_num` / the 1500 steps ceiling.
+
+    - "loop": at least `max_repeat_ratio` of the `ngram`-grams of the last `window` tokens already
+      occurred earlier in that window, i.e. the row keeps repeating a short pattern (any period shorter
+      than the window, including a stuck token).
+    - "budget": the row generated more than its `max_new_tokens`, see `length_budget`.
+
+    The cost per step is O(window) per row, independent of the number of generated tokens.
+
+    Args:
+        batch_size (int): the number of rows.
+        device: the device of the sampled tokens.
+        max_new_tokens (torch.LongTensor): (bsz,) the token budget of every row, or None.
+        detect_loop (bool): False to only enforce the budget.
+        ngram (int): the length of the compared patterns.
+        window (int): the number of recent tokens checked, 150 tokens are 6 seconds at 25hz.
+        max_repeat_ratio (float): the share of repeated n-grams in the window that counts as a loop.
+    """
+
+    REASONS = [None, "loop", "budget"]
+    # 与 Text2SemanticDataset 过滤训练数据的每秒音素数范围一致
+    MIN_PS_RATIO = 3
+    MAX_PS_RATIO = 25
+
+    def __init__(
+        self,
+        batch_size: int,
+        device,
+        max_new_tokens: Optional[torch.LongTensor] = None,
+        detect_loop: bool = True,
+        ngram: int = 3,
+        window: int = 150,
+        max_repeat_ratio: float = 0.7,
+    ):
+        self.detect_loop = detect_loop
+        self.ngram = ngram
+        self.window = window
+        self.min_repeats = int(window * max_repeat_ratio)
+        self.max_new_tokens = max_new_tokens.to(device) if max_new_tokens is not None else None
+        self.n_generated = torch.zeros((batch_size,), dtype=torch.long, device=device)
+
+        self.last_tokens = torch.zeros((batch_size, ngram), dtype=torch.long, device=device)
+        # 窗口内每个位置的n-gram编码(-1为空)及其是否在窗口内更早出现过, 按步数循环写入
+        self.codes = torch.full((batch_size, window), -1, dtype=torch.long, device=device)
+        self.repeated = torch.zeros((batch_size, window), dtype=torch.bool, device=device)
+        self.n_repeated = torch.zeros((batch_size,), dtype=torch.long, device=device)
+
+    @classmethod
+    def length_budget(cls, phones_len: torch.LongTensor, hz: int = 25) -> torch.LongTensor:
+        """
+        The most semantic tokens a sentence of `phones_len` phonemes may take: the slowest speech rate
+        of the training data, plus one second for the leading / trailing silence.
+        """
+        return (phones_len * hz + cls.MIN_PS_RATIO - 1) // cls.MIN_PS_RATIO + hz
+
+    @classmethod
+    def min_length(cls, phones_len: torch.LongTensor, hz: int = 25) -> torch.LongTensor:
+        """
+        The fewest semantic tokens a sentence of `phones_len` phonemes should take (the fastest speech rate).
+        """
+        return phones_len * hz // cls.MAX_PS_RATIO
+
+    def update(self, samples: torch.Tensor, active: Optional[torch.Tensor] = None) -> torch.LongTensor:
+        """
+        Feed the tokens (bsz, 1) sampled at this step, rows where the bool mask `active` (bsz,) is False are
+        left unchanged. Returns (bsz,) indices into `REASONS`, 0 for the rows to keep.
+        """
+        if active is None:
+            active = torch.ones((samples.shape[0],), dtype=torch.bool, device=samples.device)
+        self.n_generated = self.n_generated + active.long()
+        self.last_tokens = torch.where(
+            active.unsqueeze(1), torch.concat([self.last_tokens[:, 1:], samples.long()], dim=1), self.last_tokens
+        )
+        reasons = torch.zeros((samples.shape[0],), dtype=torch.long, device=samples.device)
+
+        if self.detect_loop:
+            active = active.logical_and(self.n_generated >= self.ngram)
+            code = self.last_tokens[:, 0]
+            for i in range(1, self.ngram):
+                code = code * 1025 + self.last_tokens[:, i]
+            pos = (self.n_generated % self.window).unsqueeze(1)
+            # 先清空当前位置(窗口中最旧的n-gram), 再与窗口内其余n-gram比较
+            codes = self.codes.scatter(1, pos, -1)
+            repeated = (codes == code.unsqueeze(1)).any(dim=1)
+            n_repeated = self.n_repeated - self.repeated.gather(1, pos).squeeze(1).long() + repeated.long()
+            self.codes = torch.where(active.unsqueeze(1), codes.scatter(1, pos, code.unsqueeze(1)), self.codes)
+            self.repeated = torch.where(
+                active.unsqueeze(1), self.repeated.scatter(1, pos, repeated.unsqueeze(1)), self.repeated
+            )
+            self.n_repeated = torch.where(active, n_repeated, self.n_repeated)
+            reasons.masked_fill_(self.n_repeated >= self.min_repeats, 1)
+
+        if self.max_new_tokens is not None:
+            reasons.masked_fill_(self.n_generated > self.max_new_tokens, 2)
+        return reasons
+
+    def index_select(self, index: torch.LongTensor):
+        self.n_generated = torch.index_select(self.n_generated, dim=0, index=index)
+        self.last_tokens = torch.index_select(self.last_tokens, dim=0, index=index)
+        self.codes = torch.index_select(self.codes, dim=0, index=index)
+        self.repeated = torch.index_select(self.repeated, dim=0, index=index)
+        self.n_repeated = torch.index_select(self.n_repeated, dim=0, index=index)
+        if self.max_new_tokens is not None:
+            self.max_new_tokens = torch.index_select(self.max_new_tokens, dim=0, index=index)
+
+
+class T2SDraftModel:
+    """
+    The draft model of `Text2SemanticDecoder.infer_panel_speculative`.
+
+    `decoder` provides the embeddings and the output layer, `t2s_transformer` the blocks. Build it with
+    `from_truncated` (the first blocks of the target itself, no extra weights) or `from_decoder`
+    (a shallow Text2SemanticDecoder trained with the s1 pipeline on the same vocabularies).
+    """
+
+    def __init__(self, decoder: "Text2SemanticDecoder", t2s_transformer: T2STransformer):
+        self.decoder = decoder
+        self.t2s_transformer = t2s_transformer
+
+    @classmethod
+    def from_truncated(cls, decoder: "Text2SemanticDecoder", num_layers: int) -> "T2SDraftModel":
+        num_layers = max(1, min(num_layers, decoder.num_layers))
+        blocks = decoder.t2s_transformer.blocks[:num_layers]
+        return cls(decoder, T2STransformer(num_layers, blocks))
+
+    @classmethod
+    def from_decoder(cls, decoder: "Text2SemanticDecoder") -> "T2SDraftModel":
+        return cls(decoder, decoder.t2s_transformer)
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -321,6 +690,15 @@ class Text2SemanticDecoder(nn.Module):
             ignore_index=self.EOS,
         )
 
+        self.init_t2s_transformer()
+        self.draft_model: Optional[T2SDraftModel] = None
+        self.speculative_stats: dict = None
+
+    def init_t2s_transformer(self):
+        """
+        The inference blocks hold references to the parameters of `self.h`, rebuild them after those parameters
+        were replaced instead of copied into (e.g. `load_state_dict(..., assign=True)`).
+        """
         blocks = []
 
         for i in range(self.num_layers):
@@ -580,34 +958,20 @@ class Text2SemanticDecoder(nn.Module):
         # 错位
         return targets[:, :-1], targets[:, 1:]
 
-    def infer_panel_batch_infer(
+    def _make_batch_prefill_inputs(
         self,
-        x: List[torch.LongTensor],  #####全部文本token
+        x: List[torch.LongTensor],
         x_lens: torch.LongTensor,
-        prompts: torch.LongTensor,  ####参考音频token
+        prompts: torch.LongTensor,
         bert_feature: List[torch.LongTensor],
-        top_k: int = -100,
-        top_p: int = 100,
-        early_stop_num: int = -1,
-        temperature: float = 1.0,
-        repetition_penalty: float = 1.35,
-        **kwargs,
+        max_len: int,
     ):
-        if prompts is None:
-            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
-            return self.infer_panel_naive_batched(
-                x,
-                x_lens,
-                prompts,
-                bert_feature,
-                top_k=top_k,
-                top_p=top_p,
-                early_stop_num=early_stop_num,
-                temperature=temperature,
-                **kwargs,
-            )
+        """
+        The left padded input and the attention mask of the first step of `infer_panel_batch_infer`.
 
-        max_len = kwargs.get("max_len", x_lens.max())
+        Returns:
+            (xy_pos, attn_mask): (bsz, src_len, hidden_dim) and (bsz, num_head, src_len, src_len), True for masked.
+        """
         x_list = []
         for x_item, bert_item in zip(x, bert_feature):
             # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
@@ -621,21 +985,12 @@ class Text2SemanticDecoder(nn.Module):
             x_list.append(x_item)
         x: torch.Tensor = torch.stack(x_list, dim=0)
 
-        # AR Decoder
         y = prompts
-
         x_len = x.shape[1]
-        stop = False
-
-        k_cache = None
-        v_cache = None
-        ###################  first step ##########################
         assert y is not None, "Error: Prompt free is not supported batch_infer!"
-        ref_free = False
 
         y_emb = self.ar_audio_embedding(y)
         y_len = y_emb.shape[1]
-        prefix_len = y.shape[1]
         y_lens = torch.LongTensor([y_emb.shape[1]] * y_emb.shape[0]).to(x.device)
         y_pos = self.ar_audio_position(y_emb)
         xy_pos = torch.concat([x, y_pos], dim=1)
@@ -694,36 +1049,205 @@ class Text2SemanticDecoder(nn.Module):
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5, EOS],
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5,   6]]
 
+        return xy_pos, attn_mask
+
+    def _make_packed_prefill_inputs(
+        self,
+        x: List[torch.LongTensor],
+        prompts: Optional[torch.LongTensor],
+        bert_feature: List[torch.LongTensor],
+    ):
+        """
+        The unpadded inputs of `_packed_prefill`: one (x_len + y_len, hidden_dim) tensor per row and the x_len of every row.
+        """
+        y_pos = self.ar_audio_position(self.ar_audio_embedding(prompts)) if prompts is not None else None
+        xy_list = []
+        x_len_list = []
+        for i, (x_item, bert_item) in enumerate(zip(x, bert_feature)):
+            x_item = self.ar_text_embedding(x_item.unsqueeze(0))
+            x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
+            x_item = self.ar_text_position(x_item).squeeze(0)
+            x_len_list.append(x_item.shape[0])
+            xy_list.append(torch.concat([x_item, y_pos[i]], dim=0) if y_pos is not None else x_item)
+        return xy_list, x_len_list
+
+    def _packed_prefill(
+        self,
+        xy_list: List[torch.Tensor],
+        x_len_list: List[int],
+        t2s_transformer: Optional[T2STransformer] = None,
+    ):
+        """
+        The first step of the batched decode loops without padding the rows to a common length.
+
+        The rows are concatenated and attention runs on every row separately (`cu_seqlens` offsets), with the
+        (len, len) mask of that row built on demand, so the prefill cost and the mask memory follow the real
+        token count instead of bsz * src_len^2. Only the kv cache handed to the decode loop is left padded.
+
+        Returns:
+            (xy_dec, k_cache, v_cache, padding_mask): the output of the last position of every row (bsz, 1, hidden_dim),
+            the per-layer kv left padded to the longest row (bsz, src_len, hidden_dim) and (bsz, src_len), True for padding.
+        """
+        t2s_transformer = t2s_transformer if t2s_transformer is not None else self.t2s_transformer
+        device = xy_list[0].device
+        seq_lens = [item.shape[0] for item in xy_list]
+        cu_seqlens = [0]
+        for seq_len in seq_lens:
+            cu_seqlens.append(cu_seqlens[-1] + seq_len)
+
+        # x之间双向可见, y可见全部x及之前的y: 即 key > max(query, x_len - 1) 的位置被mask
+        masks = {}
+        attn_masks = []
+        for seq_len, x_len in zip(seq_lens, x_len_list):
+            if (seq_len, x_len) not in masks:
+                pos = torch.arange(seq_len, device=device)
+                masks[(seq_len, x_len)] = (pos.unsqueeze(0) > pos.clamp(min=x_len - 1).unsqueeze(1)).view(
+                    1, 1, seq_len, seq_len
+                )
+            attn_masks.append(masks[(seq_len, x_len)])
+
+        xy_dec, k_packed, v_packed = t2s_transformer.process_prompt_packed(
+            torch.concat(xy_list, dim=0), cu_seqlens, attn_masks
+        )
+        last = torch.LongTensor(cu_seqlens[1:]).to(device) - 1
+        xy_dec = xy_dec[last].unsqueeze(1)
+
+        # 左padding到最长的序列, 与 infer_panel_batch_infer 的cache布局一致
+        bsz = len(xy_list)
+        src_len = max(seq_lens)
+        index = torch.concat(
+            [torch.arange(src_len - seq_len, src_len, device=device) + i * src_len for i, seq_len in enumerate(seq_lens)]
+        )
+        padding_mask = torch.ones(bsz * src_len, dtype=torch.bool, device=device)
+        padding_mask[index] = False
+
+        def unpack(item: torch.Tensor) -> torch.Tensor:
+            return item.new_zeros(bsz * src_len, item.shape[-1]).index_copy_(0, index, item).view(bsz, src_len, -1)
+
+        k_cache = [unpack(item) for item in k_packed]
+        v_cache = [unpack(item) for item in v_packed]
+        return xy_dec, k_cache, v_cache, padding_mask.view(bsz, src_len)
+
+    def _make_loop_detector(self, batch_size: int, device, **kwargs) -> Optional[T2SLoopDetector]:
+        """
+        The `T2SLoopDetector` asked for by the `detect_loop` / `max_new_tokens` kwargs of the infer_panel_* methods.
+        """
+        max_new_tokens = kwargs.get("max_new_tokens", None)
+        detect_loop = kwargs.get("detect_loop", False)
+        if not detect_loop and max_new_tokens is None:
+            return None
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * batch_size
+        if isinstance(max_new_tokens, list):
+            max_new_tokens = torch.LongTensor(max_new_tokens)
+        return T2SLoopDetector(batch_size, device, max_new_tokens, detect_loop=detect_loop)
+
+    def _report_stop_reasons(self, reasons: List[Optional[str]], output: Optional[list] = None):
+        """
+        Log the rows stopped by the `T2SLoopDetector` and hand the per-row reasons ("eos", "early_stop",
+        "loop" or "budget") to the caller through the `stop_reasons` list kwarg, if any.
+        """
+        for i, reason in enumerate(reasons):
+            if reason in ["loop", "budget"]:
+                print(f"T2S Decoding stopped: {reason} (row {i})")
+        if output is not None:
+            output.extend(reasons)
+
+    def infer_panel_batch_infer(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        if prompts is None:
+            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
+            return self.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        # 默认不把各行padding到同一长度, 逐行计算attention; packed_prefill=False 时使用padding后的整批计算
+        packed_prefill = kwargs.get("packed_prefill", True)
+        if packed_prefill:
+            xy_list, x_len_list = self._make_packed_prefill_inputs(x, prompts, bert_feature)
+            src_len = max(item.shape[0] for item in xy_list)
+        else:
+            max_len = kwargs.get("max_len", x_lens.max())
+            xy_pos, attn_mask = self._make_batch_prefill_inputs(x, x_lens, prompts, bert_feature, max_len)
+            src_len = xy_pos.shape[1]
+
+        # AR Decoder
+        y = prompts
+        stop = False
+        ref_free = False
+        y_len = prefix_len = y.shape[1]
+
         ###### decode #####
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
+        kv_cache: T2SKVCache = None
+        token_counts = make_token_counts(y, self.vocab_size)
+        loop_detector = self._make_loop_detector(y.shape[0], y.device, **kwargs)
+        stop_reasons = [None] * y.shape[0]
+        max_decode_len = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
         for idx in tqdm(range(1500)):
             if idx == 0:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                if packed_prefill:
+                    xy_dec, k_cache, v_cache, padding_mask = self._packed_prefill(xy_list, x_len_list)
+                else:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                    # 最后一行的mask即为每个序列的padding mask, 之后的decode只需在其后追加
+                    padding_mask = attn_mask[:, 0, -1]
+                kv_cache = T2SKVCache(k_cache, v_cache, padding_mask, src_len + max_decode_len)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
+                kv_cache.reserve(1)
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, kv_cache.k_cache, kv_cache.v_cache, kv_cache.length, kv_cache.attn_mask()
+                )
+                kv_cache.advance()
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
                 logits = logits[:, :-1]
-            else:
-                attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = sample_top_k_first(
+                logits,
+                token_counts,
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                temperature=temperature,
+            )
+            update_token_counts(token_counts, samples)
 
             y = torch.concat([y, samples], dim=1)
 
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
+            # 陷入循环或超出长度预算的序列与生成到EOS的序列一样移除
+            runaway = loop_detector.update(samples) if loop_detector is not None else None
             reserved_idx_of_batch_for_y = None
-            if (self.EOS in samples[:, 0]) or (self.EOS in tokens):  ###如果生成到EOS，则停止
+            if (self.EOS in samples[:, 0]) or (self.EOS in tokens) or (runaway is not None and runaway.any()):
                 l1 = samples[:, 0] == self.EOS
                 l2 = tokens == self.EOS
                 l = l1.logical_or(l2)
+                if runaway is not None:
+                    l = l.logical_or(runaway > 0)
                 removed_idx_of_batch_for_y = torch.where(l == True)[0].tolist()
                 reserved_idx_of_batch_for_y = torch.where(l == False)[0]
                 # batch_indexs = torch.tensor(batch_idx_map, device=y.device)[removed_idx_of_batch_for_y]
@@ -731,6 +1255,9 @@ class Text2SemanticDecoder(nn.Module):
                     batch_index = batch_idx_map[i]
                     idx_list[batch_index] = idx
                     y_list[batch_index] = y[i, :-1]
+                    stop_reasons[batch_index] = (
+                        "eos" if l1[i] or l2[i] else T2SLoopDetector.REASONS[int(runaway[i])]
+                    )
 
                 batch_idx_map = [batch_idx_map[i] for i in reserved_idx_of_batch_for_y.tolist()]
 
@@ -738,11 +1265,10 @@ class Text2SemanticDecoder(nn.Module):
             if reserved_idx_of_batch_for_y is not None:
                 # index = torch.LongTensor(batch_idx_map).to(y.device)
                 y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
-                attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
-                if k_cache is not None:
-                    for i in range(len(k_cache)):
-                        k_cache[i] = torch.index_select(k_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
-                        v_cache[i] = torch.index_select(v_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
+                kv_cache.index_select(reserved_idx_of_batch_for_y)
+                token_counts = torch.index_select(token_counts, dim=0, index=reserved_idx_of_batch_for_y)
+                if loop_detector is not None:
+                    loop_detector.index_select(reserved_idx_of_batch_for_y)
 
             if (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx == 1499:
                 print("use early stop num:", early_stop_num)
@@ -751,6 +1277,7 @@ class Text2SemanticDecoder(nn.Module):
                     batch_index = batch_idx_map[i]
                     idx_list[batch_index] = idx
                     y_list[batch_index] = y[i, :-1]
+                    stop_reasons[batch_index] = "early_stop"
 
             if None not in idx_list:
                 stop = True
@@ -769,15 +1296,282 @@ class Text2SemanticDecoder(nn.Module):
             ].to(dtype=y_emb.dtype, device=y_emb.device)
 
         if None in idx_list:
-            for i in range(x.shape[0]):
+            for i in range(len(x)):
                 if idx_list[i] is None:
                     idx_list[i] = 1500 - 1  ###如果没有生成到EOS，就用最大长度代替
+        self._report_stop_reasons(stop_reasons, kwargs.get("stop_reasons", None))
 
         if ref_free:
-            return y_list, [0] * x.shape[0]
+            return y_list, [0] * len(x)
         # print(idx_list)
         return y_list, idx_list
 
+    def set_draft_model(self, draft_model: Optional[T2SDraftModel]):
+        """
+        Set (or remove with None) the draft model used by `infer_panel_speculative`.
+        """
+        self.draft_model = draft_model
+
+    def _embed_audio_tokens(self, tokens: torch.LongTensor, positions: torch.LongTensor) -> torch.Tensor:
+        """
+        Semantic tokens (bsz, n) at per-row positions (bsz, n) of the audio positional encoding.
+        """
+        y_emb = self.ar_audio_embedding(tokens)
+        pe = self.ar_audio_position.pe[0, positions.to(self.ar_audio_position.pe.device)]
+        return y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * pe.to(
+            dtype=y_emb.dtype, device=y_emb.device
+        )
+
+    def _speculative_probs(
+        self, logits: torch.Tensor, previous_tokens: torch.LongTensor, ban_eos: bool = False, **sampling_kwargs
+    ):
+        """
+        The sampling distribution of `infer_panel_batch_infer` for a batch of positions.
+        Returns the probabilities and the argmax of the repetition-penalized logits, which decides the EOS stop.
+        """
+        logits = logits.float()
+        if ban_eos:
+            logits[:, self.EOS] = -float("Inf")
+        probs = logits_to_probs(logits, previous_tokens, **sampling_kwargs)
+        return probs, torch.argmax(logits, dim=-1)
+
+    def infer_panel_speculative(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        num_draft_tokens: int = 4,
+        **kwargs,
+    ):
+        """
+        Speculative decoding with `self.draft_model`, same inputs and outputs as `infer_panel_batch_infer`.
+
+        Every round the draft proposes `num_draft_tokens` tokens one by one, then the target scores the pending
+        token and all proposals in one multi-token pass. A proposal d is accepted with probability
+        min(1, p(d) / q(d)), at the first rejection a token is sampled from max(p - q, 0), and when everything
+        is accepted one more token is sampled from p. The output therefore follows exactly the distribution of
+        `infer_panel_batch_infer` (same repetition penalty, top_k, top_p, temperature and stop rules).
+
+        Each row accepts its own number of tokens. The kv of the rejected proposals stays in both caches
+        and is masked out like padding, so no row waits for or recomputes another row.
+
+        The acceptance statistics of the call are stored in `self.speculative_stats`.
+        """
+        draft = self.draft_model
+        if draft is None or prompts is None:
+            if draft is None:
+                print("Warning: no draft model is set! switch to batch_infer")
+            return self.infer_panel_batch_infer(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                **kwargs,
+            )
+
+        k = max(int(num_draft_tokens), 1)
+        sampling_kwargs = dict(top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature)
+        xy_list, x_len_list = self._make_packed_prefill_inputs(x, prompts, bert_feature)
+        if draft.decoder is self:
+            draft_xy_list = xy_list
+        else:
+            draft_xy_list, _ = draft.decoder._make_packed_prefill_inputs(x, prompts, bert_feature)
+
+        y = prompts.long()
+        bsz = y.shape[0]
+        y_len = prefix_len = y.shape[1]
+        src_len = max(item.shape[0] for item in xy_list)
+        device = y.device
+        # 最多保留的token数, 与 infer_panel_batch_infer 的 early_stop_num 及1500步上限一致
+        limit = 1499 if early_stop_num == -1 else min(early_stop_num, 1499)
+        max_cache_len = src_len + (limit + 1) * (k + 1)
+
+        ###################  first step ##########################
+        xy_dec, k_cache, v_cache, padding_mask = self._packed_prefill(xy_list, x_len_list)
+        kv_cache = T2SKVCache(k_cache, v_cache, padding_mask, max_cache_len)
+        _, k_cache, v_cache, padding_mask = self._packed_prefill(draft_xy_list, x_len_list, draft.t2s_transformer)
+        draft_cache = T2SKVCache(k_cache, v_cache, padding_mask, max_cache_len)
+
+        probs, _ = self._speculative_probs(self.ar_predict_layer(xy_dec[:, -1]), y, True, **sampling_kwargs)
+        first_tokens = multinomial_sample_one_no_sync(probs).long()
+
+        # rows: 每行的 prompt + 已生成的token, 最后一个为尚未写入cache的 pending token
+        rows = [torch.cat([y[i], first_tokens[i]]) for i in range(bsz)]
+        n_gen = [1] * bsz
+        y_list = [None] * bsz
+        idx_list = [None] * bsz
+        stop_reasons = [None] * bsz
+        batch_idx_map = list(range(bsz))
+        if limit < 1:
+            for i in range(bsz):
+                y_list[i], idx_list[i], stop_reasons[i] = y[i], 0, "early_stop"
+        # 每行每轮接受的token数不同, 每行单独检测
+        max_new_tokens = kwargs.pop("max_new_tokens", None)
+        detectors = [
+            self._make_loop_detector(
+                1, device, max_new_tokens=max_new_tokens[i : i + 1] if max_new_tokens is not None else None, **kwargs
+            )
+            for i in range(bsz)
+        ]
+        for i, detector in enumerate(detectors):
+            if detector is not None:
+                detector.update(first_tokens[i : i + 1])
+
+        stats = {"rounds": 0, "row_passes": 0, "proposed": 0, "accepted": 0, "emitted": 0}
+        arange_k = torch.arange(k + 1, device=device)
+        while None in idx_list:
+            n = len(batch_idx_map)
+            stats["rounds"] += 1
+            stats["row_passes"] += n
+            # 重复惩罚只与出现过的token集合有关, 用每行第一个token补齐长度
+            max_row_len = max(row.shape[0] for row in rows)
+            previous = torch.stack([F.pad(row, (0, max_row_len - row.shape[0]), value=int(row[0])) for row in rows])
+            positions = torch.LongTensor([y_len + g - 1 for g in n_gen]).to(device).unsqueeze(1) + arange_k
+            start = kv_cache.length
+            draft_start = draft_cache.length
+
+            ####### draft: 逐个提出k个token, 最后一个草稿token也写入cache, 使两个cache的位置一一对应
+            tokens = torch.stack([row[-1:] for row in rows])
+            draft_probs = []
+            for m in range(k + 1):
+                draft_cache.reserve(1)
+                draft_dec = draft.t2s_transformer.decode_next_token_static(
+                    draft.decoder._embed_audio_tokens(tokens[:, -1:], positions[:, m : m + 1]),
+                    draft_cache.k_cache,
+                    draft_cache.v_cache,
+                    draft_cache.length,
+                    draft_cache.attn_mask(),
+                )
+                draft_cache.advance()
+                if m == k:
+                    break
+                q, _ = self._speculative_probs(
+                    draft.decoder.ar_predict_layer(draft_dec[:, -1]),
+                    torch.cat([previous, tokens[:, 1:]], dim=1),
+                    **sampling_kwargs,
+                )
+                draft_probs.append(q)
+                tokens = torch.cat([tokens, multinomial_sample_one_no_sync(q).long()], dim=1)
+
+            ####### target: 一次前向同时验证 pending token 与 k 个草稿token
+            kv_cache.reserve(k + 1)
+            xy_dec = self.t2s_transformer.decode_next_token_static(
+                self._embed_audio_tokens(tokens, positions),
+                kv_cache.k_cache,
+                kv_cache.v_cache,
+                kv_cache.length,
+                kv_cache.attn_mask(k + 1),
+            )
+            kv_cache.advance(k + 1)
+            # 第j个位置的历史token为 previous + 前j个草稿token
+            candidates = torch.cat([previous, tokens[:, 1:]], dim=1)
+            visible = torch.arange(candidates.shape[1], device=device).unsqueeze(0) < (
+                previous.shape[1] + arange_k
+            ).unsqueeze(1)
+            history = torch.where(visible.unsqueeze(0), candidates.unsqueeze(1), previous[:, :1].unsqueeze(1))
+            p, argmax = self._speculative_probs(
+                self.ar_predict_layer(xy_dec).flatten(0, 1), history.flatten(0, 1), **sampling_kwargs
+            )
+            p = p.view(n, k + 1, -1)
+            argmax = argmax.view(n, k + 1).tolist()
+
+            drafts = tokens[:, 1:]
+            q = torch.stack(draft_probs, dim=1)
+            p_d = p[:, :k].gather(-1, drafts.unsqueeze(-1)).squeeze(-1)
+            q_d = q.gather(-1, drafts.unsqueeze(-1)).squeeze(-1)
+            # 以 min(1, p/q) 的概率接受
+            accepted_mask = (torch.rand_like(p_d) * q_d < p_d).tolist()
+            drafts_list = drafts.tolist()
+
+            valid_lens = []
+            finished = []
+            for i in range(n):
+                accepted = 0
+                stop = False
+                reason = "eos"
+                for j in range(k + 1):
+                    # 第j个位置预测的是第 n_gen + j + 1 个token
+                    if argmax[i][j] == self.EOS or n_gen[i] + j + 1 > limit:
+                        stop = True
+                        if argmax[i][j] != self.EOS:
+                            reason = "early_stop"
+                        break
+                    if j < k and accepted_mask[i][j]:
+                        if drafts_list[i][j] == self.EOS:
+                            stop = True
+                            break
+                        accepted += 1
+                        continue
+                    if j < k:
+                        residual = (p[i, j] - q[i, j]).clamp_(min=0)
+                        dist = residual if residual.sum() > 0 else p[i, j]
+                    else:
+                        dist = p[i, k]
+                    new_token = multinomial_sample_one_no_sync(dist.unsqueeze(0)).long()[0]
+                    stop = int(new_token) == self.EOS
+                    break
+
+                stats["proposed"] += k
+                stats["accepted"] += accepted
+                batch_index = batch_idx_map[i]
+                new_tokens = drafts[i, :accepted] if stop else torch.cat([drafts[i, :accepted], new_token])
+                if not stop and detectors[batch_index] is not None:
+                    for j in range(new_tokens.shape[0]):
+                        runaway = int(detectors[batch_index].update(new_tokens[j : j + 1].unsqueeze(0))[0])
+                        if runaway:
+                            stop = True
+                            reason = T2SLoopDetector.REASONS[runaway]
+                            new_tokens = new_tokens[:j]
+                            break
+                rows[i] = torch.cat([rows[i], new_tokens])
+                stats["emitted"] += new_tokens.shape[0]
+                if stop:
+                    idx_list[batch_index] = n_gen[i] + new_tokens.shape[0]
+                    y_list[batch_index] = rows[i]
+                    stop_reasons[batch_index] = reason
+                    finished.append(i)
+                else:
+                    n_gen[i] += new_tokens.shape[0]
+                valid_lens.append(1 + accepted)
+
+            valid_lens = torch.LongTensor(valid_lens)
+            kv_cache.mask_tail(start, valid_lens)
+            draft_cache.mask_tail(draft_start, valid_lens)
+
+            ####### 移除batch中已经生成完毕的序列
+            if finished:
+                keep = [i for i in range(n) if i not in finished]
+                if len(keep) == 0:
+                    break
+                index = torch.LongTensor(keep).to(device)
+                kv_cache.index_select(index)
+                draft_cache.index_select(index)
+                rows = [rows[i] for i in keep]
+                n_gen = [n_gen[i] for i in keep]
+                batch_idx_map = [batch_idx_map[i] for i in keep]
+
+        stats["acceptance_rate"] = stats["accepted"] / max(stats["proposed"], 1)
+        stats["tokens_per_pass"] = stats["emitted"] / max(stats["row_passes"], 1)
+        self.speculative_stats = stats
+        print(
+            f"T2S speculative decoding [{prefix_len} -> {prefix_len + max(idx_list)}]: "
+            f"{stats['accepted']}/{stats['proposed']} draft tokens accepted ({stats['acceptance_rate']:.1%}), "
+            f"{stats['tokens_per_pass']:.2f} tokens per target pass"
+        )
+        self._report_stop_reasons(stop_reasons, kwargs.get("stop_reasons", None))
+        return y_list, idx_list
+
     def infer_panel_naive_batched(
         self,
         x: List[torch.LongTensor],  #####全部文本token
@@ -793,6 +1587,7 @@ class Text2SemanticDecoder(nn.Module):
     ):
         y_list = []
         idx_list = []
+        max_new_tokens = kwargs.pop("max_new_tokens", None)
         for i in range(len(x)):
             y, idx = self.infer_panel_naive(
                 x[i].unsqueeze(0),
@@ -804,6 +1599,7 @@ class Text2SemanticDecoder(nn.Module):
                 early_stop_num,
                 temperature,
                 repetition_penalty,
+                max_new_tokens=max_new_tokens[i : i + 1] if max_new_tokens is not None else None,
                 **kwargs,
             )
             y_list.append(y[0])
@@ -875,11 +1671,21 @@ class Text2SemanticDecoder(nn.Module):
             .to(device=x.device, dtype=torch.bool)
         )
 
+        kv_cache: T2SKVCache = None
+        token_counts = make_token_counts(y, self.vocab_size)
+        loop_detector = self._make_loop_detector(bsz, y.device, **kwargs)
+        stop_reason = "early_stop"
+        max_decode_len = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
         for idx in tqdm(range(1500)):
             if xy_attn_mask is not None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                kv_cache = T2SKVCache(k_cache, v_cache, None, src_len + max_decode_len)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
+                kv_cache.reserve(1)
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, kv_cache.k_cache, kv_cache.v_cache, kv_cache.length
+                )
+                kv_cache.advance()
 
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
@@ -888,9 +1694,15 @@ class Text2SemanticDecoder(nn.Module):
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1]
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = sample_top_k_first(
+                logits,
+                token_counts,
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                temperature=temperature,
+            )
+            update_token_counts(token_counts, samples)
 
             y = torch.concat([y, samples], dim=1)
 
@@ -900,6 +1712,12 @@ class Text2SemanticDecoder(nn.Module):
 
             if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
                 stop = True
+                stop_reason = "eos"
+            elif loop_detector is not None:
+                runaway = int(loop_detector.update(samples)[0])
+                if runaway:
+                    stop = True
+                    stop_reason = T2SLoopDetector.REASONS[runaway]
             if stop:
                 if y.shape[1] == 0:
                     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
@@ -913,10 +1731,123 @@ class Text2SemanticDecoder(nn.Module):
                 :, y_len + idx
             ].to(dtype=y_emb.dtype, device=y_emb.device)
 
+        self._report_stop_reasons([stop_reason], kwargs.get("stop_reasons", None))
         if ref_free:
             return y[:, :-1], 0
         return y[:, :-1], idx
 
+    def infer_panel_naive_streaming(
+        self,
+        x: torch.LongTensor,  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        chunk_size: int = 24,
+        **kwargs,
+    ):
+        """
+        Same decoding as `infer_panel_naive` (batch size 1), but yields the generated semantic tokens
+        every `chunk_size` tokens instead of returning them at the end.
+
+        Yields:
+            (tokens, is_last): tokens is a LongTensor of shape [1, n] without the prompt and the EOS token,
+            is_last is True for the final chunk (which may be empty).
+        """
+        x = self.ar_text_embedding(x)
+        x = x + self.bert_proj(bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+
+        y = prompts
+        x_len = x.shape[1]
+        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
+
+        if y is not None:
+            y_len = y.shape[1]
+            xy_pos = torch.concat([x, self.ar_audio_position(self.ar_audio_embedding(y))], dim=1)
+        else:
+            y_len = 0
+            xy_pos = x
+            y = torch.zeros(x.shape[0], 0, dtype=torch.int, device=x.device)
+        prefix_len = y_len
+
+        src_len = x_len + y_len
+        x_attn_mask_pad = F.pad(x_attn_mask, (0, y_len), value=True)
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = (
+            torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
+            .unsqueeze(0)
+            .expand(self.num_head, -1, -1)
+            .view(1, self.num_head, src_len, src_len)
+            .to(device=x.device, dtype=torch.bool)
+        )
+
+        kv_cache: T2SKVCache = None
+        token_counts = make_token_counts(y, self.vocab_size)
+        loop_detector = self._make_loop_detector(1, y.device, **kwargs)
+        max_decode_len = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
+        # 采样出的token要等确认不是本句最后一步后才能输出
+        emitted = prefix_len
+        for idx in range(1500):
+            if xy_attn_mask is not None:
+                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                kv_cache = T2SKVCache(k_cache, v_cache, None, src_len + max_decode_len)
+                xy_attn_mask = None
+            else:
+                kv_cache.reserve(1)
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, kv_cache.k_cache, kv_cache.v_cache, kv_cache.length
+                )
+                kv_cache.advance()
+
+            logits = self.ar_predict_layer(xy_dec[:, -1])
+            if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
+                logits = logits[:, :-1]
+
+            samples = sample_top_k_first(
+                logits,
+                token_counts,
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                temperature=temperature,
+            )
+            update_token_counts(token_counts, samples)
+            y = torch.concat([y, samples], dim=1)
+
+            stop_reason = None
+            if (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx == 1499:
+                print("use early stop num:", early_stop_num)
+                stop_reason = "early_stop"
+            if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
+                stop_reason = "eos"
+            elif loop_detector is not None:
+                runaway = int(loop_detector.update(samples)[0])
+                if runaway:
+                    stop_reason = T2SLoopDetector.REASONS[runaway]
+            if stop_reason is not None:
+                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+                self._report_stop_reasons([stop_reason], kwargs.get("stop_reasons", None))
+                yield y[:, emitted:-1], True
+                return
+
+            if y.shape[1] - emitted >= chunk_size:
+                yield y[:, emitted:], False
+                emitted = y.shape[1]
+
+            y_emb = self.ar_audio_embedding(y[:, -1:])
+            xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[
+                :, y_len + idx
+            ].to(dtype=y_emb.dtype, device=y_emb.device)
+
     def infer_panel(
         self,
         x: torch.LongTensor,  #####全部文本token
@@ -280,3 +280,70 @@ def make_reject_y(y_o, y_lens):
     reject_y_lens = torch.tensor(reject_y_lens, device=y_lens.device)
 
     return reject_y, reject_y_lens
+
+
+def make_token_counts(previous_tokens: torch.Tensor, vocab_size: int) -> torch.Tensor:
+    """
+    Per-row occurrence counts (bsz, vocab_size) of the tokens in `previous_tokens` (bsz, n).
+    Built once from the prompt, then kept up to date with `update_token_counts`.
+    """
+    token_counts = torch.zeros(
+        (previous_tokens.shape[0], vocab_size), dtype=torch.int32, device=previous_tokens.device
+    )
+    return update_token_counts(token_counts, previous_tokens)
+
+
+def update_token_counts(token_counts: torch.Tensor, tokens: torch.Tensor) -> torch.Tensor:
+    """
+    Add the new tokens (bsz, n) to the counts in place.
+    """
+    tokens = tokens.long()
+    return token_counts.scatter_add_(1, tokens, torch.ones_like(tokens, dtype=token_counts.dtype))
+
+
+def apply_repetition_penalty(logits: torch.Tensor, token_counts: torch.Tensor, repetition_penalty: float):
+    """
+    Same penalty as `logits_to_probs`, but from the counts instead of the history, O(vocab) per step.
+    Modifies `logits` in place like `logits_to_probs` does, the callers take the argmax of the penalized logits.
+    """
+    if repetition_penalty == 1.0:
+        return logits
+    seen = token_counts[:, : logits.shape[1]] > 0
+    penalized = torch.where(logits < 0, logits * repetition_penalty, logits / repetition_penalty)
+    return logits.copy_(torch.where(seen, penalized, logits))
+
+
+def sample_top_k_first(
+    logits: torch.Tensor,
+    token_counts: Optional[torch.Tensor] = None,
+    temperature: float = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+    repetition_penalty: float = 1.0,
+) -> torch.Tensor:
+    """
+    Draws from the same distribution as `sample`, without sorting the vocabulary or touching the history.
+
+    `logits_to_probs` keeps the tokens that are both in the top-p nucleus and among the top-k, so the top-k
+    is taken first and the nucleus is cut on the k survivors only, with their probabilities normalized over
+    the whole vocabulary. The repetition penalty reads `token_counts` (see `make_token_counts`).
+
+    Returns:
+        idx_next (bsz, 1) int, the sampled tokens. The caller updates `token_counts` with them.
+    """
+    if token_counts is not None:
+        apply_repetition_penalty(logits, token_counts, repetition_penalty)
+
+    vocab_size = logits.shape[1]
+    k = vocab_size if top_k is None or top_k <= 0 else min(top_k, vocab_size)
+    values, indices = torch.topk(logits, k)
+
+    if top_p is not None and top_p < 1.0:
+        cum_probs = torch.cumsum(torch.exp(values - torch.logsumexp(logits, dim=-1, keepdim=True)), dim=-1)
+        to_remove = cum_probs > top_p
+        to_remove[:, 0] = False  # keep at least one option
+        values = values.masked_fill(to_remove, -float("Inf"))
+
+    probs = torch.nn.functional.softmax(values / max(temperature, 1e-5), dim=-1)
+    choice = multinomial_sample_one_no_sync(probs)
+    return torch.gather(indices, 1, choice.long()).to(dtype=torch.int)
@@ -0,0 +1,89 @@
+import queue
+import threading
+from typing import Callable, Iterable
+
+import torch
+
+_END = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class BackgroundStage:
+    """
+    One stage of a producer/consumer pipeline: a daemon thread applies `fn` to every item of `items`
+    (which may itself be another stage) and puts the results, in order, into a queue of at most
+    `maxsize` items, so the stage runs ahead of its consumer by that many items and no further.
+
+    Iterating the stage yields the results; an exception raised by `fn` is re-raised in the consumer.
+    `close()` stops the thread after the item it is working on, e.g. when the consumer gives up early,
+    `close(wait=True)` also waits for it (and for the upstream stages).
+    `fn` runs under `torch.no_grad()`, like `TTS.run` (the grad mode is per thread).
+
+    Args:
+        fn (Callable): applied to every item, a result of None is skipped.
+        items (Iterable): the input items.
+        maxsize (int): the number of finished results that may wait for the consumer.
+        name (str): the name of the thread.
+    """
+
+    def __init__(self, fn: Callable, items: Iterable, maxsize: int = 2, name: str = "BackgroundStage"):
+        self.fn = fn
+        self.items = items
+        self.queue: queue.Queue = queue.Queue(maxsize=max(maxsize, 1))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            with torch.no_grad():
+                for item in self.items:
+                    if self.stopped.is_set():
+                        break
+                    result = self.fn(item)
+                    if result is not None and not self._put(result):
+                        break
+        except BaseException as e:
+            self._put(_StageError(e))
+        finally:
+            self._put(_END)
+            if isinstance(self.items, BackgroundStage):
+                self.items.close()
+
+    def __iter__(self):
+        try:
+            while True:
+                result = self.queue.get()
+                if result is _END:
+                    return
+                if isinstance(result, _StageError):
+                    raise result.error
+                yield result
+        finally:
+            self.close()
+
+    def close(self, wait: bool = False):
+        self.stopped.set()
+        # 取走已完成的结果, 让阻塞在put上的线程退出
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        if wait and self.thread is not threading.current_thread():
+            self.thread.join()
+            if isinstance(self.items, BackgroundStage):
+                self.items.close(wait=True)
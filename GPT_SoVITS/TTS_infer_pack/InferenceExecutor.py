@@ -0,0 +1,220 @@
+import asyncio
+import queue
+import threading
+import traceback
+from typing import Callable, List
+
+
+class ExecutorBusyError(Exception):
+    pass
+
+
+class ExecutorClosedError(Exception):
+    pass
+
+
+_END = object()
+
+
+class _PipelineGate:
+    """
+    Readers-writer lock of one pipeline: jobs run on it concurrently (continuous batching),
+    `run_on_all` waits for the running jobs to finish and holds new ones back while it changes the pipeline.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.running = 0
+        self.exclusive = False
+        self.waiting_exclusive = 0
+
+    def acquire_shared(self):
+        with self.cond:
+            while self.exclusive or self.waiting_exclusive > 0:
+                self.cond.wait()
+            self.running += 1
+
+    def release_shared(self):
+        with self.cond:
+            self.running -= 1
+            self.cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self.cond:
+            self.waiting_exclusive += 1
+            try:
+                while self.exclusive or self.running > 0:
+                    self.cond.wait()
+            finally:
+                self.waiting_exclusive -= 1
+            self.exclusive = True
+
+    def release_exclusive(self):
+        with self.cond:
+            self.exclusive = False
+            self.cond.notify_all()
+
+
+class InferenceJob:
+    """
+    One `TTS.run` call. The worker thread pushes every `(sr, audio)` the pipeline yields into an
+    asyncio queue owned by the event loop, the request handler consumes it with `async for`.
+    """
+
+    def __init__(self, req: dict, loop: asyncio.AbstractEventLoop):
+        self.req = req
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stop the synthesis at the next fragment, e.g. when the client has disconnected.
+        """
+        self.cancelled.set()
+
+    def _emit(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭, 没有人再消费结果
+            self.cancelled.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is _END:
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    async def result(self):
+        """
+        The first item yielded by `TTS.run`, i.e. the whole audio when `return_fragment` is False.
+        """
+        try:
+            return await self.__anext__()
+        finally:
+            self.cancel()
+
+
+class InferenceExecutor:
+    """
+    Runs `TTS.run` off the event loop.
+
+    Every pipeline (model replica) is served by `workers_per_replica` dedicated threads, all of them
+    take jobs from one bounded queue. `submit` never blocks: when `max_queue_size` jobs are already
+    waiting it raises `ExecutorBusyError` (HTTP 429), after `shutdown` it raises `ExecutorClosedError` (HTTP 503).
+    A job whose request names a `model` runs on that pipeline of the `registry` instead of the worker's replica.
+
+    Args:
+        pipelines (List[TTS]): the model replicas.
+        max_queue_size (int): the maximum number of jobs waiting for a free worker.
+        workers_per_replica (int): more than 1 only makes sense with continuous batching enabled.
+        registry (ModelRegistry): the named models, optional.
+    """
+
+    def __init__(self, pipelines: List, max_queue_size: int = 8, workers_per_replica: int = 1, registry=None):
+        self.pipelines = pipelines
+        self.registry = registry
+        self.jobs: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.running = True
+        self.busy_workers = 0
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        self.gates = {id(pipeline): _PipelineGate() for pipeline in pipelines}
+        for i, pipeline in enumerate(pipelines):
+            for j in range(workers_per_replica):
+                thread = threading.Thread(
+                    target=self._worker, args=(pipeline,), name=f"TTSWorker-{i}-{j}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, req: dict) -> InferenceJob:
+        """
+        Must be called from the event loop thread.
+        """
+        if not self.running:
+            raise ExecutorClosedError("inference executor has been shut down")
+        job = InferenceJob(req, asyncio.get_running_loop())
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            raise ExecutorBusyError(f"{self.jobs.maxsize} requests are already waiting")
+        return job
+
+    def run_on_all(self, fn: Callable):
+        """
+        Apply `fn(pipeline)` to every replica, e.g. to switch weights. Blocking.
+        Each replica is changed only once the jobs running on it have finished, its queued jobs wait meanwhile.
+        """
+        for pipeline in self.pipelines:
+            gate = self.gates[id(pipeline)]
+            gate.acquire_exclusive()
+            try:
+                fn(pipeline)
+            finally:
+                gate.release_exclusive()
+
+    def stats(self) -> dict:
+        with self.lock:
+            busy_workers = self.busy_workers
+        return {
+            "replicas": len(self.pipelines),
+            "workers": len(self.threads),
+            "busy_workers": busy_workers,
+            "queued": self.jobs.qsize(),
+            "max_queue_size": self.jobs.maxsize,
+        }
+
+    def shutdown(self):
+        self.running = False
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _worker(self, pipeline):
+        while True:
+            job: InferenceJob = self.jobs.get()
+            if job is None:
+                return
+            if job.cancelled.is_set():
+                job._emit(_END)
+                continue
+
+            with self.lock:
+                self.busy_workers += 1
+            try:
+                model = job.req.get("model", None)
+                if model in [None, ""] or self.registry is None:
+                    gate = self.gates[id(pipeline)]
+                    gate.acquire_shared()
+                    try:
+                        self._run_job(pipeline, job)
+                    finally:
+                        gate.release_shared()
+                else:
+                    with self.registry.acquire(model) as model_pipeline:
+                        self._run_job(model_pipeline, job)
+            except Exception as e:
+                traceback.print_exc()
+                job._emit(e)
+            finally:
+                job._emit(_END)
+                with self.lock:
+                    self.busy_workers -= 1
+
+    def _run_job(self, pipeline, job: InferenceJob):
+        tts_generator = pipeline.run(job.req)
+        try:
+            for item in tts_generator:
+                job._emit(item)
+                if job.cancelled.is_set():
+                    break
+        finally:
+            tts_generator.close()
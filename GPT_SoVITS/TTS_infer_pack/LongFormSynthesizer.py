@@ -0,0 +1,238 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+import torch
+
+from process_ckpt import export_inference_bundle, get_sovits_version_from_path_fast, is_inference_bundle
+from TTS_infer_pack.TTS import TTS, TTS_Config
+from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+
+thread_env_names = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+# 工作进程内的模型, 由 _init_worker 创建
+_worker_tts: TTS = None
+
+
+def _init_worker(configs: dict, num_threads: int):
+    global _worker_tts
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 已经有并行任务运行过, 只能在此之前设置
+        pass
+    tts_config = TTS_Config(configs)
+    tts_config.configs_path = None
+    _worker_tts = TTS(tts_config)
+
+
+def _synthesize_shard(task: Tuple[int, dict]) -> Tuple[int, int, np.ndarray, float]:
+    index, inputs = task
+    t0 = time.perf_counter()
+    sr, audio = None, None
+    # 消费完整个生成器, 让 run() 的 finally 在本任务内执行
+    for sr, audio in _worker_tts.run(inputs):
+        pass
+    return index, sr, audio, time.perf_counter() - t0
+
+
+@contextmanager
+def _thread_env(num_threads: int):
+    # 子进程在导入torch之前读取这些环境变量, 创建进程池时临时设置
+    old = {name: os.environ.get(name) for name in thread_env_names}
+    for name in thread_env_names:
+        os.environ[name] = str(num_threads)
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class LongFormSynthesizer:
+    """
+    Long-form job mode for CPU nodes: the sentences of a long text are segmented once, grouped into shards of
+    `sentences_per_shard` consecutive sentences and synthesized by a pool of worker processes, each with its own
+    `TTS` pipeline and `threads_per_worker` intra-op threads. A single pipeline uses many threads poorly on the
+    small per-token matmuls of the T2S decoder, several processes with a few threads each scale much better.
+
+    The shards are reassembled in text order; every sentence is followed by `fragment_interval` seconds of silence,
+    exactly like a single `TTS.run` call over the whole text.
+
+    With `share_weights`, GPT / SoVITS weights that are not inference bundles yet are converted once into `bundle_dir`
+    (see `process_ckpt.export_inference_bundle`) in the dtype the workers run in (fp32 on CPU). Bundles are
+    memory-mapped and need no conversion when loaded, so all workers share one copy of the weights in the page cache.
+    BERT and CNHuBERT are still loaded by every worker.
+
+    Args:
+        configs: a `TTS_Config`, a config dict or the path of a tts_infer.yaml, the default config if None.
+        num_workers (int): the number of worker processes, the number of cores / threads_per_worker by default.
+        threads_per_worker (int): the torch intra-op threads of every worker.
+        share_weights (bool): convert the weights into memory-mapped inference bundles.
+        bundle_dir (str): where to keep the converted bundles.
+
+    Example:
+        with LongFormSynthesizer("GPT_SoVITS/configs/tts_infer.yaml", num_workers=8) as synthesizer:
+            sr, audio = synthesizer.synthesize(chapter, "zh", "ref.wav", "参考文本", "zh")
+    """
+
+    def __init__(
+        self,
+        configs: Union[dict, str, TTS_Config] = None,
+        num_workers: int = None,
+        threads_per_worker: int = 2,
+        share_weights: bool = True,
+        bundle_dir: str = "GPT_SoVITS/pretrained_models/inference_bundles",
+    ):
+        self.configs: TTS_Config = configs if isinstance(configs, TTS_Config) else TTS_Config(configs)
+        self.threads_per_worker = max(int(threads_per_worker), 1)
+        cpu_count = os.cpu_count() or 1
+        if num_workers is None:
+            num_workers = cpu_count // self.threads_per_worker
+        self.num_workers = max(int(num_workers), 1)
+        self.share_weights = share_weights
+        self.bundle_dir = bundle_dir
+        # 只用于切句, 不需要BERT
+        self.text_preprocessor = TextPreprocessor(None, None, torch.device("cpu"))
+        self.pool = None
+
+    def _bundle_path(self, path: str, kind: str) -> str:
+        if is_inference_bundle(path):
+            return path
+        # 以模型运行时的dtype导出, 加载时无需转换, 各进程的参数才会直接引用page cache中的同一份权重
+        if self.configs.is_half and str(self.configs.device) != "cpu":
+            dtype, dtype_name = torch.float16, "fp16"
+        else:
+            dtype, dtype_name = torch.float32, "fp32"
+        stat = os.stat(path)
+        digest = hashlib.sha1(
+            f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime}:{dtype_name}".encode("utf-8")
+        ).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(path))[0]
+        bundle_path = os.path.join(self.bundle_dir, f"{name}-{dtype_name}-{digest}.safetensors")
+        if not os.path.exists(bundle_path):
+            os.makedirs(self.bundle_dir, exist_ok=True)
+            base_sovits_path = None
+            if kind == "sovits":
+                _, model_version, if_lora_v3 = get_sovits_version_from_path_fast(path)
+                if if_lora_v3:
+                    base_sovits_path = self.configs.default_configs[model_version]["vits_weights_path"]
+            tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+            export_inference_bundle(path, tmp_path, kind=kind, dtype=dtype, base_sovits_path=base_sovits_path)
+            os.replace(tmp_path, bundle_path)
+            print(f"LongFormSynthesizer: {path} -> {bundle_path}")
+        return bundle_path
+
+    def _worker_configs(self) -> dict:
+        custom = dict(self.configs.update_configs())
+        if self.share_weights:
+            custom["t2s_weights_path"] = self._bundle_path(custom["t2s_weights_path"], "gpt")
+            custom["vits_weights_path"] = self._bundle_path(custom["vits_weights_path"], "sovits")
+        version = self.configs.version if self.configs.version in ["v1", "v2", "v3", "v4"] else "v2"
+        return {"version": version, "custom": custom}
+
+    def start(self) -> "LongFormSynthesizer":
+        """
+        Start the workers, every worker loads its models before it takes the first shard.
+        """
+        if self.pool is not None:
+            return self
+        configs = self._worker_configs()
+        # fork后的子进程继承父进程的OpenMP线程池状态, 可能死锁, 统一使用spawn
+        context = multiprocessing.get_context("spawn")
+        with _thread_env(self.threads_per_worker):
+            self.pool = context.Pool(
+                self.num_workers, initializer=_init_worker, initargs=(configs, self.threads_per_worker)
+            )
+        print(f"LongFormSynthesizer: {self.num_workers} workers x {self.threads_per_worker} threads")
+        return self
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self) -> "LongFormSynthesizer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def segment(self, text: str, text_lang: str, text_split_method: str = "cut5") -> List[str]:
+        text = self.text_preprocessor.replace_consecutive_punctuation(text)
+        return self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
+
+    def synthesize_iter(
+        self,
+        text: str,
+        text_lang: str,
+        ref_audio_path: str,
+        prompt_text: str = "",
+        prompt_lang: str = "auto",
+        text_split_method: str = "cut5",
+        sentences_per_shard: int = 4,
+        **kwargs,
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Yield (sampling rate, int16 audio) for every shard in text order, as soon as it and all the shards before it are done.
+
+        Args:
+            sentences_per_shard (int): the number of consecutive sentences synthesized by one worker task,
+                smaller shards balance the load better, larger ones batch better inside the worker.
+            kwargs: any other input of `TTS.run` (top_k, batch_size, speed_factor, fragment_interval, seed, ...),
+                the streaming inputs (return_fragment, stream_chunk_size) are ignored.
+        """
+        sentences = self.segment(text, text_lang, text_split_method)
+        if len(sentences) == 0:
+            return
+        sentences_per_shard = max(int(sentences_per_shard), 1)
+        shards = [sentences[i : i + sentences_per_shard] for i in range(0, len(sentences), sentences_per_shard)]
+
+        base_inputs = dict(kwargs)
+        base_inputs.update(
+            {
+                "text_lang": text_lang,
+                "ref_audio_path": ref_audio_path,
+                "prompt_text": prompt_text,
+                "prompt_lang": prompt_lang,
+                # 已经切好句, 工作进程按行切分即可
+                "text_split_method": "cut0",
+                "return_fragment": False,
+                "stream_chunk_size": 0,
+                "pipelined": False,
+            }
+        )
+        tasks = [(i, dict(base_inputs, text="\n".join(shard))) for i, shard in enumerate(shards)]
+
+        self.start()
+        t0 = time.perf_counter()
+        busy = 0.0
+        # imap按任务顺序返回结果, 先完成的后续分片在内部排队等待
+        for index, sr, audio, elapsed in self.pool.imap(_synthesize_shard, tasks, chunksize=1):
+            busy += elapsed
+            yield sr, audio
+        wall = time.perf_counter() - t0
+        print(
+            f"LongFormSynthesizer: {len(sentences)} sentences in {len(shards)} shards, "
+            f"{wall:.3f}s wall, {busy:.3f}s worker time, {busy / max(wall, 1e-6):.2f}x parallelism"
+        )
+
+    def synthesize(self, *args, **kwargs) -> Tuple[int, np.ndarray]:
+        """
+        `synthesize_iter` with the shards concatenated, returns the whole audio.
+        """
+        sr, chunks = 16000, []
+        for sr, audio in self.synthesize_iter(*args, **kwargs):
+            chunks.append(audio)
+        if len(chunks) == 0:
+            return sr, np.zeros(int(16000), dtype=np.int16)
+        return sr, np.concatenate(chunks)
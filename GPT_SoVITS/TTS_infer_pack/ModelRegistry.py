@@ -0,0 +1,236 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import torch
+
+from .TTS import TTS, TTS_Config
+
+
+class ModelNotFoundError(KeyError):
+    pass
+
+
+def module_nbytes(module: torch.nn.Module) -> int:
+    if module is None:
+        return 0
+    nbytes = sum(p.numel() * p.element_size() for p in module.parameters())
+    return nbytes + sum(b.numel() * b.element_size() for b in module.buffers())
+
+
+class ModelEntry:
+    def __init__(self, name: str, t2s_weights_path: str, vits_weights_path: str, concurrency: int):
+        self.name = name
+        self.t2s_weights_path = t2s_weights_path
+        self.vits_weights_path = vits_weights_path
+        self.pipeline: TTS = None
+        self.nbytes: int = 0
+        self.in_use: int = 0
+        self.last_used: float = 0.0
+        self.load_lock = threading.Lock()
+        # TTS.run 不可重入, 同一模型的请求依次执行 (开启连续批处理时可以并发)
+        self.slots = threading.Semaphore(concurrency)
+
+    def estimate_nbytes(self) -> int:
+        # 未加载过时以权重文件大小估计, 用于加载前腾出空间
+        if self.nbytes > 0:
+            return self.nbytes
+        return sum(os.path.getsize(path) for path in [self.t2s_weights_path, self.vits_weights_path] if os.path.exists(path))
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "t2s_weights_path": self.t2s_weights_path,
+            "vits_weights_path": self.vits_weights_path,
+            "loaded": self.pipeline is not None,
+            "version": self.pipeline.configs.version if self.pipeline is not None else None,
+            "memory_mb": round(self.nbytes / 2**20, 1),
+            "in_use": self.in_use,
+        }
+
+
+class ModelRegistry:
+    """
+    Named GPT/SoVITS weight pairs, each with its own `TTS` pipeline. At most `max_models` pairs stay loaded
+    and their total parameter memory stays under `memory_budget_mb`, the least recently used pairs are
+    unloaded first. Pipelines in use are never unloaded, the budget can be exceeded temporarily instead.
+
+    All pipelines share BERT, CNHuBERT, the vocoders and the caches of `shared_models` (see `TTS.__init__`),
+    so a resident voice costs only its GPT/SoVITS pair and switching voices is a dictionary lookup.
+
+    Args:
+        configs (TTS_Config): the base config, device / precision / BERT and CNHuBERT paths are used for every model.
+        shared_models (dict): usually `TTS.shared_models` of the default pipeline.
+        max_models (int): the maximum number of resident pairs.
+        memory_budget_mb (float): the maximum parameter memory of the resident pairs, 0 for no limit.
+        concurrency (int): the number of `run()` calls allowed on one pipeline at a time.
+        on_load (Callable[[TTS], None]): applied to every newly loaded pipeline, e.g. to enable continuous batching.
+    """
+
+    def __init__(
+        self,
+        configs: TTS_Config,
+        shared_models: dict = None,
+        max_models: int = 4,
+        memory_budget_mb: float = 0,
+        concurrency: int = 1,
+        on_load: Callable = None,
+    ):
+        self.configs = configs
+        self.shared_models: dict = shared_models if shared_models is not None else {}
+        self.max_models = max(max_models, 1)
+        self.memory_budget = int(memory_budget_mb * 2**20)
+        self.concurrency = max(concurrency, 1)
+        self.on_load = on_load
+        self.entries: Dict[str, ModelEntry] = {}
+        # 已加载的模型, 按最近使用排序, 最后一个为最近使用
+        self.resident: "OrderedDict[str, ModelEntry]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, name: str, t2s_weights_path: str, vits_weights_path: str, preload: bool = False):
+        for path in [t2s_weights_path, vits_weights_path]:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} does not exist")
+        with self.lock:
+            old = self.entries.get(name)
+            if old is not None and (old.t2s_weights_path, old.vits_weights_path) == (t2s_weights_path, vits_weights_path):
+                entry = old
+            else:
+                entry = ModelEntry(name, t2s_weights_path, vits_weights_path, self.concurrency)
+                self.entries[name] = entry
+                # 同名旧模型不再接受新请求, 正在使用的请求结束后随引用释放
+                if old is not None:
+                    self.resident.pop(name, None)
+        if preload:
+            self.get(name)
+
+    def register_from_dict(self, models: dict, preload: bool = False):
+        """
+        models: {name: {"t2s_weights_path": ..., "vits_weights_path": ...}}
+        """
+        for name, item in models.items():
+            self.register(name, item["t2s_weights_path"], item["vits_weights_path"], preload=preload)
+
+    def unregister(self, name: str):
+        with self.lock:
+            if self.entries.pop(name, None) is None:
+                raise ModelNotFoundError(name)
+            self.resident.pop(name, None)
+        gc.collect()
+        self._empty_cache()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def list_models(self) -> List[dict]:
+        with self.lock:
+            return [entry.info() for entry in self.entries.values()]
+
+    def resident_nbytes(self) -> int:
+        with self.lock:
+            return sum(entry.nbytes for entry in self.resident.values())
+
+    def get(self, name: str) -> TTS:
+        """
+        The pipeline of `name`, loaded if needed. It may be unloaded at any time afterwards,
+        use `acquire` to keep it resident while it is in use.
+        """
+        with self.acquire(name, exclusive=False) as pipeline:
+            return pipeline
+
+    @contextmanager
+    def acquire(self, name: str, exclusive: bool = True):
+        """
+        Pin the pipeline of `name` against eviction for the duration of the `with` block.
+        With `exclusive` the block also takes one of the `concurrency` slots of the pipeline.
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            raise ModelNotFoundError(name)
+        if exclusive:
+            entry.slots.acquire()
+        try:
+            with self.lock:
+                entry.in_use += 1
+            try:
+                yield self._ensure_loaded(entry)
+            finally:
+                with self.lock:
+                    entry.in_use -= 1
+                    entry.last_used = time.time()
+        finally:
+            if exclusive:
+                entry.slots.release()
+
+    def _ensure_loaded(self, entry: ModelEntry) -> TTS:
+        with self.lock:
+            if entry.pipeline is not None:
+                if self.resident.get(entry.name) is entry:
+                    self.resident.move_to_end(entry.name)
+                return entry.pipeline
+        # 不同模型的加载互不阻塞, 已加载模型的查询也不受影响
+        with entry.load_lock:
+            if entry.pipeline is None:
+                self._evict(incoming=entry.estimate_nbytes(), keep=entry.name)
+                pipeline = self._load(entry)
+                with self.lock:
+                    entry.pipeline = pipeline
+                    entry.nbytes = sum(
+                        module_nbytes(model)
+                        for model in [pipeline.t2s_model, pipeline.vits_model, pipeline.draft_t2s_model]
+                    )
+                    if self.entries.get(entry.name) is entry:
+                        self.resident[entry.name] = entry
+                self._evict(incoming=0, keep=entry.name)
+                print(f"ModelRegistry: loaded {entry.name} ({entry.nbytes / 2**20:.1f}MB)")
+        with self.lock:
+            if self.resident.get(entry.name) is entry:
+                self.resident.move_to_end(entry.name)
+            return entry.pipeline
+
+    def _load(self, entry: ModelEntry) -> TTS:
+        base = self.configs.update_configs()
+        custom = dict(base)
+        custom["t2s_weights_path"] = entry.t2s_weights_path
+        custom["vits_weights_path"] = entry.vits_weights_path
+        # 实际版本由SoVITS权重决定, 这里只影响缺省路径
+        version = self.configs.version if self.configs.version in ["v1", "v2", "v3", "v4"] else "v2"
+        configs = TTS_Config({"version": version, "custom": custom})
+        configs.configs_path = None
+        pipeline = TTS(configs, shared_models=self.shared_models)
+        if self.on_load is not None:
+            self.on_load(pipeline)
+        return pipeline
+
+    def _evict(self, incoming: int, keep: str):
+        """
+        Unload the least recently used idle pipelines until `incoming` more bytes fit the budget.
+        """
+        evicted = []
+        with self.lock:
+            def over_budget():
+                count = len(self.resident) + (1 if keep not in self.resident else 0)
+                nbytes = sum(entry.nbytes for entry in self.resident.values()) + incoming
+                return count > self.max_models or (self.memory_budget > 0 and nbytes > self.memory_budget)
+
+            for name in list(self.resident.keys()):
+                if not over_budget():
+                    break
+                entry = self.resident[name]
+                if name == keep or entry.in_use > 0:
+                    continue
+                del self.resident[name]
+                entry.pipeline = None
+                evicted.append(name)
+        if evicted:
+            print(f"ModelRegistry: unloaded {', '.join(evicted)}")
+            gc.collect()
+            self._empty_cache()
+
+    def _empty_cache(self):
+        if "cuda" in str(self.configs.device):
+            torch.cuda.empty_cache()
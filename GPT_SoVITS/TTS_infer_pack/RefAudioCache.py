@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+from safetensors.torch import load_file, save_file
+
+
+class RefAudioCache:
+    """
+    Features derived from a reference audio (prompt_semantic, refer_spec, 16k audio, sv_emb, raw audio),
+    keyed by the hash of the audio file content plus a tag of the models that produced them.
+    Entries are returned on the device passed to `get`, whichever device they were computed on.
+
+    The memory tier is an LRU of `max_items` entries. If `cache_dir` is set, every entry is also written
+    there as a safetensors file, so a voice computed once (even by another process) costs a file read
+    instead of a CNHuBERT forward.
+
+    Args:
+        max_items (int): the maximum number of entries kept in memory, 0 disables the memory tier.
+        cache_dir (str): the directory of the disk tier, None disables it.
+    """
+
+    def __init__(self, max_items: int = 64, cache_dir: str = None):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.entries: OrderedDict = OrderedDict()
+        self.file_hashes: Dict[str, tuple] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def hash_file(self, path: str) -> str:
+        """
+        sha1 of the file content, memoized by (path, mtime, size).
+        """
+        stat = os.stat(path)
+        with self.lock:
+            memo = self.file_hashes.get(path)
+        if memo is not None and memo[0] == stat.st_mtime_ns and memo[1] == stat.st_size:
+            return memo[2]
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        with self.lock:
+            self.file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def make_key(self, path: str, kind: str, tag: str) -> str:
+        return hashlib.sha1(f"{self.hash_file(path)}|{kind}|{tag}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def get(self, key: str, device: torch.device = None) -> Optional[Dict[str, torch.Tensor]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            # 共享同一缓存的流水线可能在不同的设备上, 命中时迁移到调用方的设备
+            if device is not None:
+                entry = {k: v.to(device) for k, v in entry.items()}
+            return entry
+
+        if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                entry = load_file(self._disk_path(key), device=str(device) if device is not None else "cpu")
+            except Exception as e:
+                print(f"Failed to load reference cache {self._disk_path(key)}: {e}")
+                entry = None
+            if entry is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                self._put_memory(key, entry)
+                return entry
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, entry: Dict[str, torch.Tensor]):
+        self._put_memory(key, entry)
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                save_file({k: v.detach().contiguous().cpu() for k, v in entry.items()}, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Failed to save reference cache {path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _put_memory(self, key: str, entry: Dict[str, torch.Tensor]):
+        if self.max_items <= 0:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "items": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
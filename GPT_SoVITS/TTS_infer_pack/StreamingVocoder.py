@@ -0,0 +1,105 @@
+from typing import Iterator, List
+
+import torch
+
+
+class StreamingVocoder:
+    """
+    Runs a mel vocoder (BigVGAN for v3, the HiFiGAN Generator for v4) over mel chunks as they are produced,
+    instead of once over the whole utterance, so the peak memory of the vocoder no longer grows with the
+    sentence length and the first audio is ready after the first chunk.
+
+    Every vocoder call covers `chunk_frames` new frames plus up to `context_frames` earlier frames as left
+    context and `lookahead_frames` later frames as right context; the audio of the context frames is dropped.
+    Consecutive calls overlap by `overlap_frames`, which are cross-faded with a hann window. Both calls see the
+    overlapping frames at the same time position, so no SOLA offset search is needed.
+
+    Args:
+        vocoder (torch.nn.Module): (1, n_mels, T) -> (1, 1, T * upsample_rate).
+        upsample_rate (int): the number of samples per mel frame.
+        chunk_frames (int): the number of new frames of every vocoder call.
+        context_frames (int): the left context of every vocoder call.
+        lookahead_frames (int): the right context, a chunk is only vocoded once these frames are available.
+        overlap_frames (int): the number of frames cross-faded between consecutive calls.
+    """
+
+    def __init__(
+        self,
+        vocoder: torch.nn.Module,
+        upsample_rate: int,
+        chunk_frames: int = 128,
+        context_frames: int = 32,
+        lookahead_frames: int = 8,
+        overlap_frames: int = 4,
+    ):
+        self.vocoder = vocoder
+        self.upsample_rate = upsample_rate
+        self.chunk_frames = max(chunk_frames, overlap_frames + 1)
+        self.context_frames = context_frames
+        self.lookahead_frames = lookahead_frames
+        self.overlap_frames = overlap_frames
+        self.reset()
+
+    def reset(self):
+        # mel: 尚未丢弃的帧, 其第一帧在整句中的位置为 mel_start
+        self.mel: torch.Tensor = None
+        self.mel_start = 0
+        self.total_frames = 0
+        # 已输出音频的帧数 (不含保留的重叠部分)
+        self.emitted_frames = 0
+        self.held_audio: torch.Tensor = None
+
+    def push(self, mel: torch.Tensor) -> Iterator[torch.Tensor]:
+        """
+        Append mel frames (1, n_mels, T) and yield the audio (1D) of every chunk that became complete.
+        """
+        self.mel = mel if self.mel is None else torch.cat([self.mel, mel], dim=2)
+        self.total_frames += mel.shape[2]
+        while self.total_frames - self.lookahead_frames - self.emitted_frames >= self.chunk_frames:
+            yield self._vocode(self.emitted_frames + self.chunk_frames, final=False)
+
+    def flush(self) -> Iterator[torch.Tensor]:
+        """
+        Yield the audio of the remaining frames, the wrapper can be reused afterwards.
+        """
+        if self.mel is not None and (self.total_frames > self.emitted_frames or self.held_audio is not None):
+            yield self._vocode(self.total_frames, final=True)
+        self.reset()
+
+    def _vocode(self, end: int, final: bool) -> torch.Tensor:
+        up = self.upsample_rate
+        # 本次输出 [emitted - overlap, end) 的音频, 前 overlap 帧与上次保留的音频交叉淡化
+        overlap = min(self.overlap_frames, self.emitted_frames) if self.held_audio is not None else 0
+        out_start = self.emitted_frames - overlap
+        start = max(out_start - self.context_frames, self.mel_start)
+        stop = min(end + self.lookahead_frames, self.total_frames)
+
+        with torch.inference_mode():
+            audio = self.vocoder(self.mel[:, :, start - self.mel_start : stop - self.mel_start])[0, 0]
+        audio = audio[(out_start - start) * up : (end - start) * up]
+
+        if overlap > 0:
+            fade_len = overlap * up
+            window = torch.hann_window(fade_len * 2, device=audio.device, dtype=audio.dtype)
+            audio = audio.clone()
+            audio[:fade_len] = window[:fade_len] * audio[:fade_len] + window[fade_len:] * self.held_audio
+        if final:
+            self.held_audio = None
+            out = audio
+        else:
+            hold = min(self.overlap_frames, end - out_start) * up
+            self.held_audio = audio[audio.shape[0] - hold :]
+            out = audio[: audio.shape[0] - hold]
+        self.emitted_frames = end
+
+        # 只保留下一次调用需要的帧 (左侧上下文及重叠部分)
+        keep_from = max(end - self.overlap_frames - self.context_frames, 0)
+        if keep_from > self.mel_start:
+            self.mel = self.mel[:, :, keep_from - self.mel_start :]
+            self.mel_start = keep_from
+        return out
+
+    def __call__(self, mel_chunks: List[torch.Tensor]) -> Iterator[torch.Tensor]:
+        for mel in mel_chunks:
+            yield from self.push(mel)
+        yield from self.flush()
@@ -0,0 +1,343 @@
+import threading
+import traceback
+from collections import deque
+from typing import Dict, List, Tuple
+
+import torch
+
+from AR.models.t2s_model import T2SKVCache, T2SLoopDetector, Text2SemanticDecoder
+from AR.models.utils import make_token_counts, sample_top_k_first, update_token_counts
+
+
+class T2SRequest:
+    """
+    One sentence (one batch row) waiting for, or going through, the T2S decode loop.
+    """
+
+    def __init__(
+        self,
+        x: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        prompt: torch.LongTensor,
+        top_k: int = 5,
+        top_p: float = 1.0,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        early_stop_num: int = -1,
+        loop_detector: T2SLoopDetector = None,
+    ):
+        self.x = x
+        self.bert_feature = bert_feature
+        self.prompt = prompt
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.early_stop_num = early_stop_num
+        self.loop_detector = loop_detector
+
+        self.y: torch.LongTensor = None
+        # (1, vocab_size) occurrence counts of y, for the repetition penalty
+        self.token_counts: torch.Tensor = None
+        self.prefix_len: int = prompt.shape[-1]
+        self.idx: int = 0
+        self.stop_reason: str = None
+        self.result: torch.LongTensor = None
+        self.done = threading.Event()
+
+    @property
+    def sampling_key(self) -> Tuple:
+        return (self.top_k, self.top_p, self.temperature, self.repetition_penalty)
+
+    def finish(self, idx: int, stop_reason: str = "early_stop"):
+        self.idx = idx
+        self.stop_reason = stop_reason
+        self.result = self.y[:-1] if self.y is not None else self.prompt
+        self.done.set()
+
+
+class T2SScheduler:
+    """
+    Iteration-level (continuous) batching for the T2S decoder.
+
+    Sentences from any number of concurrent callers are queued with `infer()`. A background
+    thread merges them into one running batch at token boundaries: finished rows leave the batch
+    after every step and queued rows are prefilled and join the batch before the next one.
+
+    Args:
+        t2s_model (Text2SemanticDecoder): the decoder, i.e. `TTS.t2s_model.model`.
+        max_batch_size (int): the maximum number of rows decoded together.
+        max_steps (int): the hard ceiling of decode steps per row, same as `infer_panel_batch_infer`.
+    """
+
+    def __init__(self, t2s_model: Text2SemanticDecoder, max_batch_size: int = 20, max_steps: int = 1500):
+        self.model = t2s_model
+        self.max_batch_size = max_batch_size
+        self.max_steps = max_steps
+
+        self.pending: deque = deque()
+        self.active: List[T2SRequest] = []
+        self.cond = threading.Condition()
+        self.running = True
+        self._next_model: Text2SemanticDecoder = None
+
+        self.kv_cache: T2SKVCache = None
+
+        self.thread = threading.Thread(target=self._loop, name="T2SScheduler", daemon=True)
+        self.thread.start()
+
+    def set_model(self, t2s_model: Text2SemanticDecoder):
+        """
+        Swap the decoder once the running batch has drained. No new rows are admitted meanwhile.
+        """
+        with self.cond:
+            self._next_model = t2s_model
+            self.cond.notify_all()
+
+    def submit(self, requests: List[T2SRequest]):
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("T2SScheduler has been shut down")
+            self.pending.extend(requests)
+            self.cond.notify_all()
+
+    def abort_all(self):
+        """
+        Finish every queued and running row with the tokens generated so far.
+        The running rows leave the batch at the next token boundary.
+        """
+        with self.cond:
+            for request in self.pending:
+                request.finish(0)
+            self.pending.clear()
+            for request in self.active:
+                if not request.done.is_set():
+                    request.finish(request.idx)
+
+    def shutdown(self):
+        self.abort_all()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+    def infer(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.Tensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """
+        Drop-in replacement of `Text2SemanticDecoder.infer_panel_batch_infer`, blocks until all rows are done.
+        """
+        if prompts is None:
+            print("Warning: Prompt free is not supported by the scheduler! switch to naive_infer")
+            return self.model.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                **kwargs,
+            )
+
+        max_new_tokens = kwargs.pop("max_new_tokens", None)
+        detectors = [
+            self.model._make_loop_detector(
+                1,
+                prompts.device,
+                max_new_tokens=max_new_tokens[i : i + 1] if max_new_tokens is not None else None,
+                **kwargs,
+            )
+            for i in range(len(x))
+        ]
+        requests = [
+            T2SRequest(
+                x_item,
+                bert_item,
+                prompt_item,
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                early_stop_num=early_stop_num,
+                loop_detector=detector,
+            )
+            for x_item, bert_item, prompt_item, detector in zip(x, bert_feature, prompts, detectors)
+        ]
+        self.submit(requests)
+        for request in requests:
+            request.done.wait()
+        stop_reasons = [request.stop_reason for request in requests]
+        self.model._report_stop_reasons(stop_reasons, kwargs.get("stop_reasons", None))
+        return [request.result for request in requests], [request.idx for request in requests]
+
+    def _reset_batch(self):
+        self.active = []
+        self.kv_cache = None
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending and not self.active:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                if self._next_model is not None and not self.active:
+                    self.model = self._next_model
+                    self._next_model = None
+                new_requests: List[T2SRequest] = []
+                if self._next_model is None:
+                    while self.pending and len(self.active) + len(new_requests) < self.max_batch_size:
+                        new_requests.append(self.pending.popleft())
+
+            try:
+                with torch.no_grad():
+                    if new_requests:
+                        self._admit(new_requests)
+                    if self.active:
+                        self._step()
+            except Exception:
+                traceback.print_exc()
+                with self.cond:
+                    for request in self.active + new_requests:
+                        if not request.done.is_set():
+                            request.finish(request.idx)
+                    self._reset_batch()
+
+    def _admit(self, requests: List[T2SRequest]):
+        model = self.model
+        xy_list = []
+        for request in requests:
+            x_item = model.ar_text_embedding(request.x.unsqueeze(0))
+            x_item = x_item + model.bert_proj(request.bert_feature.transpose(0, 1).unsqueeze(0))
+            x_item = model.ar_text_position(x_item)
+            y_pos = model.ar_audio_position(model.ar_audio_embedding(request.prompt.unsqueeze(0)))
+            xy_list.append(torch.concat([x_item, y_pos], dim=1).squeeze(0))
+            request.y = request.prompt
+            request.token_counts = make_token_counts(request.prompt.unsqueeze(0), model.vocab_size)
+
+        # rows are prefilled without padding, only the returned kv cache is left padded to the longest row
+        x_len_list = [request.x.shape[0] for request in requests]
+        xy_dec, k_cache, v_cache, kv_padding_mask = model._packed_prefill(xy_list, x_len_list)
+        src_len = kv_padding_mask.shape[1]
+        logits = model.ar_predict_layer(xy_dec[:, -1])[:, :-1]
+        samples = self._sample_and_append(requests, logits)
+
+        # merge into the running batch, left padding whichever side has the shorter kv cache
+        kv_cache = T2SKVCache(k_cache, v_cache, kv_padding_mask, src_len + self.max_steps)
+        if self.kv_cache is None:
+            self.kv_cache = kv_cache
+        else:
+            if self.kv_cache.length < kv_cache.length:
+                self.kv_cache.left_pad(kv_cache.length - self.kv_cache.length)
+            elif kv_cache.length < self.kv_cache.length:
+                kv_cache.left_pad(self.kv_cache.length - kv_cache.length)
+            self.kv_cache.concat(kv_cache)
+
+        with self.cond:
+            self.active.extend(requests)
+        self._retire(requests, logits, samples)
+
+    def _step(self):
+        model = self.model
+        last_tokens = torch.stack([request.y[-1:] for request in self.active])
+        y_emb = model.ar_audio_embedding(last_tokens)
+        positions = torch.LongTensor([request.y.shape[0] - 1 for request in self.active]).to(y_emb.device)
+        pe = model.ar_audio_position.pe[0, positions].to(dtype=y_emb.dtype, device=y_emb.device)
+        xy_pos = y_emb * model.ar_audio_position.x_scale + model.ar_audio_position.alpha * pe.unsqueeze(1)
+
+        kv_cache = self.kv_cache
+        kv_cache.reserve(1)
+        xy_dec = model.t2s_transformer.decode_next_token_static(
+            xy_pos, kv_cache.k_cache, kv_cache.v_cache, kv_cache.length, kv_cache.attn_mask()
+        )
+        kv_cache.advance()
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+
+        for request in self.active:
+            request.idx += 1
+        samples = self._sample_and_append(self.active, logits)
+        self._retire(self.active, logits, samples)
+
+    def _sample_and_append(self, requests: List[T2SRequest], logits: torch.Tensor):
+        groups: Dict[Tuple, List[int]] = {}
+        for i, request in enumerate(requests):
+            groups.setdefault(request.sampling_key, []).append(i)
+
+        samples = torch.empty((len(requests), 1), dtype=torch.long, device=logits.device)
+        token_counts = torch.concat([request.token_counts for request in requests])
+        for (top_k, top_p, temperature, repetition_penalty), rows in groups.items():
+            index = torch.LongTensor(rows).to(logits.device)
+            samples[index] = sample_top_k_first(
+                logits[index],
+                token_counts[index],
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                temperature=temperature,
+            ).long()
+
+        update_token_counts(token_counts, samples)
+        for i, (request, token) in enumerate(zip(requests, samples)):
+            request.y = torch.concat([request.y, token.to(request.y.dtype)])
+            request.token_counts = token_counts[i : i + 1]
+        return samples
+
+    def _retire(self, requests: List[T2SRequest], logits: torch.Tensor, samples: torch.Tensor):
+        EOS = self.model.EOS
+        tokens = torch.argmax(logits, dim=-1)
+        finished = (samples[:, 0] == EOS).logical_or(tokens == EOS).tolist()
+
+        reserved = []
+        with self.cond:
+            for i, request in enumerate(requests):
+                if request.done.is_set():
+                    continue
+                n_generated = request.y.shape[0] - request.prefix_len
+                runaway = 0
+                if not finished[i] and request.loop_detector is not None:
+                    runaway = int(request.loop_detector.update(samples[i : i + 1])[0])
+                if (
+                    finished[i]
+                    or runaway
+                    or (request.early_stop_num != -1 and n_generated > request.early_stop_num)
+                    or request.idx >= self.max_steps - 1
+                ):
+                    if finished[i]:
+                        stop_reason = "eos"
+                    elif runaway:
+                        stop_reason = T2SLoopDetector.REASONS[runaway]
+                    else:
+                        stop_reason = "early_stop"
+                        print("use early stop num:", request.early_stop_num)
+                    print(f"T2S Decoding EOS [{request.prefix_len} -> {request.y.shape[0]}]")
+                    request.finish(request.idx, stop_reason)
+
+            for i, request in enumerate(self.active):
+                if not request.done.is_set():
+                    reserved.append(i)
+            if len(reserved) == len(self.active):
+                return
+            if len(reserved) == 0:
+                self._reset_batch()
+                return
+
+            index = torch.LongTensor(reserved).to(self.kv_cache.padding_mask.device)
+            self.active = [self.active[i] for i in reserved]
+            self.kv_cache.index_select(index)
+            # drop the leading columns that became padding for every remaining row
+            lead = int(self.kv_cache.padding_mask[:, : self.kv_cache.length].int().argmin(dim=1).min())
+            if lead > 0:
+                self.kv_cache.trim_left(lead)
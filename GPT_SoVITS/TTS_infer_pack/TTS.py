@@ -3,9 +3,11 @@ import math
 import os
 import random
 import sys
+import threading
 import time
 import traceback
 from copy import deepcopy
+from functools import partial
 
 import torchaudio
 from tqdm import tqdm
@@ -22,20 +24,33 @@ import torch
 import torch.nn.functional as F
 import yaml
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from AR.models.t2s_model import T2SDraftModel, T2SLoopDetector
 from BigVGAN.bigvgan import BigVGAN
 from feature_extractor.cnhubert import CNHubert
 from module.mel_processing import mel_spectrogram_torch, spectrogram_torch
 from module.models import SynthesizerTrn, SynthesizerTrnV3, Generator
 from peft import LoraConfig, get_peft_model
-from process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
+from process_ckpt import (
+    get_sovits_version_from_path_fast,
+    is_inference_bundle,
+    load_inference_bundle,
+    load_sovits_new,
+    remove_weight_norm_hooks,
+)
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 
 from tools.audio_sr import AP_BWE
 from tools.i18n.i18n import I18nAuto, scan_language_list
 from tools.my_utils import load_audio
+from TTS_infer_pack.BackgroundStage import BackgroundStage
+from TTS_infer_pack.StreamingVocoder import StreamingVocoder
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.T2SScheduler import T2SScheduler
+from TTS_infer_pack.RefAudioCache import RefAudioCache
+from TTS_infer_pack.TextFeatureCache import TextFeatureCache
 from sv import SV
+from text.frontends import get_module_map, profile_report as text_frontends_profile_report, warmup as warmup_text_frontends
 resample_transform_dict={}
 def resample(audio_tensor, sr0,sr1,device):
     global resample_transform_dict
@@ -321,6 +336,10 @@ class TTS_Config:
         self.vits_weights_path = self.configs.get("vits_weights_path", None)
         self.bert_base_path = self.configs.get("bert_base_path", None)
         self.cnhuhbert_base_path = self.configs.get("cnhuhbert_base_path", None)
+        self.ref_cache_size: int = self.configs.get("ref_cache_size", 64)
+        self.ref_cache_dir: str = self.configs.get("ref_cache_dir", None)
+        self.text_cache_max_mb: int = self.configs.get("text_cache_max_mb", 256)
+        self.text_cache_dir: str = self.configs.get("text_cache_dir", None)
         self.languages = self.v1_languages if self.version == "v1" else self.v2_languages
 
         self.use_vocoder: bool = False
@@ -367,6 +386,9 @@ class TTS_Config:
 
         if configs_path is None:
             configs_path = self.configs_path
+        if configs_path is None:
+            # 仅存在于内存中的配置 (如 ModelRegistry 中各模型的配置), 不写回文件
+            return
         with open(configs_path, "w") as f:
             yaml.dump(configs, f)
 
@@ -379,6 +401,10 @@ class TTS_Config:
             "vits_weights_path": self.vits_weights_path,
             "bert_base_path": self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "ref_cache_size": self.ref_cache_size,
+            "ref_cache_dir": self.ref_cache_dir,
+            "text_cache_max_mb": self.text_cache_max_mb,
+            "text_cache_dir": self.text_cache_dir,
         }
         return self.config
 
@@ -405,12 +431,23 @@ class TTS_Config:
 
 
 class TTS:
-    def __init__(self, configs: Union[dict, str, TTS_Config]):
+    def __init__(self, configs: Union[dict, str, TTS_Config], shared_models: dict = None):
+        """
+        Args:
+            configs: the config of this pipeline.
+            shared_models: dict, the `shared_models` of another pipeline. The models that do not depend on the
+                GPT/SoVITS weights (BERT, CNHuBERT, vocoders, SV, super sampling) and the reference / text feature
+                caches are then loaded once and used by both, only the GPT/SoVITS pair is loaded for this pipeline.
+        """
         if isinstance(configs, TTS_Config):
             self.configs = configs
         else:
             self.configs: TTS_Config = TTS_Config(configs)
 
+        # 与GPT/SoVITS权重无关的模型及缓存, 可在多个TTS实例之间共享
+        self.owns_shared_models: bool = shared_models is None
+        self.shared_models: dict = shared_models if shared_models is not None else {}
+
         self.t2s_model: Text2SemanticLightningModule = None
         self.vits_model: Union[SynthesizerTrn, SynthesizerTrnV3] = None
         self.bert_tokenizer: AutoTokenizer = None
@@ -431,8 +468,15 @@ class TTS:
 
         self._init_models()
 
+        if "text_feature_cache" not in self.shared_models:
+            self.shared_models["text_feature_cache"] = TextFeatureCache(
+                int(self.configs.text_cache_max_mb * (1 << 20)),
+                self.configs.text_cache_dir,
+                tag=f"{self.configs.bert_base_path}|{self.configs.is_half}",
+            )
+        self.text_feature_cache: TextFeatureCache = self.shared_models["text_feature_cache"]
         self.text_preprocessor: TextPreprocessor = TextPreprocessor(
-            self.bert_model, self.bert_tokenizer, self.configs.device
+            self.bert_model, self.bert_tokenizer, self.configs.device, self.text_feature_cache
         )
 
         self.prompt_cache: dict = {
@@ -445,8 +489,17 @@ class TTS:
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "vocoder_ref_cond": None,
         }
 
+        self.prompt_lock = threading.RLock()
+        if "ref_audio_cache" not in self.shared_models:
+            self.shared_models["ref_audio_cache"] = RefAudioCache(self.configs.ref_cache_size, self.configs.ref_cache_dir)
+        self.ref_audio_cache: RefAudioCache = self.shared_models["ref_audio_cache"]
+        self.t2s_scheduler: T2SScheduler = None
+        self.speculative_config: dict = None
+        self.draft_t2s_model: Text2SemanticLightningModule = None
+
         self.stop_flag: bool = False
         self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
 
@@ -460,14 +513,23 @@ class TTS:
         # self.enable_half_precision(self.configs.is_half)
 
     def init_cnhuhbert_weights(self, base_path: str):
+        shared = self.shared_models.get("cnhubert")
+        if shared is not None and shared[0] == base_path:
+            self.cnhuhbert_model = shared[1]
+            return
         print(f"Loading CNHuBERT weights from {base_path}")
         self.cnhuhbert_model = CNHubert(base_path)
         self.cnhuhbert_model = self.cnhuhbert_model.eval()
         self.cnhuhbert_model = self.cnhuhbert_model.to(self.configs.device)
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.cnhuhbert_model = self.cnhuhbert_model.half()
+        self.shared_models["cnhubert"] = (base_path, self.cnhuhbert_model)
 
     def init_bert_weights(self, base_path: str):
+        shared = self.shared_models.get("bert")
+        if shared is not None and shared[0] == base_path:
+            _, self.bert_tokenizer, self.bert_model = shared
+            return
         print(f"Loading BERT weights from {base_path}")
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
         self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
@@ -475,6 +537,7 @@ class TTS:
         self.bert_model = self.bert_model.to(self.configs.device)
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.bert_model = self.bert_model.half()
+        self.shared_models["bert"] = (base_path, self.bert_tokenizer, self.bert_model)
 
     def init_vits_weights(self, weights_path: str):
         self.configs.vits_weights_path = weights_path
@@ -488,7 +551,13 @@ class TTS:
             raise FileExistsError(info)
 
         # dict_s2 = torch.load(weights_path, map_location=self.configs.device,weights_only=False)
-        dict_s2 = load_sovits_new(weights_path)
+        is_bundle = is_inference_bundle(weights_path)
+        if is_bundle:
+            # 推理权重包: 无enc_q, weight norm已融合, LoRA已合并
+            weight, config, _ = load_inference_bundle(weights_path)
+            dict_s2 = {"weight": weight, "config": config}
+        else:
+            dict_s2 = load_sovits_new(weights_path)
         hps = dict_s2["config"]
         hps["model"]["semantic_frame_rate"] = "25hz"
         if "enc_p.text_embedding.weight" not in dict_s2["weight"]:
@@ -544,7 +613,13 @@ class TTS:
 
         self.is_v2pro=model_version in {"v2Pro","v2ProPlus"}
 
-        if if_lora_v3 == False:
+        if is_bundle:
+            if hasattr(vits_model, "enc_q"):
+                del vits_model.enc_q
+            remove_weight_norm_hooks(vits_model)
+            load_result = self._load_bundle_state_dict(vits_model, dict_s2["weight"], bundle_path=weights_path)
+            print(f"Loading VITS inference bundle from {weights_path}. {load_result}")
+        elif if_lora_v3 == False:
             print(
                 f"Loading VITS weights from {weights_path}. {vits_model.load_state_dict(dict_s2['weight'], strict=False)}"
             )
@@ -572,31 +647,151 @@ class TTS:
         self.vits_model = vits_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.vits_model = self.vits_model.half()
+        if getattr(self, "prompt_cache", None) is not None:
+            self.prompt_cache["vocoder_ref_cond"] = None
 
     def init_t2s_weights(self, weights_path: str):
         print(f"Loading Text2Semantic weights from {weights_path}")
         self.configs.t2s_weights_path = weights_path
         self.configs.save_configs()
         self.configs.hz = 50
-        dict_s1 = torch.load(weights_path, map_location=self.configs.device, weights_only=False)
+        is_bundle = is_inference_bundle(weights_path)
+        if is_bundle:
+            weight, config, _ = load_inference_bundle(weights_path)
+            dict_s1 = {"weight": weight, "config": config}
+        else:
+            dict_s1 = torch.load(weights_path, map_location=self.configs.device, weights_only=False)
         config = dict_s1["config"]
         self.configs.max_sec = config["data"]["max_sec"]
         t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
-        t2s_model.load_state_dict(dict_s1["weight"])
+        if is_bundle:
+            self._load_bundle_state_dict(t2s_model, dict_s1["weight"], strict=True, bundle_path=weights_path)
+            t2s_model.model.init_t2s_transformer()
+        else:
+            t2s_model.load_state_dict(dict_s1["weight"])
         t2s_model = t2s_model.to(self.configs.device)
         t2s_model = t2s_model.eval()
         self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.t2s_model = self.t2s_model.half()
+        if getattr(self, "t2s_scheduler", None) is not None:
+            self.t2s_scheduler.set_model(self.t2s_model.model)
+        if getattr(self, "speculative_config", None) is not None:
+            self.init_draft_model()
+
+    def _load_bundle_state_dict(
+        self, model: torch.nn.Module, state_dict: dict, strict: bool = False, bundle_path: str = None
+    ):
+        # 直接使用mmap的张量作为参数(assign), 不复制; 只有dtype与模型不同的张量才会转换
+        params = dict(model.named_parameters())
+        params.update(model.named_buffers())
+        converted_bytes = 0
+        converted_dtypes = set()
+        for key, value in state_dict.items():
+            if key in params and params[key].dtype != value.dtype:
+                state_dict[key] = value.to(params[key].dtype)
+                converted_bytes += state_dict[key].numel() * state_dict[key].element_size()
+                converted_dtypes.add((value.dtype, params[key].dtype))
+        if converted_bytes > 0 and str(self.configs.device) == "cpu":
+            # CPU上参数直接引用mmap的页, 转换后则是本进程私有的一份拷贝
+            dtypes = ", ".join(f"{src} -> {dst}" for src, dst in sorted(converted_dtypes, key=str))
+            print(
+                f"Warning: {converted_bytes / 2**20:.1f}MB of the inference bundle {bundle_path} are converted ({dtypes}) "
+                f"into a private copy instead of being memory-mapped, export it with --dtype fp32 for CPU inference."
+            )
+        return model.load_state_dict(state_dict, strict=strict, assign=True)
+
+    def warmup_text_frontends(self, languages: List[str] = None) -> str:
+        """
+        Load the text frontends (g2p models, dictionaries) of `languages` before the first request instead of during it.
+        Args:
+            languages: list of language codes of `TTS_Config.languages` ("zh", "all_ja", "auto", ...), all of them if None.
+        returns:
+            str: the load time report of the text frontends.
+        """
+        module_map = get_module_map(self.configs.version)
+        frontend_languages = set()
+        for language in languages if languages is not None else self.configs.languages:
+            language = language.strip()
+            if language.startswith("auto"):
+                frontend_languages.update(module_map.keys())
+                continue
+            frontend_languages.add(language.replace("all_", ""))
+            if not language.startswith("all_"):
+                # 混合语种中的英文
+                frontend_languages.add("en")
+        warmup_text_frontends(sorted(frontend_languages & set(module_map.keys())), self.configs.version)
+        return text_frontends_profile_report()
+
+    def enable_continuous_batching(self, enable: bool = True, max_batch_size: int = 20):
+        """
+        To merge the sentences of concurrent `run()` calls into one T2S decode batch (parallel_infer only).
+        Args:
+            enable: bool, whether to enable the continuous batching scheduler.
+            max_batch_size: int, the maximum number of sentences decoded together.
+        """
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.shutdown()
+            self.t2s_scheduler = None
+        if enable:
+            self.t2s_scheduler = T2SScheduler(self.t2s_model.model, max_batch_size=max_batch_size)
+
+    def enable_speculative_decoding(
+        self,
+        enable: bool = True,
+        draft_layers: int = 4,
+        num_draft_tokens: int = 4,
+        draft_weights_path: str = None,
+    ):
+        """
+        To decode the semantic tokens with speculative decoding (parallel_infer only), the output distribution is unchanged.
+        Args:
+            enable: bool, whether to enable speculative decoding.
+            draft_layers: int, the draft is made of the first `draft_layers` blocks of the GPT model.
+            num_draft_tokens: int, the number of tokens the draft proposes in every round.
+            draft_weights_path: str, a shallow GPT model trained with the s1 pipeline, used as the draft instead.
+        """
+        if not enable:
+            self.speculative_config = None
+            self.draft_t2s_model = None
+            self.t2s_model.model.set_draft_model(None)
+            return
+        self.speculative_config = {
+            "draft_layers": draft_layers,
+            "num_draft_tokens": num_draft_tokens,
+            "draft_weights_path": draft_weights_path,
+        }
+        self.init_draft_model()
+
+    def init_draft_model(self):
+        draft_weights_path = self.speculative_config["draft_weights_path"]
+        if draft_weights_path in [None, ""]:
+            self.draft_t2s_model = None
+            draft = T2SDraftModel.from_truncated(self.t2s_model.model, self.speculative_config["draft_layers"])
+        else:
+            print(f"Loading draft Text2Semantic weights from {draft_weights_path}")
+            dict_s1 = torch.load(draft_weights_path, map_location=self.configs.device, weights_only=False)
+            draft_t2s_model = Text2SemanticLightningModule(dict_s1["config"], "****", is_train=False)
+            draft_t2s_model.load_state_dict(dict_s1["weight"])
+            draft_t2s_model = draft_t2s_model.to(self.configs.device).eval()
+            if self.configs.is_half and str(self.configs.device) != "cpu":
+                draft_t2s_model = draft_t2s_model.half()
+            self.draft_t2s_model = draft_t2s_model
+            draft = T2SDraftModel.from_decoder(draft_t2s_model.model)
+        self.t2s_model.model.set_draft_model(draft)
 
     def init_vocoder(self, version: str):
+        shared = self.shared_models.get(f"vocoder_{version}")
+        if shared is not None:
+            if self.vocoder is not shared[0]:
+                self._release_vocoder()
+                self.vocoder = shared[0]
+                self.vocoder_configs.update(shared[1])
+            return
         if version == "v3":
             if self.vocoder is not None and self.vocoder.__class__.__name__ == "BigVGAN":
                 return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
+            self._release_vocoder()
 
             self.vocoder = BigVGAN.from_pretrained(
                 "%s/GPT_SoVITS/pretrained_models/models--nvidia--bigvgan_v2_24khz_100band_256x" % (now_dir,),
@@ -614,10 +809,7 @@ class TTS:
         elif version == "v4":
             if self.vocoder is not None and self.vocoder.__class__.__name__ == "Generator":
                 return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
+            self._release_vocoder()
 
             self.vocoder = Generator(
                 initial_channel=100,
@@ -647,13 +839,30 @@ class TTS:
             self.vocoder = self.vocoder.half().to(self.configs.device)
         else:
             self.vocoder = self.vocoder.to(self.configs.device)
+        self.shared_models[f"vocoder_{version}"] = (self.vocoder, dict(self.vocoder_configs))
+
+    def _release_vocoder(self):
+        if self.vocoder is None:
+            return
+        # 共享的声码器可能仍在被其他实例使用, 只从自己的字典中移除, 引用全部释放后显存才会回收
+        if self.owns_shared_models:
+            for key in [key for key, value in self.shared_models.items() if key.startswith("vocoder_")]:
+                if self.shared_models[key][0] is self.vocoder:
+                    del self.shared_models[key]
+        self.vocoder = None
+        self.empty_cache()
 
     def init_sr_model(self):
         if self.sr_model is not None:
             return
+        if self.shared_models.get("sr") is not None:
+            self.sr_model = self.shared_models["sr"]
+            self.sr_model_not_exist = False
+            return
         try:
             self.sr_model: AP_BWE = AP_BWE(self.configs.device, DictToAttrRecursive)
             self.sr_model_not_exist = False
+            self.shared_models["sr"] = self.sr_model
         except FileNotFoundError:
             print(i18n("你没有下载超分模型的参数，因此不进行超分。如想超分请先参照教程把文件下载好"))
             self.sr_model_not_exist = True
@@ -661,7 +870,9 @@ class TTS:
     def init_sv_model(self):
         if self.sv_model is not None:
             return
-        self.sv_model = SV(self.configs.device, self.configs.is_half)
+        if self.shared_models.get("sv") is None:
+            self.shared_models["sv"] = SV(self.configs.device, self.configs.is_half)
+        self.sv_model = self.shared_models["sv"]
 
     def enable_half_precision(self, enable: bool = True, save: bool = True):
         """
@@ -681,6 +892,8 @@ class TTS:
         if enable:
             if self.t2s_model is not None:
                 self.t2s_model = self.t2s_model.half()
+            if self.draft_t2s_model is not None:
+                self.draft_t2s_model = self.draft_t2s_model.half()
             if self.vits_model is not None:
                 self.vits_model = self.vits_model.half()
             if self.bert_model is not None:
@@ -692,6 +905,8 @@ class TTS:
         else:
             if self.t2s_model is not None:
                 self.t2s_model = self.t2s_model.float()
+            if self.draft_t2s_model is not None:
+                self.draft_t2s_model = self.draft_t2s_model.float()
             if self.vits_model is not None:
                 self.vits_model = self.vits_model.float()
             if self.bert_model is not None:
@@ -712,6 +927,8 @@ class TTS:
             self.configs.save_configs()
         if self.t2s_model is not None:
             self.t2s_model = self.t2s_model.to(device)
+        if self.draft_t2s_model is not None:
+            self.draft_t2s_model = self.draft_t2s_model.to(device)
         if self.vits_model is not None:
             self.vits_model = self.vits_model.to(device)
         if self.bert_model is not None:
@@ -722,6 +939,19 @@ class TTS:
             self.vocoder = self.vocoder.to(device)
         if self.sr_model is not None:
             self.sr_model = self.sr_model.to(device)
+        if self.sv_model is not None:
+            self.sv_model.embedding_model = self.sv_model.embedding_model.to(device)
+        self.text_preprocessor.device = device
+        # 已设置的参考音频与参考文本特征也迁移到新设备上, 缓存中的条目在命中时迁移
+        with self.prompt_lock:
+            for key in ("prompt_semantic", "raw_audio", "bert_features"):
+                if self.prompt_cache.get(key, None) is not None:
+                    self.prompt_cache[key] = self.prompt_cache[key].to(device)
+            if self.prompt_cache["refer_spec"]:
+                self.prompt_cache["refer_spec"] = [
+                    tuple(None if t is None else t.to(device) for t in item) for item in self.prompt_cache["refer_spec"]
+                ]
+            self.prompt_cache["vocoder_ref_cond"] = None
 
     def set_ref_audio(self, ref_audio_path: str):
         """
@@ -730,25 +960,51 @@ class TTS:
         Args:
             ref_audio_path: str, the path of the reference audio.
         """
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
-        self._set_ref_audio_path(ref_audio_path)
+        with self.prompt_lock:
+            self._set_prompt_semantic(ref_audio_path)
+            self._set_ref_spec(ref_audio_path)
+            self._set_ref_audio_path(ref_audio_path)
+
+    def _snapshot_prompt_cache(self) -> dict:
+        prompt_cache = dict(self.prompt_cache)
+        prompt_cache["refer_spec"] = list(self.prompt_cache["refer_spec"])
+        prompt_cache["aux_ref_audio_paths"] = list(self.prompt_cache["aux_ref_audio_paths"])
+        return prompt_cache
 
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path
 
     def _set_ref_spec(self, ref_audio_path):
-        spec_audio = self._get_ref_spec(ref_audio_path)
+        spec_audio = self._get_ref_spec(ref_audio_path, set_raw_audio=True)
         if self.prompt_cache["refer_spec"] in [[], None]:
             self.prompt_cache["refer_spec"] = [spec_audio]
         else:
             self.prompt_cache["refer_spec"][0] = spec_audio
 
-    def _get_ref_spec(self, ref_audio_path):
+    def _ref_cache_tag(self, kind: str) -> str:
+        if kind == "prompt_semantic":
+            # 语义token依赖CNHuBERT以及SoVITS模型中的ssl_proj和quantizer
+            return f"{self.configs.version}|{self.configs.vits_weights_path}|{self.configs.cnhuhbert_base_path}|{self.configs.is_half}"
+        return (
+            f"{self.configs.version}|{self.configs.sampling_rate}|{self.configs.filter_length}|"
+            f"{self.configs.hop_length}|{self.configs.win_length}|{self.configs.is_half}|{self.is_v2pro}"
+        )
+
+    def _get_ref_spec(self, ref_audio_path, set_raw_audio: bool = False):
+        cache_key = self.ref_audio_cache.make_key(ref_audio_path, "refer_spec", self._ref_cache_tag("refer_spec"))
+        entry = self.ref_audio_cache.get(cache_key, self.configs.device)
+        if entry is None:
+            entry = self._compute_ref_spec(ref_audio_path)
+            self.ref_audio_cache.put(cache_key, entry)
+
+        if set_raw_audio:
+            self.prompt_cache["raw_audio"] = entry["raw_audio"]
+            self.prompt_cache["raw_sr"] = int(entry["raw_sr"])
+        return entry["spec"], entry.get("audio_16k", None), entry.get("sv_emb", None)
+
+    def _compute_ref_spec(self, ref_audio_path) -> dict:
         raw_audio, raw_sr = torchaudio.load(ref_audio_path)
         raw_audio = raw_audio.to(self.configs.device).float()
-        self.prompt_cache["raw_audio"] = raw_audio
-        self.prompt_cache["raw_sr"] = raw_sr
 
         if raw_sr != self.configs.sampling_rate:
             audio = raw_audio.to(self.configs.device)
@@ -771,14 +1027,22 @@ class TTS:
         )
         if self.configs.is_half:
             spec = spec.half()
+        entry = {"raw_audio": raw_audio, "raw_sr": torch.tensor(raw_sr), "spec": spec}
         if self.is_v2pro == True:
             audio = resample(audio, self.configs.sampling_rate, 16000, self.configs.device)
             if self.configs.is_half:
                 audio = audio.half()
-        else:audio=None
-        return spec,audio
+            entry["audio_16k"] = audio
+            entry["sv_emb"] = self.sv_model.compute_embedding3(audio)
+        return entry
 
     def _set_prompt_semantic(self, ref_wav_path: str):
+        cache_key = self.ref_audio_cache.make_key(ref_wav_path, "prompt_semantic", self._ref_cache_tag("prompt_semantic"))
+        entry = self.ref_audio_cache.get(cache_key, self.configs.device)
+        if entry is not None:
+            self.prompt_cache["prompt_semantic"] = entry["prompt_semantic"]
+            return
+
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
             dtype=np.float16 if self.configs.is_half else np.float32,
@@ -803,6 +1067,7 @@ class TTS:
 
             prompt_semantic = codes[0, 0].to(self.configs.device)
             self.prompt_cache["prompt_semantic"] = prompt_semantic
+            self.ref_audio_cache.put(cache_key, {"prompt_semantic": prompt_semantic})
 
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length: int = None):
         seq = sequences[0]
@@ -965,6 +1230,8 @@ class TTS:
         Stop the inference process.
         """
         self.stop_flag = True
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.abort_all()
 
     @torch.no_grad()
     def run(self, inputs: dict):
@@ -994,7 +1261,14 @@ class TTS:
                     "parallel_infer": True,       # bool. whether to use parallel inference.
                     "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
                     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
+                    "cfm_solver": "euler",        # str. ODE solver of the V3/V4 CFM: "euler", "midpoint", "heun" or "rk4".
+                    "cfm_schedule": "uniform",    # str. timestep schedule of the V3/V4 CFM: "uniform", "sway" or "cosine".
                     "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                    "stream_chunk_size": 0,       # int. stream audio every N semantic tokens from inside the T2S decode loop (v3/v4: every N tokens worth of mel frames through the vocoder), 0 to disable.
+                    "loop_detection": True,       # bool. stop T2S rows that loop or exceed the length budget of their phonemes.
+                    "loop_retries": 1,            # int. decode such sentences again with another seed, up to N times.
+                    "t2s_events": None,           # list.(optional) filled with one dict per sentence whose T2S decoding was cut off or too short.
+                    "pipelined": False,           # bool. extract the text features of the next batch in a background thread while the current batch is synthesized (and, with return_fragment, synthesize the next batch while the current fragment is consumed).
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
@@ -1023,14 +1297,41 @@ class TTS:
         parallel_infer = inputs.get("parallel_infer", True)
         repetition_penalty = inputs.get("repetition_penalty", 1.35)
         sample_steps = inputs.get("sample_steps", 32)
+        cfm_kwargs = {"solver": inputs.get("cfm_solver", "euler"), "schedule": inputs.get("cfm_schedule", "uniform")}
         super_sampling = inputs.get("super_sampling", False)
+        stream_chunk_size = inputs.get("stream_chunk_size", 0)
+        loop_detection = inputs.get("loop_detection", True)
+        loop_retries = inputs.get("loop_retries", 1) if loop_detection else 0
+        t2s_events: list = inputs.get("t2s_events", None)
+        pipelined = inputs.get("pipelined", False)
 
         if parallel_infer:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+            if self.t2s_scheduler is not None:
+                infer_panel = self.t2s_scheduler.infer
+            elif self.speculative_config is not None:
+                print(i18n("投机解码已开启"))
+                infer_panel = partial(
+                    self.t2s_model.model.infer_panel_speculative,
+                    num_draft_tokens=self.speculative_config["num_draft_tokens"],
+                )
+            else:
+                infer_panel = self.t2s_model.model.infer_panel_batch_infer
         else:
             print(i18n("并行推理模式已关闭"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+            infer_panel = self.t2s_model.model.infer_panel_naive_batched
+
+        if stream_chunk_size > 0:
+            if self.configs.use_vocoder:
+                print(i18n("SoVits V3/4模型: 每句的语义Token生成后, CFM与声码器逐块流式返回"))
+                batch_size = 1
+            elif speed_factor != 1.0:
+                print(i18n("语速调节不支持逐Token流式返回，已自动切换为分段返回模式"))
+                stream_chunk_size = 0
+            else:
+                print(i18n("逐Token流式返回模式已开启"))
+                batch_size = 1
+            return_fragment = True
 
         if return_fragment:
             print(i18n("分段返回模式已开启"))
@@ -1073,52 +1374,57 @@ class TTS:
 
         ###### setting reference audio and prompt text preprocessing ########
         t0 = time.perf_counter()
-        if (ref_audio_path is not None) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
-
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
-
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
-                )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+        with self.prompt_lock:
+            if (ref_audio_path is not None) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
+                if not os.path.exists(ref_audio_path):
+                    raise ValueError(f"{ref_audio_path} not exists")
+                self.set_ref_audio(ref_audio_path)
+
+            aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
+            paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
+            if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+                self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
+                self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+                for path in aux_ref_audio_paths:
+                    if path in [None, ""]:
+                        continue
+                    if not os.path.exists(path):
+                        print(i18n("音频文件不存在，跳过："), path)
+                        continue
+                    self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+
+            if not no_prompt_text:
+                prompt_text = prompt_text.strip("\n")
+                if prompt_text[-1] not in splits:
+                    prompt_text += "。" if prompt_lang != "en" else "."
+                print(i18n("实际输入的参考文本:"), prompt_text)
+                if self.prompt_cache["prompt_text"] != prompt_text:
+                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                        prompt_text, prompt_lang, self.configs.version
+                    )
+                    self.prompt_cache["prompt_text"] = prompt_text
+                    self.prompt_cache["prompt_lang"] = prompt_lang
+                    self.prompt_cache["phones"] = phones
+                    self.prompt_cache["bert_features"] = bert_features
+                    self.prompt_cache["norm_text"] = norm_text
+            # 后续步骤只读取快照, 其他请求更换参考音频不会影响本次推理
+            prompt_cache = self._snapshot_prompt_cache()
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
         data: list = None
-        if not return_fragment:
+        batch_index_list: list = None
+        # 逐批次提取文本特征 (分段返回, 或流水线模式下不分桶时), 流水线模式下与前一批次的推理重叠进行
+        incremental = return_fragment or (pipelined and not split_bucket)
+        if not incremental:
             data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
             if len(data) == 0:
                 yield 16000, np.zeros(int(16000), dtype=np.int16)
                 return
 
-            batch_index_list: list = None
             data, batch_index_list = self.to_batch(
                 data,
-                prompt_data=self.prompt_cache if not no_prompt_text else None,
+                prompt_data=prompt_cache if not no_prompt_text else None,
                 batch_size=batch_size,
                 threshold=batch_threshold,
                 split_bucket=split_bucket,
@@ -1127,6 +1433,8 @@ class TTS:
             )
         else:
             print(f"############ {i18n('切分文本')} ############")
+            if not return_fragment:
+                text = self.text_preprocessor.replace_consecutive_punctuation(text)
             texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
             data = []
             for i in range(len(texts)):
@@ -1141,7 +1449,7 @@ class TTS:
                     phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
                         text, text_lang, self.configs.version
                     )
-                    if phones is None:
+                    if phones is None or norm_text == "":
                         continue
                     res = {
                         "phones": phones,
@@ -1153,7 +1461,7 @@ class TTS:
                     return None
                 batch, _ = self.to_batch(
                     batch_data,
-                    prompt_data=self.prompt_cache if not no_prompt_text else None,
+                    prompt_data=prompt_cache if not no_prompt_text else None,
                     batch_size=batch_size,
                     threshold=batch_threshold,
                     split_bucket=False,
@@ -1163,6 +1471,7 @@ class TTS:
                 return batch[0]
 
         t2 = time.perf_counter()
+        stages: List[BackgroundStage] = []
         try:
             print("############ 推理 ############")
             ###### inference ######
@@ -1170,13 +1479,117 @@ class TTS:
             t_45 = 0.0
             audio = []
             output_sr = self.configs.sampling_rate if not self.configs.use_vocoder else self.vocoder_configs["sr"]
-            for item in data:
-                t3 = time.perf_counter()
-                if return_fragment:
-                    item = make_batch(item)
-                    if item is None:
-                        continue
 
+            refer_audio_spec = []
+            if self.is_v2pro:sv_emb=[]
+            for spec, audio_tensor, sv_emb_item in prompt_cache["refer_spec"]:
+                spec=spec.to(dtype=self.precision, device=self.configs.device)
+                refer_audio_spec.append(spec)
+                if self.is_v2pro:
+                    sv_emb.append(sv_emb_item)
+
+            if not incremental:
+                batches = data
+            elif pipelined:
+                batches = BackgroundStage(make_batch, data, maxsize=2, name="TTSFrontend")
+                stages.append(batches)
+            else:
+                batches = (batch for batch in map(make_batch, data) if batch is not None)
+
+            if stream_chunk_size > 0:
+                for item in batches:
+                    t3 = time.perf_counter()
+                    batch_phones: List[torch.LongTensor] = item["phones"]
+                    # batch_phones:torch.LongTensor = item["phones"]
+                    batch_phones_len: torch.LongTensor = item["phones_len"]
+                    all_phoneme_ids: torch.LongTensor = item["all_phones"]
+                    all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
+                    all_bert_features: torch.LongTensor = item["all_bert_features"]
+                    norm_text: str = item["norm_text"]
+                    max_len = item["max_len"]
+
+                    print(i18n("前端处理后的文本(每句):"), norm_text)
+                    if no_prompt_text:
+                        prompt = None
+                    else:
+                        prompt = (
+                            prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                        )
+
+                    stop_reasons = []
+                    if self.configs.use_vocoder:
+                        print(f"############ {i18n('流式合成中')} ############")
+                        pred_semantic_list, idx_list = infer_panel(
+                            all_phoneme_ids,
+                            all_phoneme_lens,
+                            prompt,
+                            all_bert_features,
+                            top_k=top_k,
+                            top_p=top_p,
+                            temperature=temperature,
+                            early_stop_num=self.configs.hz * self.configs.max_sec,
+                            max_len=max_len,
+                            repetition_penalty=repetition_penalty,
+                            detect_loop=loop_detection,
+                            max_new_tokens=T2SLoopDetector.length_budget(batch_phones_len) if loop_detection else None,
+                            stop_reasons=stop_reasons,
+                        )
+                        # 语义token每秒25个, 换算为mel帧数
+                        frames_per_token = 3.875 if self.configs.version == "v3" else 4
+                        for audio_chunk in self.using_vocoder_synthesis_streaming(
+                            pred_semantic_list[0][-idx_list[0] :].unsqueeze(0).unsqueeze(0),
+                            batch_phones[0].unsqueeze(0).to(self.configs.device),
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            prompt_cache=prompt_cache,
+                            chunk_frames=int(stream_chunk_size * frames_per_token),
+                            **cfm_kwargs,
+                        ):
+                            # 逐块输出无法按整句归一化, 直接截断防止16bit爆音
+                            yield output_sr, (audio_chunk.float().clamp(-1, 1).cpu().numpy() * 32767).astype(np.int16)
+                            if self.stop_flag:
+                                break
+                        t_34 += time.perf_counter() - t3
+                        self.report_t2s_events(norm_text[:1], stop_reasons, idx_list, batch_phones_len[:1], 0, t2s_events)
+                        if self.stop_flag:
+                            yield 16000, np.zeros(int(16000), dtype=np.int16)
+                            return
+                        yield output_sr, np.zeros(int(output_sr * fragment_interval), dtype=np.int16)
+                        continue
+                    print(f"############ {i18n('流式合成中')} ############")
+                    for audio_chunk in self.token_streaming_synthesis(
+                        all_phoneme_ids[0].unsqueeze(0),
+                        all_phoneme_lens[:1],
+                        prompt,
+                        all_bert_features[0].unsqueeze(0),
+                        batch_phones[0],
+                        refer_audio_spec,
+                        sv_emb if self.is_v2pro else None,
+                        chunk_size=stream_chunk_size,
+                        top_k=top_k,
+                        top_p=top_p,
+                        temperature=temperature,
+                        early_stop_num=self.configs.hz * self.configs.max_sec,
+                        repetition_penalty=repetition_penalty,
+                        detect_loop=loop_detection,
+                        max_new_tokens=T2SLoopDetector.length_budget(batch_phones_len[:1]) if loop_detection else None,
+                        stop_reasons=stop_reasons,
+                    ):
+                        yield output_sr, audio_chunk
+                        if self.stop_flag:
+                            break
+                    t_34 += time.perf_counter() - t3
+                    # 音频已经发出, 只报告不重试
+                    self.report_t2s_events(norm_text[:1], stop_reasons, None, batch_phones_len[:1], 0, t2s_events)
+                    if self.stop_flag:
+                        yield 16000, np.zeros(int(16000), dtype=np.int16)
+                        return
+                    yield output_sr, np.zeros(int(output_sr * fragment_interval), dtype=np.int16)
+
+            def synthesize_batch(item):
+                # T2S 与 VITS/声码器, 返回该批次各句的音频
+                nonlocal t_34, t_45
+                t3 = time.perf_counter()
                 batch_phones: List[torch.LongTensor] = item["phones"]
                 # batch_phones:torch.LongTensor = item["phones"]
                 batch_phones_len: torch.LongTensor = item["phones_len"]
@@ -1191,34 +1604,61 @@ class TTS:
                     prompt = None
                 else:
                     prompt = (
-                        self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                        prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
                     )
 
+                stop_reasons = []
                 print(f"############ {i18n('预测语义Token')} ############")
-                pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
-                    all_phoneme_ids,
-                    all_phoneme_lens,
-                    prompt,
-                    all_bert_features,
-                    # prompt_phone_len=ph_offset,
+                t2s_kwargs = dict(
                     top_k=top_k,
                     top_p=top_p,
                     temperature=temperature,
                     early_stop_num=self.configs.hz * self.configs.max_sec,
                     max_len=max_len,
                     repetition_penalty=repetition_penalty,
+                    detect_loop=loop_detection,
+                    max_new_tokens=T2SLoopDetector.length_budget(batch_phones_len) if loop_detection else None,
+                )
+                pred_semantic_list, idx_list = infer_panel(
+                    all_phoneme_ids,
+                    all_phoneme_lens,
+                    prompt,
+                    all_bert_features,
+                    # prompt_phone_len=ph_offset,
+                    stop_reasons=stop_reasons,
+                    **t2s_kwargs,
+                )
+                retries = [0] * len(idx_list)
+                for attempt in range(1, loop_retries + 1):
+                    rows = [i for i, reason in enumerate(stop_reasons) if reason in ["loop", "budget"]]
+                    if len(rows) == 0:
+                        break
+                    print(i18n("语义Token生成异常的句子换随机种子重试:"), [norm_text[i] for i in rows])
+                    set_seed(actual_seed + attempt)
+                    index = torch.LongTensor(rows).to(all_phoneme_lens.device)
+                    retry_reasons = []
+                    retry_kwargs = dict(t2s_kwargs)
+                    if loop_detection:
+                        retry_kwargs["max_new_tokens"] = t2s_kwargs["max_new_tokens"][index]
+                    retry_semantic_list, retry_idx_list = infer_panel(
+                        [all_phoneme_ids[i] for i in rows],
+                        all_phoneme_lens[index],
+                        prompt[index.to(prompt.device)] if prompt is not None else None,
+                        [all_bert_features[i] for i in rows],
+                        stop_reasons=retry_reasons,
+                        **retry_kwargs,
+                    )
+                    for j, i in enumerate(rows):
+                        pred_semantic_list[i] = retry_semantic_list[j]
+                        idx_list[i] = retry_idx_list[j]
+                        stop_reasons[i] = retry_reasons[j]
+                        retries[i] = attempt
+                self.report_t2s_events(
+                    norm_text, stop_reasons, idx_list if prompt is not None else None, batch_phones_len, retries, t2s_events
                 )
                 t4 = time.perf_counter()
                 t_34 += t4 - t3
 
-                refer_audio_spec = []
-                if self.is_v2pro:sv_emb=[]
-                for spec,audio_tensor in self.prompt_cache["refer_spec"]:
-                    spec=spec.to(dtype=self.precision, device=self.configs.device)
-                    refer_audio_spec.append(spec)
-                    if self.is_v2pro:
-                        sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
-
                 batch_audio_fragment = []
 
                 # ## vits并行推理 method 1
@@ -1274,7 +1714,13 @@ class TTS:
                     if parallel_infer:
                         print(f"{i18n('并行合成中')}...")
                         audio_fragments = self.using_vocoder_synthesis_batched_infer(
-                            idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
+                            idx_list,
+                            pred_semantic_list,
+                            batch_phones,
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            prompt_cache=prompt_cache,
+                            **cfm_kwargs,
                         )
                         batch_audio_fragment.extend(audio_fragments)
                     else:
@@ -1284,7 +1730,12 @@ class TTS:
                                 pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
                             )  # .unsqueeze(0)#mq要多unsqueeze一次
                             audio_fragment = self.using_vocoder_synthesis(
-                                _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
+                                _pred_semantic,
+                                phones,
+                                speed=speed_factor,
+                                sample_steps=sample_steps,
+                                prompt_cache=prompt_cache,
+                                **cfm_kwargs,
                             )
                             batch_audio_fragment.append(audio_fragment)
 
@@ -1292,21 +1743,32 @@ class TTS:
                 t_45 += t5 - t4
                 if return_fragment:
                     print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t4 - t3, t5 - t4))
-                    yield self.audio_postprocess(
-                        [batch_audio_fragment],
-                        output_sr,
-                        None,
-                        speed_factor,
-                        False,
-                        fragment_interval,
-                        super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
-                    )
+                return batch_audio_fragment
+
+            if stream_chunk_size == 0:
+                if pipelined and return_fragment:
+                    # 推理在后台线程中进行, 当前线程负责后处理以及调用方对音频的编码/发送
+                    results = BackgroundStage(synthesize_batch, batches, maxsize=1, name="TTSInference")
+                    stages.append(results)
                 else:
-                    audio.append(batch_audio_fragment)
+                    results = map(synthesize_batch, batches)
+                for batch_audio_fragment in results:
+                    if return_fragment:
+                        yield self.audio_postprocess(
+                            [batch_audio_fragment],
+                            output_sr,
+                            None,
+                            speed_factor,
+                            False,
+                            fragment_interval,
+                            super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
+                        )
+                    else:
+                        audio.append(batch_audio_fragment)
 
-                if self.stop_flag:
-                    yield 16000, np.zeros(int(16000), dtype=np.int16)
-                    return
+                    if self.stop_flag:
+                        yield 16000, np.zeros(int(16000), dtype=np.int16)
+                        return
 
             if not return_fragment:
                 print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t_34, t_45))
@@ -1327,6 +1789,9 @@ class TTS:
             traceback.print_exc()
             # 必须返回一个空音频, 否则会导致显存不释放。
             yield 16000, np.zeros(int(16000), dtype=np.int16)
+            # 等待后台线程结束当前批次, 再重置模型
+            for stage in stages:
+                stage.close(wait=True)
             # 重置模型, 否则会导致显存释放不完全。
             del self.t2s_model
             del self.vits_model
@@ -1336,8 +1801,40 @@ class TTS:
             self.init_vits_weights(self.configs.vits_weights_path)
             raise e
         finally:
+            for stage in stages:
+                stage.close()
             self.empty_cache()
 
+    def report_t2s_events(
+        self,
+        norm_text: List[str],
+        stop_reasons: List[str],
+        idx_list: List[int],
+        phones_len: torch.LongTensor,
+        retries: Union[int, List[int]],
+        t2s_events: list = None,
+    ):
+        """
+        Log the sentences whose semantic tokens are suspicious and append them to `t2s_events`:
+        cut off by the `T2SLoopDetector` ("loop" / "budget"), or ended by EOS with fewer tokens than
+        the fastest speech rate allows ("short"). `idx_list` is None when the token counts are unknown.
+        """
+        min_lengths = T2SLoopDetector.min_length(phones_len).tolist()
+        for i, reason in enumerate(stop_reasons):
+            if reason == "eos" and idx_list is not None and idx_list[i] < min_lengths[i]:
+                reason = "short"
+            if reason not in ["loop", "budget", "short"]:
+                continue
+            event = {
+                "text": norm_text[i],
+                "reason": reason,
+                "tokens": idx_list[i] if idx_list is not None else None,
+                "retries": retries[i] if isinstance(retries, list) else retries,
+            }
+            print(i18n("语义Token生成异常:"), event)
+            if t2s_events is not None:
+                t2s_events.append(event)
+
     def empty_cache(self):
         try:
             gc.collect()  # 触发gc的垃圾回收。避免内存一直增长。
@@ -1402,19 +1899,30 @@ class TTS:
 
         return sr, audio
 
-    def using_vocoder_synthesis(
-        self, semantic_tokens: torch.Tensor, phones: torch.Tensor, speed: float = 1.0, sample_steps: int = 32
-    ):
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
+    def _get_vocoder_ref_cond(self, prompt_cache: dict):
+        """
+        The conditioning of the v3/v4 CFM that only depends on the reference voice: the refer spec, fea_ref and ge of
+        the prompt semantic and phones, and the normalized mel of the reference audio (mel2), trimmed to T_ref.
+
+        Cached in prompt_cache["vocoder_ref_cond"] together with the objects it was computed from, so a different reference
+        audio or prompt text, precision or device makes it recompute. Loading other SoVITS weights or another vocoder clears it.
+        """
+        raw_entry = prompt_cache["refer_spec"][0]
         if isinstance(raw_entry, tuple):
             raw_entry = raw_entry[0]
+        key = (prompt_cache["prompt_semantic"], prompt_cache["phones"], raw_entry, prompt_cache["raw_audio"])
+        tag = (self.precision, str(self.configs.device))
+        cached = self.prompt_cache.get("vocoder_ref_cond", None)
+        if cached is not None and cached[1] == tag and all(a is b for a, b in zip(cached[0], key)):
+            return cached[2]
+
+        prompt_semantic_tokens = prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
+        prompt_phones = torch.LongTensor(prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
         refer_audio_spec = raw_entry.to(dtype=self.precision,device=self.configs.device)
 
         fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
+        ref_audio: torch.Tensor = prompt_cache["raw_audio"]
+        ref_sr = prompt_cache["raw_sr"]
         ref_audio = ref_audio.to(self.configs.device).float()
         if ref_audio.shape[0] == 2:
             ref_audio = ref_audio.mean(0).unsqueeze(0)
@@ -1430,17 +1938,70 @@ class TTS:
         mel2 = mel2[:, :, :T_min]
         fea_ref = fea_ref[:, :, :T_min]
         T_ref = self.vocoder_configs["T_ref"]
-        T_chunk = self.vocoder_configs["T_chunk"]
         if T_min > T_ref:
             mel2 = mel2[:, :, -T_ref:]
             fea_ref = fea_ref[:, :, -T_ref:]
-            T_min = T_ref
-        chunk_len = T_chunk - T_min
 
         mel2 = mel2.to(self.precision)
+        ref_cond = (refer_audio_spec, fea_ref, ge, mel2)
+        # 整体替换, 并发的请求读到的总是完整的一项
+        self.prompt_cache["vocoder_ref_cond"] = (key, tag, ref_cond)
+        return ref_cond
+
+    def using_vocoder_synthesis(
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        prompt_cache: dict = None,
+        solver: str = "euler",
+        schedule: str = "uniform",
+    ):
+        audio_chunks = self.using_vocoder_synthesis_streaming(
+            semantic_tokens,
+            phones,
+            speed=speed,
+            sample_steps=sample_steps,
+            prompt_cache=prompt_cache,
+            solver=solver,
+            schedule=schedule,
+        )
+        return torch.cat(list(audio_chunks), 0)
+
+    def using_vocoder_synthesis_streaming(
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        prompt_cache: dict = None,
+        solver: str = "euler",
+        schedule: str = "uniform",
+        chunk_frames: int = None,
+    ):
+        """
+        The CFM runs chunk by chunk as before, every mel chunk goes into a `StreamingVocoder` right away,
+        so the audio comes out while the later chunks are still being generated.
+
+        Args:
+            chunk_frames: int, the number of mel frames of every vocoder call, T_chunk if None.
+
+        Yields:
+            torch.Tensor: 1D audio chunks at `self.vocoder_configs["sr"]`.
+        """
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        refer_audio_spec, fea_ref, ge, mel2 = self._get_vocoder_ref_cond(prompt_cache)
+        T_min = mel2.shape[2]
+        chunk_len = self.vocoder_configs["T_chunk"] - T_min
+
         fea_todo, ge = self.vits_model.decode_encp(semantic_tokens, phones, refer_audio_spec, ge, speed)
+        streaming_vocoder = StreamingVocoder(
+            self.vocoder,
+            self.vocoder_configs["upsample_rate"],
+            chunk_frames=chunk_frames if chunk_frames is not None else self.vocoder_configs["T_chunk"],
+        )
 
-        cfm_resss = []
         idx = 0
         while 1:
             fea_todo_chunk = fea_todo[:, :, idx : idx + chunk_len]
@@ -1450,22 +2011,21 @@ class TTS:
             fea = torch.cat([fea_ref, fea_todo_chunk], 2).transpose(2, 1)
 
             cfm_res = self.vits_model.cfm.inference(
-                fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+                fea,
+                torch.LongTensor([fea.size(1)]).to(fea.device),
+                mel2,
+                sample_steps,
+                inference_cfg_rate=0,
+                solver=solver,
+                schedule=schedule,
             )
             cfm_res = cfm_res[:, :, mel2.shape[2] :]
 
             mel2 = cfm_res[:, :, -T_min:]
             fea_ref = fea_todo_chunk[:, :, -T_min:]
 
-            cfm_resss.append(cfm_res)
-        cfm_res = torch.cat(cfm_resss, 2)
-        cfm_res = denorm_spec(cfm_res)
-
-        with torch.inference_mode():
-            wav_gen = self.vocoder(cfm_res)
-            audio = wav_gen[0][0]  # .cpu().detach().numpy()
-
-        return audio
+            yield from streaming_vocoder.push(denorm_spec(cfm_res))
+        yield from streaming_vocoder.flush()
 
     def using_vocoder_synthesis_batched_infer(
         self,
@@ -1474,40 +2034,14 @@ class TTS:
         batch_phones: List[torch.Tensor],
         speed: float = 1.0,
         sample_steps: int = 32,
+        prompt_cache: dict = None,
+        solver: str = "euler",
+        schedule: str = "uniform",
     ) -> List[torch.Tensor]:
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
-        if isinstance(raw_entry, tuple):
-            raw_entry = raw_entry[0]
-        refer_audio_spec = raw_entry.to(dtype=self.precision,device=self.configs.device)
-
-        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
-        ref_audio = ref_audio.to(self.configs.device).float()
-        if ref_audio.shape[0] == 2:
-            ref_audio = ref_audio.mean(0).unsqueeze(0)
-
-        # tgt_sr = self.vocoder_configs["sr"]
-        tgt_sr = 24000 if self.configs.version == "v3" else 32000
-        if ref_sr != tgt_sr:
-            ref_audio = resample(ref_audio, ref_sr, tgt_sr, self.configs.device)
-
-        mel2 = mel_fn(ref_audio) if self.configs.version == "v3" else mel_fn_v4(ref_audio)
-        mel2 = norm_spec(mel2)
-        T_min = min(mel2.shape[2], fea_ref.shape[2])
-        mel2 = mel2[:, :, :T_min]
-        fea_ref = fea_ref[:, :, :T_min]
-        T_ref = self.vocoder_configs["T_ref"]
-        T_chunk = self.vocoder_configs["T_chunk"]
-        if T_min > T_ref:
-            mel2 = mel2[:, :, -T_ref:]
-            fea_ref = fea_ref[:, :, -T_ref:]
-            T_min = T_ref
-        chunk_len = T_chunk - T_min
-
-        mel2 = mel2.to(self.precision)
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        refer_audio_spec, fea_ref, ge, mel2 = self._get_vocoder_ref_cond(prompt_cache)
+        T_min = mel2.shape[2]
+        chunk_len = self.vocoder_configs["T_chunk"] - T_min
 
         # #### batched inference
         overlapped_len = self.vocoder_configs["overlapped_len"]
@@ -1549,7 +2083,13 @@ class TTS:
         fea_ref = fea_ref.repeat(bs, 1, 1)
         fea = torch.cat([fea_ref, feat_chunks], 2).transpose(2, 1)
         pred_spec = self.vits_model.cfm.inference(
-            fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+            fea,
+            torch.LongTensor([fea.size(1)]).to(fea.device),
+            mel2,
+            sample_steps,
+            inference_cfg_rate=0,
+            solver=solver,
+            schedule=schedule,
         )
         pred_spec = pred_spec[:, :, -chunk_len:]
         dd = pred_spec.shape[1]
@@ -1558,9 +2098,11 @@ class TTS:
 
         pred_spec = denorm_spec(pred_spec)
 
-        with torch.no_grad():
-            wav_gen = self.vocoder(pred_spec)
-            audio = wav_gen[0][0]  # .cpu().detach().numpy()
+        # 分块送入声码器, 显存不随batch的总长度增长
+        streaming_vocoder = StreamingVocoder(
+            self.vocoder, self.vocoder_configs["upsample_rate"], chunk_frames=self.vocoder_configs["T_chunk"]
+        )
+        audio = torch.cat(list(streaming_vocoder([pred_spec])), 0)
 
         audio_fragments = []
         upsample_rate = self.vocoder_configs["upsample_rate"]
@@ -1582,6 +2124,78 @@ class TTS:
 
         return audio_fragments
 
+    def token_streaming_synthesis(
+        self,
+        x: torch.LongTensor,
+        x_lens: torch.LongTensor,
+        prompt: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        phones: torch.LongTensor,
+        refer_audio_spec: List[torch.Tensor],
+        sv_emb: List[torch.Tensor] = None,
+        chunk_size: int = 24,
+        overlap_tokens: int = 2,
+        context_tokens: int = 24,
+        **kwargs,
+    ):
+        """
+        Stream one sentence from inside the T2S decode loop (SoVITS v1/v2/v2Pro).
+
+        Every `chunk_size` new semantic tokens are decoded by SoVITS with up to `context_tokens`
+        earlier tokens as left context, whose audio is dropped. The last `overlap_tokens` of every
+        chunk are held back and cross-faded into the next chunk with `sola_algorithm`.
+
+        Args:
+            x, x_lens, prompt, bert_feature: the inputs of `infer_panel_naive_streaming` (batch size 1).
+            phones (torch.LongTensor): the phones of the sentence, shape [T].
+            refer_audio_spec (List[torch.Tensor]): the reference spectrograms.
+            sv_emb (List[torch.Tensor]): the speaker embeddings of the references (v2Pro only).
+            **kwargs: the sampling parameters of the T2S model.
+
+        Yields:
+            np.ndarray: int16 audio chunks at `self.configs.sampling_rate`.
+        """
+        phones = phones.unsqueeze(0).to(self.configs.device)
+        chunk_size = max(chunk_size, overlap_tokens + 1)
+        samples_per_token = 2 * math.prod(self.vits_model.upsample_rates)
+        overlap_len = overlap_tokens * samples_per_token
+
+        def to_int16(audio: torch.Tensor) -> np.ndarray:
+            # 逐块输出无法按整句归一化, 直接截断防止16bit爆音
+            return (audio.float().clamp(-1, 1).cpu().numpy() * 32767).astype(np.int16)
+
+        semantic_chunks = []
+        decoded_len = 0
+        held_audio: torch.Tensor = None
+        for new_tokens, is_last in self.t2s_model.model.infer_panel_naive_streaming(
+            x, x_lens, prompt, bert_feature, chunk_size=chunk_size, **kwargs
+        ):
+            semantic_chunks.append(new_tokens)
+            semantic = torch.cat(semantic_chunks, dim=1)
+            if semantic.shape[1] == decoded_len:
+                if held_audio is not None:
+                    yield to_int16(held_audio)
+                return
+
+            if held_audio is None:
+                start = 0
+            else:
+                # 新音频从上一块保留的重叠部分开始, 更早的token只作为上下文
+                start = max(decoded_len - overlap_tokens - context_tokens, 0)
+            audio = self.vits_model.decode(
+                semantic[:, start:].unsqueeze(0), phones, refer_audio_spec, sv_emb=sv_emb
+            ).detach()[0, 0, :]
+            if held_audio is not None:
+                audio = audio[(decoded_len - overlap_tokens - start) * samples_per_token :]
+                audio = self.sola_algorithm([held_audio, audio], overlap_len)
+            decoded_len = semantic.shape[1]
+
+            if is_last:
+                yield to_int16(audio)
+                return
+            held_audio = audio[-overlap_len:]
+            yield to_int16(audio[:-overlap_len])
+
     def sola_algorithm(
         self,
         audio_fragments: List[torch.Tensor],
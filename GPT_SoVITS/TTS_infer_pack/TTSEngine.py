@@ -0,0 +1,169 @@
+import gc
+import os
+import threading
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+import torch
+
+from TTS_infer_pack.TTS import TTS, TTS_Config
+
+# 与 inference_webui 的下拉选项一致, 便于直接传入界面上的中文名称
+language_names = {
+    "中文": "all_zh",
+    "英文": "en",
+    "日文": "all_ja",
+    "粤语": "all_yue",
+    "韩文": "all_ko",
+    "中英混合": "zh",
+    "日英混合": "ja",
+    "粤英混合": "yue",
+    "韩英混合": "ko",
+    "多语种混合": "auto",
+    "多语种混合(粤语)": "auto_yue",
+}
+cut_method_names = {
+    "不切": "cut0",
+    "凑四句一切": "cut1",
+    "凑50字一切": "cut2",
+    "按中文句号。切": "cut3",
+    "按英文句号.切": "cut4",
+    "按标点符号切": "cut5",
+}
+
+
+class TTSEngine:
+    """
+    Headless entry point of the inference pipeline for servers and scripts: no gradio, no argv / env parsing
+    and no module level models, unlike `inference_webui.get_tts_wav`.
+
+    The models are only loaded by the first synthesis (or an explicit `load()`), every engine owns its own
+    `TTS` pipeline, so several engines with different weights can live in one process.
+
+    Args:
+        configs: a `TTS_Config`, a config dict or the path of a tts_infer.yaml, the default config if None.
+        t2s_weights_path / vits_weights_path / device / is_half: override the corresponding config entries.
+
+    Example:
+        engine = TTSEngine("GPT_SoVITS/configs/tts_infer.yaml", device="cuda", is_half=True)
+        sr, audio = engine.synthesize_full("你好", "中文", "ref.wav", "参考文本", "中文")
+    """
+
+    def __init__(
+        self,
+        configs: Union[dict, str, TTS_Config] = None,
+        t2s_weights_path: str = None,
+        vits_weights_path: str = None,
+        device: str = None,
+        is_half: bool = None,
+    ):
+        self.configs: TTS_Config = configs if isinstance(configs, TTS_Config) else TTS_Config(configs)
+        if device is not None:
+            self.configs.device = device
+        if is_half is not None:
+            self.configs.is_half = is_half
+        if t2s_weights_path is not None:
+            self.configs.t2s_weights_path = t2s_weights_path
+        if vits_weights_path is not None:
+            self.configs.vits_weights_path = vits_weights_path
+        self._tts: TTS = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._tts is not None
+
+    @property
+    def tts(self) -> TTS:
+        """
+        The underlying pipeline, loaded on first access.
+        """
+        if self._tts is None:
+            with self._load_lock:
+                if self._tts is None:
+                    self._tts = TTS(self.configs)
+        return self._tts
+
+    def load(self) -> "TTSEngine":
+        self.tts
+        return self
+
+    def unload(self):
+        """
+        Drop the models, the next synthesis loads them again.
+        """
+        with self._load_lock:
+            if self._tts is None:
+                return
+            self._tts.stop()
+            self._tts = None
+        gc.collect()
+        if "cuda" in str(self.configs.device):
+            torch.cuda.empty_cache()
+
+    def stop(self):
+        if self._tts is not None:
+            self._tts.stop()
+
+    @staticmethod
+    def get_language(lang: str) -> str:
+        """
+        Map a webui language name ("中文", "中英混合", ...) to its code, codes pass through unchanged.
+        """
+        return language_names.get(lang, lang.lower() if isinstance(lang, str) else lang)
+
+    @staticmethod
+    def get_cut_method(method: str) -> str:
+        return cut_method_names.get(method, method)
+
+    def synthesize(
+        self,
+        text: str,
+        text_lang: str,
+        ref_audio_path: str,
+        prompt_text: str = "",
+        prompt_lang: str = "auto",
+        aux_ref_audio_paths: List[str] = None,
+        text_split_method: str = "cut5",
+        return_fragment: bool = True,
+        **kwargs,
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Yield (sampling rate, int16 audio) like `TTS.run`, one item per fragment when `return_fragment`,
+        otherwise a single item with the whole audio.
+
+        Args:
+            text_lang / prompt_lang: a language code of `TTS_Config.languages` or a webui language name.
+            text_split_method: a cut method name ("cut0"...) or its webui name ("不切"...).
+            kwargs: any other input of `TTS.run` (top_k, speed_factor, sample_steps, stream_chunk_size, ...).
+        """
+        text_lang = self.get_language(text_lang)
+        prompt_lang = self.get_language(prompt_lang)
+        if text_lang not in self.configs.languages:
+            raise ValueError(f"text_lang: {text_lang} is not supported in version {self.configs.version}")
+        if prompt_lang not in self.configs.languages:
+            raise ValueError(f"prompt_lang: {prompt_lang} is not supported in version {self.configs.version}")
+        if not os.path.exists(ref_audio_path):
+            raise FileNotFoundError(f"ref_audio_path: {ref_audio_path} does not exist")
+
+        inputs = dict(kwargs)
+        inputs.update(
+            {
+                "text": text,
+                "text_lang": text_lang,
+                "ref_audio_path": ref_audio_path,
+                "aux_ref_audio_paths": aux_ref_audio_paths or [],
+                "prompt_text": prompt_text,
+                "prompt_lang": prompt_lang,
+                "text_split_method": self.get_cut_method(text_split_method),
+                "return_fragment": return_fragment,
+            }
+        )
+        yield from self.tts.run(inputs)
+
+    def synthesize_full(self, *args, **kwargs) -> Tuple[int, np.ndarray]:
+        """
+        `synthesize` with `return_fragment=False`, returns the whole audio.
+        """
+        kwargs["return_fragment"] = False
+        return next(iter(self.synthesize(*args, **kwargs)))
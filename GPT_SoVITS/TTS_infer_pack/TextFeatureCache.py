@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+class TextFeatureCache:
+    """
+    Phones, word2ph, norm_text and BERT features of a sentence, keyed by (sentence, language, version)
+    plus a tag of the BERT model that produced them.
+
+    The memory tier is an LRU bounded by the total bytes of the cached entries. If `cache_dir` is set,
+    every entry is also written there as a safetensors file (norm_text and word2ph go into the metadata),
+    so the prompt text and sentences repeated across requests or processes skip g2p and the BERT forward.
+    The BERT features are returned on the device passed to `get`, whichever device they were computed on.
+
+    Args:
+        max_bytes (int): the memory budget of the memory tier, 0 disables it.
+        cache_dir (str): the directory of the disk tier, None disables it.
+        tag (str): identifies the BERT model, entries from another model never match.
+    """
+
+    def __init__(self, max_bytes: int = 256 << 20, cache_dir: str = None, tag: str = ""):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.tag = tag
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.entries: OrderedDict = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def make_key(self, text: str, language: str, version: str) -> str:
+        return hashlib.sha1(f"{text}|{language}|{version}|{self.tag}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def entry_bytes(entry: Dict) -> int:
+        size = entry["bert"].numel() * entry["bert"].element_size()
+        size += 8 * len(entry["phones"]) + 8 * len(entry["word2ph"] or []) + len(entry["norm_text"].encode("utf-8"))
+        return size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def get(self, key: str, device: torch.device = None) -> Optional[Dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            # 共享同一缓存的流水线可能在不同的设备上, 命中时迁移到调用方的设备
+            if device is not None:
+                entry = dict(entry, bert=entry["bert"].to(device))
+            return entry
+
+        if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                entry = self._load(self._disk_path(key), device)
+            except Exception as e:
+                print(f"Failed to load text feature cache {self._disk_path(key)}: {e}")
+                entry = None
+            if entry is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                self._put_memory(key, entry)
+                return entry
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(
+        self, key: str, phones: List[int], word2ph: Optional[List[int]], bert: torch.Tensor, norm_text: str
+    ) -> Dict:
+        entry = {"phones": phones, "word2ph": word2ph, "bert": bert, "norm_text": norm_text}
+        self._put_memory(key, entry)
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            metadata = {"norm_text": norm_text, "word2ph": json.dumps(word2ph)}
+            try:
+                save_file(
+                    {"phones": torch.LongTensor(phones), "bert": bert.detach().contiguous().cpu()},
+                    tmp_path,
+                    metadata=metadata,
+                )
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Failed to save text feature cache {path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return entry
+
+    def _load(self, path: str, device: torch.device = None) -> Dict:
+        with safe_open(path, framework="pt", device=str(device) if device is not None else "cpu") as f:
+            metadata = f.metadata()
+            return {
+                "phones": f.get_tensor("phones").tolist(),
+                "word2ph": json.loads(metadata["word2ph"]),
+                "bert": f.get_tensor("bert"),
+                "norm_text": metadata["norm_text"],
+            }
+
+    def _put_memory(self, key: str, entry: Dict):
+        size = self.entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entry_bytes(self.entries.pop(key))
+            self.entries[key] = entry
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= self.entry_bytes(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "items": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -16,6 +16,7 @@ from text.cleaner import clean_text
 from text import cleaned_text_to_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
+from TTS_infer_pack.TextFeatureCache import TextFeatureCache
 
 from tools.i18n.i18n import I18nAuto, scan_language_list
 
@@ -50,11 +51,20 @@ def merge_short_text_in_array(texts: str, threshold: int) -> list:
 
 
 class TextPreprocessor:
-    def __init__(self, bert_model: AutoModelForMaskedLM, tokenizer: AutoTokenizer, device: torch.device):
+    def __init__(
+        self,
+        bert_model: AutoModelForMaskedLM,
+        tokenizer: AutoTokenizer,
+        device: torch.device,
+        feature_cache: TextFeatureCache = None,
+    ):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
         self.bert_lock = threading.RLock()
+        self.feature_cache = feature_cache
+        # 批量提取BERT特征时每次前向的token上限 (含padding)
+        self.bert_batch_tokens = 4096
 
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
         print(f"############ {i18n('切分文本')} ############")
@@ -62,8 +72,7 @@ class TextPreprocessor:
         texts = self.pre_seg_text(text, lang, text_split_method)
         result = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        for phones, bert_features, norm_text in self.extract_features_batched(texts, lang, version):
             if phones is None or norm_text == "":
                 continue
             res = {
@@ -119,72 +128,153 @@ class TextPreprocessor:
     ) -> Tuple[list, torch.Tensor, str]:
         return self.get_phones_and_bert(text, language, version)
 
+    def _cache_key(self, text: str, language: str, version: str) -> Tuple[str, str]:
+        if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
+            # 这些语种下连续空格本来就会被合并, 合并后再作为缓存键
+            while "  " in text:
+                text = text.replace("  ", " ")
+        if self.feature_cache is None:
+            return text, None
+        return text, self.feature_cache.make_key(text, language, version)
+
     def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
+        if self.feature_cache is None or final:
+            phones, word2ph, bert, norm_text = self._get_phones_and_bert(text, language, version, final)
+            return phones, bert, norm_text
+
+        text, cache_key = self._cache_key(text, language, version)
+        entry = self.feature_cache.get(cache_key, self.device)
+        if entry is None:
+            phones, word2ph, bert, norm_text = self._get_phones_and_bert(text, language, version)
+            entry = self.feature_cache.put(cache_key, phones, word2ph, bert, norm_text)
+        return list(entry["phones"]), entry["bert"], entry["norm_text"]
+
+    def extract_features_batched(
+        self, texts: List[str], language: str, version: str
+    ) -> List[Tuple[list, torch.Tensor, str]]:
+        """
+        `get_phones_and_bert` for a list of sentences, the BERT features of all their Chinese segments
+        are extracted with batched forwards (see `get_bert_features_batched`).
+        """
+        results = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+        cache_keys: Dict[str, str] = {}
+        for i, text in enumerate(texts):
+            text, cache_key = self._cache_key(text, language, version)
+            entry = self.feature_cache.get(cache_key, self.device) if cache_key is not None else None
+            if entry is not None:
+                results[i] = (list(entry["phones"]), entry["bert"], entry["norm_text"])
+                continue
+            pending.setdefault(text, []).append(i)
+            cache_keys[text] = cache_key
+
         with self.bert_lock:
-            if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
-                # language = language.replace("all_","")
-                formattext = text
-                while "  " in formattext:
-                    formattext = formattext.replace("  ", " ")
-                if language == "all_zh":
-                    if re.search(r"[A-Za-z]", formattext):
-                        formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
-                        formattext = chinese.mix_text_normalize(formattext)
-                        return self.get_phones_and_bert(formattext, "zh", version)
-                    else:
-                        phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                        bert = self.get_bert_feature(norm_text, word2ph).to(self.device)
-                elif language == "all_yue" and re.search(r"[A-Za-z]", formattext):
+            plans = {text: self._segment_and_g2p(text, language, version) for text in tqdm(pending)}
+            jobs = [(text, j) for text, segments in plans.items() for j, segment in enumerate(segments) if segment[3]]
+            berts = self.get_bert_features_batched(
+                [plans[text][j][2] for text, j in jobs], [plans[text][j][1] for text, j in jobs]
+            )
+        segment_berts = {job: bert for job, bert in zip(jobs, berts)}
+
+        for text, indexes in pending.items():
+            phones, word2ph, bert, norm_text = self._merge_segments(
+                plans[text], [segment_berts.get((text, j), None) for j in range(len(plans[text]))]
+            )
+            if cache_keys[text] is not None:
+                self.feature_cache.put(cache_keys[text], phones, word2ph, bert, norm_text)
+            for i in indexes:
+                results[i] = (list(phones), bert, norm_text)
+        return results
+
+    def _get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
+        with self.bert_lock:
+            segments = self._segment_and_g2p(text, language, version, final)
+            berts = [
+                self.get_bert_feature(norm_text, word2ph) if need_bert else None
+                for _, word2ph, norm_text, need_bert in segments
+            ]
+            return self._merge_segments(segments, berts)
+
+    def _segment_and_g2p(self, text: str, language: str, version: str, final: bool = False) -> List[tuple]:
+        """
+        Language segmentation and g2p of a sentence.
+
+        Returns:
+            List[tuple]: (phones, word2ph, norm_text, need_bert) of every segment,
+                BERT features are only extracted for the Chinese segments.
+        """
+        if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
+            # language = language.replace("all_","")
+            formattext = text
+            while "  " in formattext:
+                formattext = formattext.replace("  ", " ")
+            if language == "all_zh":
+                if re.search(r"[A-Za-z]", formattext):
                     formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
                     formattext = chinese.mix_text_normalize(formattext)
-                    return self.get_phones_and_bert(formattext, "yue", version)
+                    return self._segment_and_g2p(formattext, "zh", version)
                 else:
                     phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                    bert = torch.zeros(
-                        (1024, len(phones)),
-                        dtype=torch.float32,
-                    ).to(self.device)
-            elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
-                textlist = []
-                langlist = []
-                if language == "auto":
-                    for tmp in LangSegmenter.getTexts(text):
-                        langlist.append(tmp["lang"])
-                        textlist.append(tmp["text"])
-                elif language == "auto_yue":
-                    for tmp in LangSegmenter.getTexts(text):
-                        if tmp["lang"] == "zh":
-                            tmp["lang"] = "yue"
+                    segments = [(phones, word2ph, norm_text, True)]
+            elif language == "all_yue" and re.search(r"[A-Za-z]", formattext):
+                formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
+                formattext = chinese.mix_text_normalize(formattext)
+                return self._segment_and_g2p(formattext, "yue", version)
+            else:
+                phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
+                segments = [(phones, word2ph, norm_text, False)]
+        elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
+            textlist = []
+            langlist = []
+            if language == "auto":
+                for tmp in LangSegmenter.getTexts(text):
+                    langlist.append(tmp["lang"])
+                    textlist.append(tmp["text"])
+            elif language == "auto_yue":
+                for tmp in LangSegmenter.getTexts(text):
+                    if tmp["lang"] == "zh":
+                        tmp["lang"] = "yue"
+                    langlist.append(tmp["lang"])
+                    textlist.append(tmp["text"])
+            else:
+                for tmp in LangSegmenter.getTexts(text):
+                    if tmp["lang"] == "en":
                         langlist.append(tmp["lang"])
-                        textlist.append(tmp["text"])
-                else:
-                    for tmp in LangSegmenter.getTexts(text):
-                        if tmp["lang"] == "en":
-                            langlist.append(tmp["lang"])
-                        else:
-                            # 因无法区别中日韩文汉字,以用户输入为准
-                            langlist.append(language)
-                        textlist.append(tmp["text"])
-                # print(textlist)
-                # print(langlist)
-                phones_list = []
-                bert_list = []
-                norm_text_list = []
-                for i in range(len(textlist)):
-                    lang = langlist[i]
-                    phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                    bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                    phones_list.append(phones)
-                    norm_text_list.append(norm_text)
-                    bert_list.append(bert)
-                bert = torch.cat(bert_list, dim=1)
-                phones = sum(phones_list, [])
-                norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
+                    else:
+                        # 因无法区别中日韩文汉字,以用户输入为准
+                        langlist.append(language)
+                    textlist.append(tmp["text"])
+            # print(textlist)
+            # print(langlist)
+            segments = []
+            for i in range(len(textlist)):
+                lang = langlist[i]
+                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
+                segments.append((phones, word2ph, norm_text, lang.replace("all_", "") == "zh"))
 
-            return phones, bert, norm_text
+        if not final and sum(len(segment[0]) for segment in segments) < 6:
+            return self._segment_and_g2p("." + text, language, version, final=True)
+
+        return segments
+
+    def _merge_segments(self, segments: List[tuple], berts: List[torch.Tensor]):
+        phones_list = []
+        word2ph_list = []
+        bert_list = []
+        norm_text_list = []
+        for (phones, word2ph, norm_text, _), bert in zip(segments, berts):
+            if bert is None:
+                bert = torch.zeros((1024, len(phones)), dtype=torch.float32)
+            phones_list.append(phones)
+            word2ph_list.append(word2ph)
+            norm_text_list.append(norm_text)
+            bert_list.append(bert.to(self.device))
+        bert = torch.cat(bert_list, dim=1)
+        phones = sum(phones_list, [])
+        # 英文片段没有word2ph
+        word2ph = None if any(item is None for item in word2ph_list) else sum(word2ph_list, [])
+        norm_text = "".join(norm_text_list)
+        return phones, word2ph, bert, norm_text
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
         with torch.no_grad():
@@ -194,13 +284,38 @@ class TextPreprocessor:
             res = self.bert_model(**inputs, output_hidden_states=True)
             res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
         assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
+        phone_level_feature = torch.repeat_interleave(res[: len(word2ph)], torch.LongTensor(word2ph), dim=0)
         return phone_level_feature.T
 
+    def get_bert_features_batched(self, texts: List[str], word2phs: List[list]) -> List[torch.Tensor]:
+        """
+        `get_bert_feature` for many texts. The texts are sorted by length and tokenized with padding,
+        each forward takes at most `bert_batch_tokens` tokens (padding included).
+        """
+        results = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = []
+        for i in order:
+            assert len(word2phs[i]) == len(texts[i])
+            # 按长度排序后, 当前句子就是批内最长的句子 (+2 为[CLS]与[SEP])
+            if batches and (len(batches[-1]) + 1) * (len(texts[i]) + 2) <= self.bert_batch_tokens:
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+
+        with torch.no_grad():
+            for batch in batches:
+                inputs = self.tokenizer([texts[i] for i in batch], return_tensors="pt", padding=True)
+                for key in inputs:
+                    inputs[key] = inputs[key].to(self.device)
+                res = self.bert_model(**inputs, output_hidden_states=True)
+                hidden = res["hidden_states"][-3].cpu()
+                for row, i in enumerate(batch):
+                    word2ph = torch.LongTensor(word2phs[i])
+                    feature = torch.repeat_interleave(hidden[row, 1 : 1 + word2ph.shape[0]], word2ph, dim=0)
+                    results[i] = feature.T
+        return results
+
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
         phones, word2ph, norm_text = clean_text(text, language, version)
@@ -0,0 +1,60 @@
+"""
+Convert GPT / SoVITS weights into inference bundles (see process_ckpt.export_inference_bundle).
+
+Usage (from the repository root):
+    python GPT_SoVITS/export_inference_bundle.py --gpt_model GPT_weights_v2/xxx.ckpt --output_dir bundles
+    python GPT_SoVITS/export_inference_bundle.py --sovits_model SoVITS_weights_v2/xxx.pth --output_dir bundles_gpu --dtype fp16
+    python GPT_SoVITS/export_inference_bundle.py --sovits_model SoVITS_weights_v4/xxx_lora.pth \
+        --base_sovits_model GPT_SoVITS/pretrained_models/gsv-v4-pretrained/s2Gv4.pth --output_dir bundles
+
+The output paths can be used as t2s_weights_path / vits_weights_path directly.
+
+--dtype should match the runtime: fp32 (the default) for CPU inference, where the bundle is memory-mapped and shared by
+all processes through the page cache; fp16 for GPU inference with is_half. A bundle in another dtype still loads, but
+every tensor is converted into a private copy.
+"""
+
+import argparse
+import os
+import sys
+
+import torch
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append(os.path.join(now_dir, "GPT_SoVITS"))
+
+from process_ckpt import export_inference_bundle  # noqa: E402
+
+dtypes = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-SoVITS inference bundle converter")
+    parser.add_argument("--gpt_model", help="Path to the GPT model file")
+    parser.add_argument("--sovits_model", help="Path to the SoVITS model file or training checkpoint")
+    parser.add_argument("--base_sovits_model", help="Path to the pretrained SoVITS model of a LoRA weight file")
+    parser.add_argument("--output_dir", required=True, help="Path to the output directory")
+    parser.add_argument(
+        "--dtype",
+        choices=list(dtypes.keys()) + ["source"],
+        default="fp32",
+        help="Dtype of the stored weights, the dtype the models run in: fp32 for CPU (default), fp16 for GPU with is_half",
+    )
+    args = parser.parse_args()
+    if args.gpt_model is None and args.sovits_model is None:
+        parser.error("at least one of --gpt_model and --sovits_model is required")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    dtype = dtypes.get(args.dtype, None)
+    for kind, path in [("gpt", args.gpt_model), ("sovits", args.sovits_model)]:
+        if path is None:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        dst_path = os.path.join(args.output_dir, f"{name}.safetensors")
+        export_inference_bundle(path, dst_path, kind=kind, dtype=dtype, base_sovits_path=args.base_sovits_model)
+        print(f"{path} -> {dst_path} ({os.path.getsize(path) / 2**20:.1f}MB -> {os.path.getsize(dst_path) / 2**20:.1f}MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Synthesize a long text (e.g. an audiobook chapter) with a pool of worker processes, see TTS_infer_pack.LongFormSynthesizer.
+
+Usage (from the repository root):
+    python GPT_SoVITS/long_form_tts.py --text_file chapter.txt --text_lang zh --ref_audio ref.wav --ref_text ref.txt \
+        --ref_lang zh --output_path chapter.wav --num_workers 8 --threads_per_worker 2
+"""
+
+import argparse
+import os
+import sys
+
+import soundfile as sf
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append(os.path.join(now_dir, "GPT_SoVITS"))
+
+from TTS_infer_pack.LongFormSynthesizer import LongFormSynthesizer  # noqa: E402
+from TTS_infer_pack.TTSEngine import TTSEngine  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-SoVITS long-form synthesis")
+    parser.add_argument("--tts_config", default="GPT_SoVITS/configs/tts_infer.yaml", help="Path to the tts_infer.yaml")
+    parser.add_argument("--gpt_model", help="Path to the GPT model file, the one of the config by default")
+    parser.add_argument("--sovits_model", help="Path to the SoVITS model file, the one of the config by default")
+    parser.add_argument("--text_file", required=True, help="Path to the text to synthesize")
+    parser.add_argument("--text_lang", default="auto", help="Language of the text")
+    parser.add_argument("--ref_audio", required=True, help="Path to the reference audio file")
+    parser.add_argument("--ref_text", help="Path to the reference text file")
+    parser.add_argument("--ref_lang", default="auto", help="Language of the reference text")
+    parser.add_argument("--output_path", required=True, help="Path to the output wav file")
+    parser.add_argument("--text_split_method", default="cut5", help="Text split method")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--threads_per_worker", type=int, default=2, help="Torch threads of every worker")
+    parser.add_argument("--sentences_per_shard", type=int, default=4, help="Sentences synthesized per worker task")
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size inside every worker")
+    parser.add_argument("--fragment_interval", type=float, default=0.3, help="Silence after every sentence, in seconds")
+    parser.add_argument("--seed", type=int, default=-1, help="Random seed")
+    parser.add_argument("--no_share_weights", action="store_true", help="Do not convert the weights into mmap bundles")
+    args = parser.parse_args()
+
+    engine = TTSEngine(args.tts_config, t2s_weights_path=args.gpt_model, vits_weights_path=args.sovits_model, device="cpu")
+    with open(args.text_file, "r", encoding="utf-8") as f:
+        text = f.read()
+    prompt_text = ""
+    if args.ref_text is not None:
+        with open(args.ref_text, "r", encoding="utf-8") as f:
+            prompt_text = f.read()
+
+    with LongFormSynthesizer(
+        engine.configs,
+        num_workers=args.num_workers,
+        threads_per_worker=args.threads_per_worker,
+        share_weights=not args.no_share_weights,
+    ) as synthesizer:
+        sr, audio = synthesizer.synthesize(
+            text,
+            engine.get_language(args.text_lang),
+            args.ref_audio,
+            prompt_text,
+            engine.get_language(args.ref_lang),
+            text_split_method=engine.get_cut_method(args.text_split_method),
+            sentences_per_shard=args.sentences_per_shard,
+            batch_size=args.batch_size,
+            fragment_interval=args.fragment_interval,
+            seed=args.seed,
+        )
+    sf.write(args.output_path, audio, sr)
+    print(f"{args.output_path}: {len(audio) / sr:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
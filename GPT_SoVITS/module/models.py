@@ -891,6 +891,8 @@ class SynthesizerTrn(nn.Module):
             self.sv_emb = nn.Linear(20480, gin_channels)
             self.ge_to512 = nn.Linear(gin_channels, 512)
             self.prelu = nn.PReLU(num_parameters=gin_channels)
+        # decode时最近一次参考音频的ge: (参考频谱及sv_emb, ge)
+        self.ge_cache = None
 
     def forward(self, ssl, y, y_lengths, text, text_lengths,sv_emb=None):
         y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, y.size(2)), 1).to(y.dtype)
@@ -968,14 +970,32 @@ class SynthesizerTrn(nn.Module):
                     ge = self.prelu(ge)
             return ge
 
-        if type(refer) == list:
-            ges = []
-            for idx,_refer in enumerate(refer):
-                ge = get_ge(_refer, sv_emb[idx]if self.is_v2pro else None)
-                ges.append(ge)
-            ge = torch.stack(ges, 0).mean(0)
+        # 参考音频不变时ge也不变, 推理时复用上一次的结果(多参考时为平均后的ge), 不再对每个batch重新编码
+        refers = tuple(refer) if type(refer) == list else (refer,)
+        if self.is_v2pro:
+            refers += tuple(sv_emb) if type(sv_emb) == list else (sv_emb,)
+        use_cache = not self.training and refers[0] is not None
+        ge_cache = self.ge_cache
+        if (
+            use_cache
+            and ge_cache is not None
+            and len(ge_cache[0]) == len(refers)
+            and all(a is b for a, b in zip(ge_cache[0], refers))
+            and ge_cache[1].dtype == refers[0].dtype
+            and ge_cache[1].device == refers[0].device
+        ):
+            ge = ge_cache[1]
         else:
-            ge = get_ge(refer, sv_emb)
+            if type(refer) == list:
+                ges = []
+                for idx,_refer in enumerate(refer):
+                    ge = get_ge(_refer, sv_emb[idx]if self.is_v2pro else None)
+                    ges.append(ge)
+                ge = torch.stack(ges, 0).mean(0)
+            else:
+                ge = get_ge(refer, sv_emb)
+            if use_cache:
+                self.ge_cache = (refers, ge)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1009,9 +1029,47 @@ class CFM(torch.nn.Module):
 
         self.use_conditioner_cache = True
 
+    solvers = ["euler", "midpoint", "heun", "rk4"]
+    schedules = ["uniform", "sway", "cosine"]
+    # 每步调用estimator的次数
+    solver_evals = {"euler": 1, "midpoint": 2, "heun": 2, "rk4": 4}
+
+    @staticmethod
+    def get_timesteps(n_timesteps, schedule="uniform", sway_coef=-1.0, device=None):
+        """
+        t_0 = 0 < t_1 < ... < t_n = 1.
+        "sway" is the sway sampling of F5-TTS, sway_coef < 0 puts more steps near t = 0 (-1: t = 1 - cos(pi / 2 * u)).
+        "cosine" is t = (1 - cos(pi * u)) / 2, with more steps near both ends.
+        """
+        t = torch.linspace(0, 1, n_timesteps + 1, device=device, dtype=torch.float32)
+        if schedule == "sway":
+            t = t + sway_coef * (torch.cos(math.pi / 2 * t) - 1 + t)
+        elif schedule == "cosine":
+            t = (1 - torch.cos(math.pi * t)) / 2
+        elif schedule != "uniform":
+            raise ValueError(f"schedule: {schedule} is not supported")
+        return t.tolist()
+
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, n_timesteps, temperature=1.0, inference_cfg_rate=0):
-        """Forward diffusion"""
+    def inference(
+        self,
+        mu,
+        x_lens,
+        prompt,
+        n_timesteps,
+        temperature=1.0,
+        inference_cfg_rate=0,
+        solver="euler",
+        schedule="uniform",
+        sway_coef=-1.0,
+    ):
+        """Forward diffusion
+
+        solver: "euler", "midpoint", "heun" or "rk4", the higher order solvers call the estimator 2/2/4 times per step.
+        schedule: "uniform", "sway" or "cosine", see `get_timesteps`.
+        """
+        if solver not in self.solver_evals:
+            raise ValueError(f"solver: {solver} is not supported")
         B, T = mu.size(0), mu.size(1)
         x = torch.randn([B, self.in_channels, T], device=mu.device, dtype=mu.dtype) * temperature
         prompt_len = prompt.size(-1)
@@ -1019,22 +1077,24 @@ class CFM(torch.nn.Module):
         prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
         x[..., :prompt_len] = 0
         mu = mu.transpose(2, 1)
-        t = 0
-        d = 1 / n_timesteps
-        text_cache = None
-        text_cfg_cache = None
-        dt_cache = None
-        d_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * d
-        for j in range(n_timesteps):
+        timesteps = self.get_timesteps(n_timesteps, schedule, sway_coef)
+        # text_emb只与mu有关, dt的embedding在步长不变时复用
+        caches = {"text": None, "text_cfg": None, "dt": None, "d": None}
+
+        def velocity(x, t, d):
+            if caches["d"] != d:
+                caches["dt"] = None
+                caches["d"] = d
             t_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * t
+            d_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * d
             # v_pred = model(x, t_tensor, d_tensor, **extra_args)
             v_pred, text_emb, dt = self.estimator(
-                x, prompt_x, x_lens, t_tensor, d_tensor, mu, use_grad_ckpt=False, drop_audio_cond=False, drop_text=False, infer=True, text_cache=text_cache, dt_cache=dt_cache
+                x, prompt_x, x_lens, t_tensor, d_tensor, mu, use_grad_ckpt=False, drop_audio_cond=False, drop_text=False, infer=True, text_cache=caches["text"], dt_cache=caches["dt"]
             )
             v_pred = v_pred.transpose(2, 1)
             if self.use_conditioner_cache:
-                text_cache = text_emb
-                dt_cache = dt
+                caches["text"] = text_emb
+                caches["dt"] = dt
             if inference_cfg_rate > 1e-5:
                 neg, text_cfg_emb, _ = self.estimator(
                                     x,
@@ -1047,15 +1107,32 @@ class CFM(torch.nn.Module):
                                     drop_audio_cond=True,
                                     drop_text=True,
                                     infer=True, 
-                                    text_cache=text_cfg_cache, 
-                                    dt_cache=dt_cache
+                                    text_cache=caches["text_cfg"], 
+                                    dt_cache=caches["dt"]
                 )
                 neg = neg.transpose(2, 1)
                 if self.use_conditioner_cache:
-                    text_cfg_cache = text_cfg_emb
+                    caches["text_cfg"] = text_cfg_emb
                 v_pred = v_pred + (v_pred - neg) * inference_cfg_rate
-            x = x + d * v_pred
-            t = t + d
+            v_pred[:, :, :prompt_len] = 0
+            return v_pred
+
+        for j in range(n_timesteps):
+            t = timesteps[j]
+            d = 1 / n_timesteps if schedule == "uniform" else timesteps[j + 1] - t
+            v1 = velocity(x, t, d)
+            if solver == "euler":
+                x = x + d * v1
+            elif solver == "midpoint":
+                x = x + d * velocity(x + d / 2 * v1, t + d / 2, d)
+            elif solver == "heun":
+                v2 = velocity(x + d * v1, t + d, d)
+                x = x + d / 2 * (v1 + v2)
+            else:
+                v2 = velocity(x + d / 2 * v1, t + d / 2, d)
+                v3 = velocity(x + d / 2 * v2, t + d / 2, d)
+                v4 = velocity(x + d * v3, t + d, d)
+                x = x + d / 6 * (v1 + 2 * v2 + 2 * v3 + v4)
             x[:, :, :prompt_len] = 0
         return x
 
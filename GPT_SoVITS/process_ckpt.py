@@ -1,9 +1,13 @@
 import traceback
 from collections import OrderedDict
 from time import time as ttime
+import json
+import mmap
 import shutil
 import os
+import struct
 import torch
+from torch.nn.utils.weight_norm import WeightNorm
 from tools.i18n.i18n import I18nAuto
 
 i18n = I18nAuto()
@@ -96,6 +100,10 @@ def get_hash_from_file(sovits_path):
 
 
 def get_sovits_version_from_path_fast(sovits_path):
+    ###0-inference bundle, by metadata (LoRA is already merged)
+    if is_inference_bundle(sovits_path):
+        metadata = _read_safetensors_header(sovits_path)[0]["__metadata__"]
+        return metadata["version"], metadata["model_version"], False
     ###1-if it is pretrained sovits models, by hash
     hash = get_hash_from_file(sovits_path)
     if hash in hash_pretrained_dict:
@@ -134,3 +142,188 @@ def load_sovits_new(sovits_path):
         bio.seek(0)
         return torch.load(bio, map_location="cpu", weights_only=False)
     return torch.load(sovits_path, map_location="cpu", weights_only=False)
+
+
+# 推理权重包: 只含推理所需权重的safetensors文件, 配置和版本信息写在header的metadata中
+#   - 去掉 enc_q 等只用于训练的子模块, weight norm 已融合 (weight_g/weight_v -> weight), LoRA 已合并进底模
+#   - 可选fp16/bf16存储
+#   - 以mmap方式加载, 张量直接引用文件映射的页, 多个推理进程共享同一份page cache
+INFERENCE_BUNDLE_FORMAT = "gpt-sovits-inference"
+inference_bundle_drop_prefixes = ("enc_q.",)
+safetensors_dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _to_plain(config):
+    # HParams -> dict, 以便写入json
+    if hasattr(config, "items"):
+        return {key: _to_plain(value) for key, value in config.items()}
+    if isinstance(config, (list, tuple)):
+        return [_to_plain(value) for value in config]
+    return config
+
+
+def _read_safetensors_header(path):
+    with open(path, "rb") as f:
+        head = f.read(8)
+        if len(head) < 8:
+            return None, 0
+        header_len = struct.unpack("<Q", head)[0]
+        if header_len > 100 * 1024 * 1024:
+            return None, 0
+        try:
+            return json.loads(f.read(header_len)), 8 + header_len
+        except ValueError:
+            return None, 0
+
+
+def is_inference_bundle(path):
+    if not path.endswith(".safetensors") or not os.path.isfile(path):
+        return False
+    header, _ = _read_safetensors_header(path)
+    return header is not None and header.get("__metadata__", {}).get("format") == INFERENCE_BUNDLE_FORMAT
+
+
+def fuse_weight_norm_state_dict(state_dict):
+    """
+    weight_g/weight_v -> weight, 与 remove_weight_norm 的结果相同 (本仓库的weight norm均为dim=0)
+    """
+    fused = OrderedDict()
+    for key, value in state_dict.items():
+        if key.endswith(".weight_g"):
+            continue
+        if key.endswith(".weight_v"):
+            prefix = key[: -len("_v")]
+            fused[prefix] = torch._weight_norm(value.float(), state_dict[prefix + "_g"].float(), 0).to(value.dtype)
+            continue
+        fused[key] = value
+    return fused
+
+
+def remove_weight_norm_hooks(model):
+    """
+    Remove every weight norm hook of a freshly built model, so that it takes the fused weights of a bundle.
+    """
+    for module in model.modules():
+        for hook in list(module._forward_pre_hooks.values()):
+            if isinstance(hook, WeightNorm):
+                torch.nn.utils.remove_weight_norm(module, hook.name)
+    return model
+
+
+def merge_lora_state_dict(base_weight, lora_weight):
+    """
+    Merge the LoRA weights saved by s2_train_v3_lora.py (peft layout, lora_alpha == r) into the weights of the base model.
+    """
+    merged = OrderedDict(base_weight)
+    lora_a = {}
+    lora_b = {}
+    for key, value in lora_weight.items():
+        key = key.replace("cfm.base_model.model.", "cfm.").replace(".base_layer.", ".")
+        if ".lora_A." in key:
+            lora_a[key.split(".lora_A.")[0]] = value
+        elif ".lora_B." in key:
+            lora_b[key.split(".lora_B.")[0]] = value
+        else:
+            merged[key] = value
+    # lora_alpha == r, 缩放系数为1
+    for prefix, a in lora_a.items():
+        weight = merged[prefix + ".weight"]
+        merged[prefix + ".weight"] = (weight.float() + lora_b[prefix].float() @ a.float()).to(weight.dtype)
+    return merged
+
+
+def export_inference_bundle(src_path, dst_path, kind=None, dtype=torch.float32, base_sovits_path=None):
+    """
+    Convert a GPT (.ckpt) or SoVITS (.pth) weight file, or a SoVITS training checkpoint (G_*.pth), into an inference bundle.
+
+    Args:
+        src_path (str): the weight file to convert.
+        dst_path (str): the output path, should end with ".safetensors".
+        kind (str): "gpt" or "sovits", detected from the content if None.
+        dtype (torch.dtype): the dtype of the floating point weights, should be the dtype the models run in: float32 on CPU,
+            float16 with is_half on GPU. Tensors of another dtype are converted into a private copy when loaded, so only a
+            float32 bundle is shared through the page cache by CPU processes. None keeps the dtype of the source
+            (fp16 for exported GPT and SoVITS weights).
+        base_sovits_path (str): the pretrained SoVITS model of a v3/v4 LoRA weight file.
+    """
+    metadata = {"format": INFERENCE_BUNDLE_FORMAT}
+    if kind is None:
+        kind = "sovits" if src_path.endswith(".pth") else "gpt"
+    if kind == "gpt":
+        ckpt = torch.load(src_path, map_location="cpu", weights_only=False)
+        weight = ckpt["weight"]
+        metadata["config"] = json.dumps(_to_plain(ckpt["config"]))
+    else:
+        version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(src_path)
+        ckpt = load_sovits_new(src_path)
+        if "weight" in ckpt:
+            weight = ckpt["weight"]
+            config = _to_plain(ckpt["config"])
+        else:
+            # 训练中保存的checkpoint: {"model", "iteration", "optimizer", "learning_rate"}, 没有配置
+            weight = ckpt["model"]
+            config_path = os.path.join(os.path.dirname(src_path), "config.json")
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        if if_lora_v3:
+            if base_sovits_path is None:
+                raise ValueError(i18n("SoVITS %s 底模缺失，无法加载相应 LoRA 权重" % model_version))
+            weight = merge_lora_state_dict(load_sovits_new(base_sovits_path)["weight"], weight)
+        weight = fuse_weight_norm_state_dict(
+            {key: value for key, value in weight.items() if not key.startswith(inference_bundle_drop_prefixes)}
+        )
+        metadata["config"] = json.dumps(config)
+        metadata["version"] = version
+        metadata["model_version"] = model_version
+    metadata["kind"] = kind
+
+    from safetensors.torch import save_file
+
+    tensors = {}
+    for key, value in weight.items():
+        if dtype is not None and value.is_floating_point():
+            value = value.to(dtype)
+        # safetensors不接受共享存储的张量
+        tensors[key] = value.detach().contiguous().clone()
+    save_file(tensors, dst_path, metadata=metadata)
+    return dst_path
+
+
+def load_inference_bundle(path):
+    """
+    Map an inference bundle into memory.
+
+    The tensors are views of a copy-on-write mmap of the file instead of copies: pages are read on first use and
+    shared between the processes that load the same bundle. Load them with `model.load_state_dict(..., assign=True)`
+    to keep it that way.
+
+    Returns:
+        (state_dict, config, metadata)
+    """
+    header, data_start = _read_safetensors_header(path)
+    metadata = header.pop("__metadata__", {})
+    if metadata.get("format") != INFERENCE_BUNDLE_FORMAT:
+        raise ValueError(f"{path} is not an inference bundle")
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict = OrderedDict()
+    for key, info in sorted(header.items(), key=lambda item: item[1]["data_offsets"][0]):
+        dtype = safetensors_dtypes[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            state_dict[key] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - start) // dtype.itemsize, offset=data_start + start)
+        state_dict[key] = tensor.view(info["shape"])
+    return state_dict, json.loads(metadata["config"]), metadata
@@ -5,6 +5,7 @@ import cn2an
 from pypinyin import lazy_pinyin, Style
 from pypinyin.contrib.tone_convert import to_finals_tone3, to_initials
 
+from text.frontends import LazyResource
 from text.symbols import punctuation
 from text.tone_sandhi import ToneSandhi
 from text.zh_normalization.text_normlization import TextNormalizer
@@ -26,17 +27,23 @@ import jieba_fast.posseg as psg
 # is_g2pw_str = os.environ.get("is_g2pw", "True")##默认开启
 # is_g2pw = False#True if is_g2pw_str.lower() == 'true' else False
 is_g2pw = True  # True if is_g2pw_str.lower() == 'true' else False
-if is_g2pw:
+
+
+def _load_g2pw():
     # print("当前使用g2pw进行拼音推理")
+    # 导入时会加载多音字词典, 创建时会加载onnx模型, 都推迟到第一次使用
     from text.g2pw import G2PWPinyin, correct_pronunciation
 
-    parent_directory = os.path.dirname(current_file_path)
     g2pw = G2PWPinyin(
         model_dir="GPT_SoVITS/text/G2PWModel",
         model_source=os.environ.get("bert_path", "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large"),
         v_to_u=False,
         neutral_tone_with_five=True,
     )
+    return g2pw, correct_pronunciation
+
+
+g2pw_resource = LazyResource("zh: G2PW", _load_g2pw)
 
 rep_map = {
     "：": ",",
@@ -205,6 +212,7 @@ def _g2p(segments):
             print("pypinyin结果", initials, finals)
         else:
             # g2pw采用整句推理
+            g2pw, correct_pronunciation = g2pw_resource.get()
             pinyins = g2pw.lazy_pinyin(seg, neutral_tone_with_five=True, style=Style.TONE3)
 
             pre_word_length = 0
@@ -295,6 +303,12 @@ def _g2p(segments):
     return phones_list, word2ph
 
 
+def warmup():
+    jieba_fast.initialize()
+    if is_g2pw:
+        g2pw_resource.get()
+
+
 def replace_punctuation_with_en(text):
     text = text.replace("嗯", "恩").replace("呣", "母")
     pattern = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
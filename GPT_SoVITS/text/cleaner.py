@@ -1,4 +1,5 @@
 from text import cleaned_text_to_sequence
+from text.frontends import get_language_module, get_module_map
 import os
 # if os.environ.get("version","v1")=="v1":
 #     from text import chinese
@@ -21,12 +22,8 @@ special = [
 def clean_text(text, language, version=None):
     if version is None:
         version = os.environ.get("version", "v2")
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+    symbols = symbols_v1.symbols if version == "v1" else symbols_v2.symbols
+    language_module_map = get_module_map(version)
 
     if language not in language_module_map:
         language = "en"
@@ -34,7 +31,7 @@ def clean_text(text, language, version=None):
     for special_s, special_l, target_symbol in special:
         if special_s in text and language == special_l:
             return clean_special(text, language, special_s, target_symbol, version)
-    language_module = __import__("text." + language_module_map[language], fromlist=[language_module_map[language]])
+    language_module = get_language_module(language, version)
     if hasattr(language_module, "text_normalize"):
         norm_text = language_module.text_normalize(text)
     else:
@@ -58,18 +55,13 @@ def clean_text(text, language, version=None):
 def clean_special(text, language, special_s, target_symbol, version=None):
     if version is None:
         version = os.environ.get("version", "v2")
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+    symbols = symbols_v1.symbols if version == "v1" else symbols_v2.symbols
 
     """
     特殊静音段sp符号处理
     """
     text = text.replace(special_s, ",")
-    language_module = __import__("text." + language_module_map[language], fromlist=[language_module_map[language]])
+    language_module = get_language_module(language, version)
     norm_text = language_module.text_normalize(text)
     phones = language_module.g2p(norm_text)
     new_ph = []
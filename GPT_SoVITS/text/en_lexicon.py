@@ -0,0 +1,227 @@
+"""
+Compiled pronunciation lexicon for the English G2P.
+
+One file per lexicon, memory-mapped read-only, so the pages are shared by every process that uses it and nothing
+is unpickled into Python dicts of lists:
+
+    b"GSVLEX01" | header length (uint32) | json header | padding to 4 bytes
+    word offsets    uint32[n + 1]   words[i] = word blob[word_offsets[i] : word_offsets[i + 1]], sorted
+    phone offsets   uint32[n + 1]   phones[i] = phone ids[phone_offsets[i] : phone_offsets[i + 1]]
+    hash slots      uint32[m]       open addressing on crc32(word), the word index + 1, 0 for an empty slot
+    word blob       utf-8
+    phone ids       uint8, indices into header["symbols"]
+
+Only the first pronunciation of every word is kept, the G2P never uses the others. The header keeps the signature
+of the sources the file was compiled from, `load_lexicon` compiles it again when they change.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional
+
+LEXICON_MAGIC = b"GSVLEX01"
+
+
+def source_signature(paths: List[str], extra: str = "") -> str:
+    parts = [LEXICON_MAGIC.decode("ascii"), sys.byteorder, extra]
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}")
+        else:
+            parts.append(f"{os.path.basename(path)}:missing")
+    return "|".join(parts)
+
+
+def compile_lexicon(entries: Dict[str, List[str]], signature: str = "") -> bytes:
+    """
+    entries: {word: phones}
+    """
+    words = sorted(entries.keys())
+    symbols = sorted({phone for phones in entries.values() for phone in phones})
+    if len(symbols) > 255:
+        raise ValueError(f"too many phone symbols for a compiled lexicon: {len(symbols)}")
+    symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+
+    word_blob = bytearray()
+    phone_blob = bytearray()
+    word_offsets = [0]
+    phone_offsets = [0]
+    for word in words:
+        word_blob += word.encode("utf-8")
+        phone_blob += bytes(symbol_ids[phone] for phone in entries[word])
+        word_offsets.append(len(word_blob))
+        phone_offsets.append(len(phone_blob))
+
+    # 负载因子不超过0.5
+    num_slots = 1
+    while num_slots < max(len(words), 1) * 2:
+        num_slots *= 2
+    slots = [0] * num_slots
+    for index, word in enumerate(words):
+        slot = zlib.crc32(word.encode("utf-8")) & (num_slots - 1)
+        while slots[slot] != 0:
+            slot = (slot + 1) & (num_slots - 1)
+        slots[slot] = index + 1
+
+    header = json.dumps(
+        {"signature": signature, "num_words": len(words), "num_slots": num_slots, "symbols": symbols},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    head = LEXICON_MAGIC + struct.pack("<I", len(header)) + header
+    head += b"\0" * (-len(head) % 4)
+    return b"".join(
+        [
+            head,
+            struct.pack(f"={len(words) + 1}I", *word_offsets),
+            struct.pack(f"={len(words) + 1}I", *phone_offsets),
+            struct.pack(f"={num_slots}I", *slots),
+            bytes(word_blob),
+            bytes(phone_blob),
+        ]
+    )
+
+
+def read_lexicon_header(buffer) -> Optional[dict]:
+    if len(buffer) < 12 or bytes(buffer[:8]) != LEXICON_MAGIC:
+        return None
+    header_len = struct.unpack("<I", bytes(buffer[8:12]))[0]
+    try:
+        header = json.loads(bytes(buffer[12 : 12 + header_len]).decode("utf-8"))
+    except ValueError:
+        return None
+    header["data_start"] = 12 + header_len + (-(12 + header_len) % 4)
+    return header
+
+
+class CompiledLexicon:
+    """
+    Read-only {word: phones} view of a compiled lexicon (a mmap or bytes).
+    A lookup is a crc32 of the word plus, usually, one comparison against the word blob.
+    """
+
+    def __init__(self, buffer, header: dict = None):
+        self.buffer = buffer
+        header = header if header is not None else read_lexicon_header(buffer)
+        if header is None:
+            raise ValueError("not a compiled lexicon")
+        self.signature: str = header["signature"]
+        self.symbols: List[str] = header["symbols"]
+        self.num_words: int = header["num_words"]
+        self.num_slots: int = header["num_slots"]
+        view = memoryview(buffer)
+        offset = header["data_start"]
+        size = (self.num_words + 1) * 4
+        self.word_offsets = view[offset : offset + size].cast("I")
+        offset += size
+        self.phone_offsets = view[offset : offset + size].cast("I")
+        offset += size
+        self.slots = view[offset : offset + self.num_slots * 4].cast("I")
+        offset += self.num_slots * 4
+        self.word_blob = view[offset : offset + self.word_offsets[self.num_words]]
+        offset += self.word_offsets[self.num_words]
+        self.phone_ids = view[offset : offset + self.phone_offsets[self.num_words]]
+
+    def index(self, word: str) -> int:
+        """
+        The position of `word` in the sorted string table, -1 if missing.
+        """
+        key = word.encode("utf-8")
+        mask = self.num_slots - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            index = self.slots[slot] - 1
+            if index < 0:
+                return -1
+            if self.word_blob[self.word_offsets[index] : self.word_offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) & mask
+
+    def phones(self, index: int) -> List[str]:
+        symbols = self.symbols
+        return [symbols[i] for i in self.phone_ids[self.phone_offsets[index] : self.phone_offsets[index + 1]]]
+
+    def word(self, index: int) -> str:
+        return bytes(self.word_blob[self.word_offsets[index] : self.word_offsets[index + 1]]).decode("utf-8")
+
+    def get(self, word: str, default=None) -> Optional[List[str]]:
+        index = self.index(word)
+        return self.phones(index) if index >= 0 else default
+
+    def __getitem__(self, word: str) -> List[str]:
+        index = self.index(word)
+        if index < 0:
+            raise KeyError(word)
+        return self.phones(index)
+
+    def __contains__(self, word: str) -> bool:
+        return self.index(word) >= 0
+
+    def __len__(self) -> int:
+        return self.num_words
+
+    def words(self) -> Iterator[str]:
+        for index in range(self.num_words):
+            yield self.word(index)
+
+
+def load_lexicon(path: str, signature: str, build: Callable[[], Dict[str, List[str]]]) -> CompiledLexicon:
+    """
+    Map the compiled lexicon at `path`, compiled from `build()` first if it is missing or was compiled from other sources.
+    If `path` cannot be written the lexicon is kept in memory instead.
+    """
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) > 0 else b""
+        header = read_lexicon_header(buffer)
+        if header is not None and header["signature"] == signature:
+            return CompiledLexicon(buffer, header)
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+    data = compile_lexicon(build(), signature)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Failed to save compiled lexicon {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return CompiledLexicon(data)
+    with open(path, "rb") as f:
+        return CompiledLexicon(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return key in self.items
+
+    def __len__(self) -> int:
+        return len(self.items)
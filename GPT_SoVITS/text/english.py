@@ -1,9 +1,15 @@
 import pickle
 import os
 import re
+from functools import lru_cache
+from typing import List
+
+import numpy as np
 import wordsegment
 from g2p_en import G2p
 
+from text.en_lexicon import LRUCache, load_lexicon, source_signature
+from text.frontends import LazyResource
 from text.symbols import punctuation
 
 from text.symbols2 import symbols
@@ -21,6 +27,12 @@ CMU_DICT_FAST_PATH = os.path.join(current_file_path, "cmudict-fast.rep")
 CMU_DICT_HOT_PATH = os.path.join(current_file_path, "engdict-hot.rep")
 CACHE_PATH = os.path.join(current_file_path, "engdict_cache.pickle")
 NAMECACHE_PATH = os.path.join(current_file_path, "namedict_cache.pickle")
+# 由以上字典编译的词典文件 (见 text/en_lexicon.py), 源文件变化时自动重新编译
+LEXICON_PATH = os.path.join(current_file_path, "engdict.lexicon")
+NAME_LEXICON_PATH = os.path.join(current_file_path, "namedict.lexicon")
+
+# 读音错误的几个缩写, 不进入词典
+removed_abbreviations = ["AE", "AI", "AR", "IOS", "HUD", "OS"]
 
 
 # 适配中文及 g2p_en 标点
@@ -230,6 +242,31 @@ def get_namedict():
     return name_dict
 
 
+def get_lexicon():
+    def build():
+        g2p_dict = get_dict()
+        for word in removed_abbreviations:
+            g2p_dict.pop(word.lower(), None)
+        return {word: prons[0] for word, prons in g2p_dict.items()}
+
+    signature = source_signature(
+        [CMU_DICT_PATH, CMU_DICT_FAST_PATH, CMU_DICT_HOT_PATH, CACHE_PATH], ",".join(removed_abbreviations)
+    )
+    return load_lexicon(LEXICON_PATH, signature, build)
+
+
+def get_name_lexicon():
+    def build():
+        return {word: prons[0] for word, prons in get_namedict().items()}
+
+    return load_lexicon(NAME_LEXICON_PATH, source_signature([NAMECACHE_PATH]), build)
+
+
+@lru_cache(maxsize=4096)
+def segment_word(word: str) -> tuple:
+    return tuple(wordsegment.segment(word))
+
+
 def text_normalize(text):
     # todo: eng text normalize
 
@@ -251,13 +288,11 @@ class en_G2p(G2p):
         # 分词初始化
         wordsegment.load()
 
-        # 扩展过时字典, 添加姓名字典
-        self.cmu = get_dict()
-        self.namedict = get_namedict()
-
-        # 剔除读音错误的几个缩写
-        for word in ["AE", "AI", "AR", "IOS", "HUD", "OS"]:
-            del self.cmu[word.lower()]
+        # 扩展过时字典, 添加姓名字典, 均为mmap的编译词典, 读音错误的几个缩写已剔除
+        self.cmu = get_lexicon()
+        self.namedict = get_name_lexicon()
+        # 神经网络预测的OOV读音
+        self.predict_cache = LRUCache(4096)
 
         # 修正多音字
         self.homograph2features["read"] = (["R", "IY1", "D"], ["R", "EH1", "D"], "VBP")
@@ -272,6 +307,11 @@ class en_G2p(G2p):
         words = word_tokenize(text)
         tokens = pos_tag(words)  # tuples of (word, tag)
 
+        # 整句的OOV词一次批量预测
+        self.predict_batch(
+            [oov for o_word, pos in tokens if o_word.lower() not in self.homograph2features for oov in self.oov_words(o_word)]
+        )
+
         # steps
         prons = []
         for o_word, pos in tokens:
@@ -286,7 +326,7 @@ class en_G2p(G2p):
                 if o_word == "A":
                     pron = ["EY1"]
                 else:
-                    pron = self.cmu[word][0]
+                    pron = self.cmu[word]
             # g2p_en 原版多音字处理
             elif word in self.homograph2features:  # Check homograph
                 pron1, pron2, pos1 = self.homograph2features[word]
@@ -310,12 +350,16 @@ class en_G2p(G2p):
         word = o_word.lower()
 
         # 查字典, 单字母除外
-        if len(word) > 1 and word in self.cmu:  # lookup CMU dict
-            return self.cmu[word][0]
+        if len(word) > 1:  # lookup CMU dict
+            pron = self.cmu.get(word)
+            if pron is not None:
+                return pron
 
         # 单词仅首字母大写时查找姓名字典
-        if o_word.istitle() and word in self.namedict:
-            return self.namedict[word][0]
+        if o_word.istitle():
+            pron = self.namedict.get(word)
+            if pron is not None:
+                return pron
 
         # oov 长度小于等于 3 直接读字母
         if len(word) <= 3:
@@ -327,7 +371,7 @@ class en_G2p(G2p):
                 elif not w.isalpha():
                     phones.extend([w])
                 else:
-                    phones.extend(self.cmu[w][0])
+                    phones.extend(self.cmu[w])
             return phones
 
         # 尝试分离所有格
@@ -347,7 +391,7 @@ class en_G2p(G2p):
             return phones
 
         # 尝试进行分词，应对复合词
-        comps = wordsegment.segment(word.lower())
+        comps = segment_word(word.lower())
 
         # 无法分词的送回去预测
         if len(comps) == 1:
@@ -356,13 +400,78 @@ class en_G2p(G2p):
         # 可以分词的递归处理
         return [phone for comp in comps for phone in self.qryword(comp)]
 
-
-_g2p = en_G2p()
+    def oov_words(self, o_word: str) -> List[str]:
+        """
+        The words `qryword(o_word)` sends to the neural `predict`.
+        """
+        word = o_word.lower()
+        if re.search("[a-z]", word) is None or len(word) <= 3:
+            return []
+        if word in self.cmu or (o_word.istitle() and word in self.namedict):
+            return []
+        if re.match(r"^([a-z]+)('s)$", word):
+            return self.oov_words(word[:-2])
+        comps = segment_word(word)
+        if len(comps) == 1:
+            return [word]
+        return [oov for comp in comps for oov in self.oov_words(comp)]
+
+    def predict(self, word: str) -> List[str]:
+        pron = self.predict_cache.get(word)
+        if pron is None:
+            pron = tuple(super().predict(word))
+            self.predict_cache.put(word, pron)
+        return list(pron)
+
+    def predict_batch(self, words: List[str]) -> List[List[str]]:
+        """
+        `predict` for several words with one padded encoder / greedy decoder pass, the cached words are skipped.
+        """
+        todo = [word for word in dict.fromkeys(words) if word not in self.predict_cache]
+        if len(todo) > 0:
+            lengths = np.array([len(word) + 1 for word in todo])
+            x = np.full((len(todo), lengths.max()), self.g2idx["<pad>"], dtype=np.int64)
+            for i, word in enumerate(todo):
+                x[i, : lengths[i]] = [self.g2idx.get(char, self.g2idx["<unk>"]) for char in list(word) + ["</s>"]]
+            enc = np.take(self.enc_emb, x, axis=0)
+
+            # 编码器: 每个词的隐状态停在其 </s> 处
+            h = np.zeros((len(todo), self.enc_w_hh.shape[-1]), np.float32)
+            for t in range(x.shape[1]):
+                h_next = self.grucell(enc[:, t, :], h, self.enc_w_ih, self.enc_w_hh, self.enc_b_ih, self.enc_b_hh)
+                h = np.where((t < lengths)[:, None], h_next, h)
+
+            # 解码器: 贪心解码, 与 predict 一样最多20步
+            dec = np.take(self.dec_emb, np.full(len(todo), 2), axis=0)  # 2: <s>
+            preds = [[] for _ in todo]
+            finished = np.zeros(len(todo), dtype=bool)
+            for _ in range(20):
+                h = self.grucell(dec, h, self.dec_w_ih, self.dec_w_hh, self.dec_b_ih, self.dec_b_hh)
+                pred = (np.matmul(h, self.fc_w.T) + self.fc_b).argmax(-1)
+                finished |= pred == 3  # 3: </s>
+                if finished.all():
+                    break
+                for i in np.nonzero(~finished)[0]:
+                    preds[i].append(pred[i])
+                dec = np.take(self.dec_emb, pred, axis=0)
+            for word, pred in zip(todo, preds):
+                self.predict_cache.put(word, tuple(self.idx2p.get(idx, "<unk>") for idx in pred))
+        return [self.predict(word) for word in words]
+
+
+# 加载 g2p_en 模型、wordsegment 以及 CMU/姓名字典, 推迟到第一次使用
+_g2p = LazyResource("en: en_G2p", en_G2p)
+
+
+def warmup():
+    _g2p.get()
+    # nltk 词性标注模型在第一次调用时加载
+    pos_tag(["warmup"])
 
 
 def g2p(text):
     # g2p_en 整段推理，剔除不存在的arpa返回
-    phone_list = _g2p(text)
+    phone_list = _g2p.get()(text)
     phones = [ph if ph != "<unk>" else "UNK" for ph in phone_list if ph not in [" ", "<pad>", "UW", "</s>", "<s>"]]
 
     return replace_phs(phones)
@@ -0,0 +1,123 @@
+"""
+Lazy loading of the per-language text frontends.
+
+The language modules (text.chinese2, text.japanese, ...) are only imported by the first `clean_text` call of their
+language, and their expensive resources (the G2PW onnx session, the pyopenjtalk user dictionary, the g2p_en model
+and dictionaries, ...) are only built by their first `g2p` call, so a worker that only speaks one language never
+pays for the others. `warmup()` loads the frontends of the given languages ahead of time, e.g. at server start,
+and every import / initialization is timed for `profile_report()`.
+
+Usage (from the GPT_SoVITS directory):
+    python -m text.frontends zh en        # warm up zh and en, print how long every step took
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+language_module_maps = {
+    "v1": {"zh": "chinese", "ja": "japanese", "en": "english"},
+    "v2": {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"},
+}
+
+_lock = threading.RLock()
+_modules: Dict[str, object] = {}
+# 加载顺序排列的 (名称, 用时)
+_profile: List[tuple] = []
+
+
+def _record(name: str, seconds: float):
+    with _lock:
+        _profile.append((name, seconds))
+
+
+def get_module_map(version: str = None) -> Dict[str, str]:
+    if version is None:
+        version = os.environ.get("version", "v2")
+    return language_module_maps["v1" if version == "v1" else "v2"]
+
+
+def get_language_module(language: str, version: str = None):
+    """
+    The frontend module of `language` ("zh", "ja", "en", "ko", "yue"), imported on first use.
+    """
+    module_name = get_module_map(version)[language]
+    module = _modules.get(module_name)
+    if module is not None:
+        return module
+    with _lock:
+        module = _modules.get(module_name)
+        if module is None:
+            t0 = time.perf_counter()
+            module = importlib.import_module("text." + module_name)
+            _record(f"import text.{module_name}", time.perf_counter() - t0)
+            _modules[module_name] = module
+    return module
+
+
+class LazyResource:
+    """
+    A module level object built by `factory` on the first `get()`, thread safe, the build time is recorded
+    for `profile_report()`.
+    """
+
+    def __init__(self, name: str, factory: Callable):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    t0 = time.perf_counter()
+                    self.value = self.factory()
+                    self.loaded = True
+                    _record(self.name, time.perf_counter() - t0)
+        return self.value
+
+
+def warmup(languages: List[str] = None, version: str = None) -> Dict[str, float]:
+    """
+    Import the frontends of `languages` (all languages of `version` if None) and build their resources.
+
+    Returns:
+        {language: seconds}
+    """
+    module_map = get_module_map(version)
+    if languages is None:
+        languages = list(module_map.keys())
+    timings = {}
+    for language in languages:
+        if language not in module_map:
+            continue
+        t0 = time.perf_counter()
+        module = get_language_module(language, version)
+        if hasattr(module, "warmup"):
+            module.warmup()
+        timings[language] = time.perf_counter() - t0
+    return timings
+
+
+def profile_report() -> str:
+    with _lock:
+        profile = list(_profile)
+    if len(profile) == 0:
+        return "text frontends: nothing loaded yet"
+    width = max(len(name) for name, _ in profile)
+    lines = [f"{name.ljust(width)}  {seconds * 1000:9.1f}ms" for name, seconds in profile]
+    lines.append(f"{'total'.ljust(width)}  {sum(seconds for _, seconds in profile) * 1000:9.1f}ms")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # 以 -m 运行时本文件是 __main__, 各语种模块记录的是 text.frontends 中的耗时
+    from text import frontends
+
+    frontends.warmup(sys.argv[1:] or None)
+    print(frontends.profile_report())
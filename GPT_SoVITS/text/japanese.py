@@ -3,78 +3,85 @@ import re
 import os
 import hashlib
 
-try:
-    import pyopenjtalk
-
-    current_file_path = os.path.dirname(__file__)
-
-    # 防止win下无法读取模型
-    if os.name == "nt":
-        python_dir = os.getcwd()
-        OPEN_JTALK_DICT_DIR = pyopenjtalk.OPEN_JTALK_DICT_DIR.decode("utf-8")
-        if not (re.match(r"^[A-Za-z0-9_/\\:.\-]*$", OPEN_JTALK_DICT_DIR)):
-            if OPEN_JTALK_DICT_DIR[: len(python_dir)].upper() == python_dir.upper():
-                OPEN_JTALK_DICT_DIR = os.path.join(os.path.relpath(OPEN_JTALK_DICT_DIR, python_dir))
-            else:
-                import shutil
-
-                if not os.path.exists("TEMP"):
-                    os.mkdir("TEMP")
-                if not os.path.exists(os.path.join("TEMP", "ja")):
-                    os.mkdir(os.path.join("TEMP", "ja"))
-                if os.path.exists(os.path.join("TEMP", "ja", "open_jtalk_dic")):
-                    shutil.rmtree(os.path.join("TEMP", "ja", "open_jtalk_dic"))
-                shutil.copytree(
-                    pyopenjtalk.OPEN_JTALK_DICT_DIR.decode("utf-8"),
-                    os.path.join("TEMP", "ja", "open_jtalk_dic"),
-                )
-                OPEN_JTALK_DICT_DIR = os.path.join("TEMP", "ja", "open_jtalk_dic")
-            pyopenjtalk.OPEN_JTALK_DICT_DIR = OPEN_JTALK_DICT_DIR.encode("utf-8")
-
-        if not (re.match(r"^[A-Za-z0-9_/\\:.\-]*$", current_file_path)):
-            if current_file_path[: len(python_dir)].upper() == python_dir.upper():
-                current_file_path = os.path.join(os.path.relpath(current_file_path, python_dir))
-            else:
-                if not os.path.exists("TEMP"):
-                    os.mkdir("TEMP")
-                if not os.path.exists(os.path.join("TEMP", "ja")):
-                    os.mkdir(os.path.join("TEMP", "ja"))
-                if not os.path.exists(os.path.join("TEMP", "ja", "ja_userdic")):
-                    os.mkdir(os.path.join("TEMP", "ja", "ja_userdic"))
-                    shutil.copyfile(
-                        os.path.join(current_file_path, "ja_userdic", "userdict.csv"),
-                        os.path.join("TEMP", "ja", "ja_userdic", "userdict.csv"),
+import pyopenjtalk
+
+from text.frontends import LazyResource
+
+
+def get_hash(fp: str) -> str:
+    hash_md5 = hashlib.md5()
+    with open(fp, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def _load_user_dict():
+    # 编译并加载用户词典 (需计算csv的md5), 推迟到第一次使用
+    try:
+        current_file_path = os.path.dirname(__file__)
+
+        # 防止win下无法读取模型
+        if os.name == "nt":
+            python_dir = os.getcwd()
+            OPEN_JTALK_DICT_DIR = pyopenjtalk.OPEN_JTALK_DICT_DIR.decode("utf-8")
+            if not (re.match(r"^[A-Za-z0-9_/\\:.\-]*$", OPEN_JTALK_DICT_DIR)):
+                if OPEN_JTALK_DICT_DIR[: len(python_dir)].upper() == python_dir.upper():
+                    OPEN_JTALK_DICT_DIR = os.path.join(os.path.relpath(OPEN_JTALK_DICT_DIR, python_dir))
+                else:
+                    import shutil
+
+                    if not os.path.exists("TEMP"):
+                        os.mkdir("TEMP")
+                    if not os.path.exists(os.path.join("TEMP", "ja")):
+                        os.mkdir(os.path.join("TEMP", "ja"))
+                    if os.path.exists(os.path.join("TEMP", "ja", "open_jtalk_dic")):
+                        shutil.rmtree(os.path.join("TEMP", "ja", "open_jtalk_dic"))
+                    shutil.copytree(
+                        pyopenjtalk.OPEN_JTALK_DICT_DIR.decode("utf-8"),
+                        os.path.join("TEMP", "ja", "open_jtalk_dic"),
                     )
-                current_file_path = os.path.join("TEMP", "ja")
-
-    def get_hash(fp: str) -> str:
-        hash_md5 = hashlib.md5()
-        with open(fp, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-
-    USERDIC_CSV_PATH = os.path.join(current_file_path, "ja_userdic", "userdict.csv")
-    USERDIC_BIN_PATH = os.path.join(current_file_path, "ja_userdic", "user.dict")
-    USERDIC_HASH_PATH = os.path.join(current_file_path, "ja_userdic", "userdict.md5")
-    # 如果没有用户词典，就生成一个；如果有，就检查md5，如果不一样，就重新生成
-    if os.path.exists(USERDIC_CSV_PATH):
-        if (
-            not os.path.exists(USERDIC_BIN_PATH)
-            or get_hash(USERDIC_CSV_PATH) != open(USERDIC_HASH_PATH, "r", encoding="utf-8").read()
-        ):
-            pyopenjtalk.mecab_dict_index(USERDIC_CSV_PATH, USERDIC_BIN_PATH)
-            with open(USERDIC_HASH_PATH, "w", encoding="utf-8") as f:
-                f.write(get_hash(USERDIC_CSV_PATH))
-
-    if os.path.exists(USERDIC_BIN_PATH):
-        pyopenjtalk.update_global_jtalk_with_user_dict(USERDIC_BIN_PATH)
-except Exception:
-    # print(e)
-    import pyopenjtalk
-
-    # failed to load user dictionary, ignore.
-    pass
+                    OPEN_JTALK_DICT_DIR = os.path.join("TEMP", "ja", "open_jtalk_dic")
+                pyopenjtalk.OPEN_JTALK_DICT_DIR = OPEN_JTALK_DICT_DIR.encode("utf-8")
+
+            if not (re.match(r"^[A-Za-z0-9_/\\:.\-]*$", current_file_path)):
+                if current_file_path[: len(python_dir)].upper() == python_dir.upper():
+                    current_file_path = os.path.join(os.path.relpath(current_file_path, python_dir))
+                else:
+                    if not os.path.exists("TEMP"):
+                        os.mkdir("TEMP")
+                    if not os.path.exists(os.path.join("TEMP", "ja")):
+                        os.mkdir(os.path.join("TEMP", "ja"))
+                    if not os.path.exists(os.path.join("TEMP", "ja", "ja_userdic")):
+                        os.mkdir(os.path.join("TEMP", "ja", "ja_userdic"))
+                        shutil.copyfile(
+                            os.path.join(current_file_path, "ja_userdic", "userdict.csv"),
+                            os.path.join("TEMP", "ja", "ja_userdic", "userdict.csv"),
+                        )
+                    current_file_path = os.path.join("TEMP", "ja")
+
+        USERDIC_CSV_PATH = os.path.join(current_file_path, "ja_userdic", "userdict.csv")
+        USERDIC_BIN_PATH = os.path.join(current_file_path, "ja_userdic", "user.dict")
+        USERDIC_HASH_PATH = os.path.join(current_file_path, "ja_userdic", "userdict.md5")
+        # 如果没有用户词典，就生成一个；如果有，就检查md5，如果不一样，就重新生成
+        if os.path.exists(USERDIC_CSV_PATH):
+            if (
+                not os.path.exists(USERDIC_BIN_PATH)
+                or get_hash(USERDIC_CSV_PATH) != open(USERDIC_HASH_PATH, "r", encoding="utf-8").read()
+            ):
+                pyopenjtalk.mecab_dict_index(USERDIC_CSV_PATH, USERDIC_BIN_PATH)
+                with open(USERDIC_HASH_PATH, "w", encoding="utf-8") as f:
+                    f.write(get_hash(USERDIC_CSV_PATH))
+
+        if os.path.exists(USERDIC_BIN_PATH):
+            pyopenjtalk.update_global_jtalk_with_user_dict(USERDIC_BIN_PATH)
+    except Exception:
+        # print(e)
+        # failed to load user dictionary, ignore.
+        pass
+
+
+user_dict = LazyResource("ja: pyopenjtalk user dictionary", _load_user_dict)
 
 
 from text.symbols import punctuation
@@ -161,6 +168,7 @@ def preprocess_jap(text, with_prosody=False):
             if with_prosody:
                 text += pyopenjtalk_g2p_prosody(sentence)[1:-1]
             else:
+                user_dict.get()
                 p = pyopenjtalk.g2p(sentence)
                 text += p.split(" ")
 
@@ -202,6 +210,7 @@ def pyopenjtalk_g2p_prosody(text, drop_unvoiced_vowels=True):
         modeling for neural TTS`: https://doi.org/10.1587/transinf.2020EDP7104
 
     """
+    user_dict.get()
     labels = pyopenjtalk.make_label(pyopenjtalk.run_frontend(text))
     N = len(labels)
 
@@ -264,6 +273,12 @@ def _numeric_feature_by_regex(regex, s):
     return int(match.group(1))
 
 
+def warmup():
+    user_dict.get()
+    # 第一次调用时加载open_jtalk系统词典
+    pyopenjtalk.g2p("あ")
+
+
 def g2p(norm_text, with_prosody=True):
     phones = preprocess_jap(norm_text, with_prosody)
     phones = [post_replace_ph(i) for i in phones]
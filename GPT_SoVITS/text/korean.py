@@ -56,6 +56,7 @@ if os.name == "nt":
     G2p = win_G2p
 
 
+from text.frontends import LazyResource
 from text.symbols2 import symbols
 
 # This is a list of Korean classifiers preceded by pure Korean numerals.
@@ -286,13 +287,18 @@ def korean_to_lazy_ipa(text):
     return text
 
 
-_g2p = G2p()
+# g2pk2 创建时加载mecab及其词典, 推迟到第一次使用
+_g2p = LazyResource("ko: g2pk2", G2p)
+
+
+def warmup():
+    _g2p.get()
 
 
 def korean_to_ipa(text):
     text = latin_to_hangul(text)
     text = number_to_hangul(text)
-    text = _g2p(text)
+    text = _g2p.get()(text)
     text = fix_g2pk2_error(text)
     text = korean_to_lazy_ipa(text)
     return text.replace("ʧ", "tʃ").replace("ʥ", "dʑ")
@@ -323,7 +329,7 @@ def post_replace_ph(ph):
 
 def g2p(text):
     text = latin_to_hangul(text)
-    text = _g2p(text)
+    text = _g2p.get()(text)
     text = divide_hangul(text)
     text = fix_g2pk2_error(text)
     text = re.sub(r"([\u3131-\u3163])$", r"\1.", text)
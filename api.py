@@ -19,7 +19,7 @@
 `-fp` - `覆盖 config.py 使用全精度`
 `-hp` - `覆盖 config.py 使用半精度`
 `-sm` - `流式返回模式, 默认不启用, "close","c", "normal","n", "keepalive","k"`
-·-mt` - `返回的音频编码格式, 流式默认ogg, 非流式默认wav, "wav", "ogg", "aac"`
+·-mt` - `返回的音频编码格式, 流式默认ogg, 非流式默认wav, "wav", "ogg", "aac", "mp3"`
 ·-st` - `返回的音频数据类型, 默认int16, "int16", "int32"`
 ·-cp` - `文本切分符号设定, 默认为空, 以",.，。"字符串的方式传入`
 
@@ -171,7 +171,7 @@ from text.cleaner import clean_text
 from module.mel_processing import spectrogram_torch
 import config as global_config
 import logging
-import subprocess
+from tools.audio_encoder import StreamingAudioEncoder
 
 
 class DefaultRefer:
@@ -668,11 +668,10 @@ def get_spepc(hps, filename, dtype, device, is_v2pro=False):
     return spec, audio
 
 
-def pack_audio(audio_bytes, data, rate):
-    if media_type == "ogg":
-        audio_bytes = pack_ogg(audio_bytes, data, rate)
-    elif media_type == "aac":
-        audio_bytes = pack_aac(audio_bytes, data, rate)
+def pack_audio(audio_bytes, data, rate, encoder=None):
+    if media_type in ["ogg", "aac", "mp3"]:
+        # 编码器在整个请求内保持打开, 所有分段组成同一个连续的音频流
+        audio_bytes.write(encoder.encode(data))
     else:
         # wav无法流式, 先暂存raw
         audio_bytes = pack_raw(audio_bytes, data, rate)
@@ -680,52 +679,6 @@ def pack_audio(audio_bytes, data, rate):
     return audio_bytes
 
 
-def pack_ogg(audio_bytes, data, rate):
-    # Author: AkagawaTsurunaki
-    # Issue:
-    #   Stack overflow probabilistically occurs
-    #   when the function `sf_writef_short` of `libsndfile_64bit.dll` is called
-    #   using the Python library `soundfile`
-    # Note:
-    #   This is an issue related to `libsndfile`, not this project itself.
-    #   It happens when you generate a large audio tensor (about 499804 frames in my PC)
-    #   and try to convert it to an ogg file.
-    # Related:
-    #   https://github.com/RVC-Boss/GPT-SoVITS/issues/1199
-    #   https://github.com/libsndfile/libsndfile/issues/1023
-    #   https://github.com/bastibe/python-soundfile/issues/396
-    # Suggestion:
-    #   Or split the whole audio data into smaller audio segment to avoid stack overflow?
-
-    def handle_pack_ogg():
-        with sf.SoundFile(audio_bytes, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-            audio_file.write(data)
-
-    import threading
-
-    # See: https://docs.python.org/3/library/threading.html
-    # The stack size of this thread is at least 32768
-    # If stack overflow error still occurs, just modify the `stack_size`.
-    # stack_size = n * 4096, where n should be a positive integer.
-    # Here we chose n = 4096.
-    stack_size = 4096 * 4096
-    try:
-        threading.stack_size(stack_size)
-        pack_ogg_thread = threading.Thread(target=handle_pack_ogg)
-        pack_ogg_thread.start()
-        pack_ogg_thread.join()
-    except RuntimeError as e:
-        # If changing the thread stack size is unsupported, a RuntimeError is raised.
-        print("RuntimeError: {}".format(e))
-        print("Changing the thread stack size is unsupported.")
-    except ValueError as e:
-        # If the specified stack size is invalid, a ValueError is raised and the stack size is unmodified.
-        print("ValueError: {}".format(e))
-        print("The specified stack size is invalid.")
-
-    return audio_bytes
-
-
 def pack_raw(audio_bytes, data, rate):
     audio_bytes.write(data.tobytes())
 
@@ -744,43 +697,6 @@ def pack_wav(audio_bytes, rate):
     return wav_bytes
 
 
-def pack_aac(audio_bytes, data, rate):
-    if is_int32:
-        pcm = "s32le"
-        bit_rate = "256k"
-    else:
-        pcm = "s16le"
-        bit_rate = "128k"
-    process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            pcm,  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            bit_rate,  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, _ = process.communicate(input=data.tobytes())
-    audio_bytes.write(out)
-
-    return audio_bytes
-
-
 def read_clean_buffer(audio_bytes):
     audio_chunk = audio_bytes.getvalue()
     audio_bytes.truncate(0)
@@ -916,6 +832,7 @@ def get_tts_wav(
     phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
     texts = text.split("\n")
     audio_bytes = BytesIO()
+    encoder = None
 
     for text in texts:
         # 简单防止纯符号引发参考音频泄露
@@ -1048,15 +965,25 @@ def get_tts_wav(
                 audio_opt /= max_audio
             sr = 48000
 
+        if encoder is None and media_type in ["ogg", "aac", "mp3"]:
+            encoder = StreamingAudioEncoder(
+                media_type, sr, "s32" if is_int32 else "s16", bit_rate=256000 if is_int32 else 128000
+            )
         if is_int32:
-            audio_bytes = pack_audio(audio_bytes, (audio_opt * 2147483647).astype(np.int32), sr)
+            audio_bytes = pack_audio(audio_bytes, (audio_opt * 2147483647).astype(np.int32), sr, encoder)
         else:
-            audio_bytes = pack_audio(audio_bytes, (audio_opt * 32768).astype(np.int16), sr)
+            audio_bytes = pack_audio(audio_bytes, (audio_opt * 32768).astype(np.int16), sr, encoder)
         # logger.info("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t3 - t2, t4 - t3))
         if stream_mode == "normal":
             audio_bytes, audio_chunk = read_clean_buffer(audio_bytes)
             yield audio_chunk
 
+    if encoder is not None:
+        audio_bytes.write(encoder.flush())
+        if stream_mode == "normal":
+            audio_bytes, audio_chunk = read_clean_buffer(audio_bytes)
+            yield audio_chunk
+
     if not stream_mode == "normal":
         if media_type == "wav":
             if version in {"v1", "v2", "v2Pro", "v2ProPlus"}:
@@ -1208,7 +1135,7 @@ parser.add_argument(
 # bool值的用法为 `python ./api.py -fp ...`
 # 此时 full_precision==True, half_precision==False
 parser.add_argument("-sm", "--stream_mode", type=str, default="close", help="流式返回模式, close / normal / keepalive")
-parser.add_argument("-mt", "--media_type", type=str, default="wav", help="音频编码格式, wav / ogg / aac")
+parser.add_argument("-mt", "--media_type", type=str, default="wav", help="音频编码格式, wav / ogg / aac / mp3")
 parser.add_argument("-st", "--sub_type", type=str, default="int16", help="音频数据类型, int16 / int32")
 parser.add_argument("-cp", "--cut_punc", type=str, default="", help="文本切分符号设定, 符号范围,.;?!、，。？！；：…")
 # 切割常用分句符为 `python ./api.py -cp ".?!。？！"`
@@ -1263,7 +1190,7 @@ else:
     stream_mode = "close"
 
 # 音频编码格式
-if args.media_type.lower() in ["aac", "ogg"]:
+if args.media_type.lower() in ["aac", "ogg", "mp3"]:
     media_type = args.media_type.lower()
 elif stream_mode == "close":
     media_type = "wav"
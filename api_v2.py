@@ -7,6 +7,17 @@
     `-a` - `绑定地址, 默认"127.0.0.1"`
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
+    `-cb` - `连续批处理的最大句数, 并发请求的句子会合并到同一个T2S解码批次中, 默认0(关闭)`
+    `-r` - `进程内加载的模型副本数, 每个副本由独立的推理线程服务, 默认1`
+    `-w` - `每个模型副本的推理线程数, 开启连续批处理时可大于1, 默认1`
+    `-q` - `等待推理的最大请求数, 队列已满时返回429, 默认8`
+    `-sd` - `投机解码的草稿模型层数(取GPT模型的前N层), 仅并行推理模式生效, 输出分布不变, 默认0(关闭)`
+    `-sk` - `投机解码每轮由草稿模型提出的token数, 默认4`
+    `-sw` - `单独训练的浅层草稿GPT模型路径, 设置后替代截断的草稿模型`
+    `-m` - `多模型配置文件(yaml/json), 格式为 {模型名: {t2s_weights_path: ..., vits_weights_path: ...}}, 请求中以 model 指定模型`
+    `-mm` - `同时驻留的模型对数, 超出时卸载最久未使用的模型, 默认4`
+    `-mb` - `驻留模型对的显存/内存预算(MB), 0为不限制, 默认0`
+    `-wl` - `启动时预加载文本前端(G2PW/日语词典/英文G2P等)的语种, 逗号分隔, 如"zh,en", "all"为全部; 默认各语种在首次请求时加载`
 
 ## 调用:
 
@@ -23,6 +34,7 @@ POST:
 {
     "text": "",                   # str.(required) text to be synthesized
     "text_lang: "",               # str.(required) language of the text to be synthesized
+    "model": "",                  # str.(optional) name of a registered GPT/SoVITS pair, the default pipeline if empty
     "ref_audio_path": "",         # str.(required) reference audio path
     "aux_ref_audio_paths": [],    # list.(optional) auxiliary reference audio paths for multi-speaker tone fusion
     "prompt_text": "",            # str.(optional) prompt text for the reference audio
@@ -40,13 +52,21 @@ POST:
     "parallel_infer": True,       # bool. whether to use parallel inference.
     "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
-    "super_sampling": False       # bool. whether to use super-sampling for audio when using VITS model V3.
+    "cfm_solver": "euler",        # str. ODE solver of the V3/V4 CFM: "euler", "midpoint", "heun" or "rk4".
+    "cfm_schedule": "uniform",    # str. timestep schedule of the V3/V4 CFM: "uniform", "sway" or "cosine".
+    "super_sampling": False,      # bool. whether to use super-sampling for audio when using VITS model V3.
+    "stream_chunk_size": 0,       # int. with streaming_mode, stream audio every N semantic tokens (25 per second) instead of every sentence, 0 to disable. v3/v4 stream the CFM + vocoder chunks of every sentence once its tokens are decoded.
+    "loop_detection": True,       # bool. stop the T2S decoding of a sentence that loops or exceeds the length budget of its phonemes.
+    "loop_retries": 1,            # int. decode such sentences again with another seed, up to N times.
+    "pipelined": False            # bool. extract the text features of the next batch while the current one is synthesized; with streaming_mode, also synthesize the next batch while the current one is encoded and sent.
 }
 ```
 
 RESP:
 成功: 直接返回 wav 音频流， http code 200
+      非流式返回时, 语义Token生成异常(循环/超长/过短)的句子以json列表放在响应头 X-T2S-Events 中, 客户端可据此换 seed 重试
 失败: 返回包含错误信息的 json, http code 400
+繁忙: 等待推理的请求已满, http code 429; 服务正在关闭, http code 503
 
 ### 命令控制
 
@@ -70,6 +90,31 @@ POST:
 RESP: 无
 
 
+### 多模型
+
+BERT、CNHuBERT与声码器由所有模型共享, 每个模型只额外占用其GPT/SoVITS权重; 切换模型无需重新加载, 也不影响其他请求。
+
+endpoint: `/models`: 列出已注册的模型及其是否已加载
+
+endpoint: `/register_model`
+
+GET:
+```
+http://127.0.0.1:9880/register_model?name=jingyuan&gpt_weights_path=GPT_weights_v2/xxx.ckpt&sovits_weights_path=SoVITS_weights_v2/xxx.pth&preload=true
+```
+
+endpoint: `/unregister_model`
+
+GET:
+```
+http://127.0.0.1:9880/unregister_model?name=jingyuan
+```
+
+RESP:
+成功: 返回"success", http code 200
+失败: 返回包含错误信息的 json, http code 400
+
+
 ### 切换GPT模型
 
 endpoint: `/set_gpt_weights`
@@ -101,25 +146,33 @@ RESP:
 import os
 import sys
 import traceback
-from typing import Generator
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 sys.path.append("%s/GPT_SoVITS" % (now_dir))
 
 import argparse
-import subprocess
-import wave
+import json
 import signal
 import numpy as np
 import soundfile as sf
+import yaml
 from fastapi import FastAPI, Response
 from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 from io import BytesIO
 from tools.i18n.i18n import I18nAuto
 from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+from GPT_SoVITS.TTS_infer_pack.InferenceExecutor import (
+    ExecutorBusyError,
+    ExecutorClosedError,
+    InferenceExecutor,
+    InferenceJob,
+)
+from GPT_SoVITS.TTS_infer_pack.ModelRegistry import ModelRegistry
 from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import get_method_names as get_cut_method_names
+from tools.audio_encoder import StreamingAudioEncoder
 from pydantic import BaseModel
 
 # print(sys.path)
@@ -130,6 +183,27 @@ parser = argparse.ArgumentParser(description="GPT-SoVITS api")
 parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/tts_infer.yaml", help="tts_infer路径")
 parser.add_argument("-a", "--bind_addr", type=str, default="127.0.0.1", help="default: 127.0.0.1")
 parser.add_argument("-p", "--port", type=int, default="9880", help="default: 9880")
+parser.add_argument(
+    "-cb", "--continuous_batching", type=int, default=0, help="连续批处理的最大句数, 0为关闭. default: 0"
+)
+parser.add_argument("-r", "--replicas", type=int, default=1, help="进程内加载的模型副本数. default: 1")
+parser.add_argument(
+    "-w", "--workers_per_replica", type=int, default=1, help="每个模型副本的推理线程数, 开启连续批处理时可大于1. default: 1"
+)
+parser.add_argument("-q", "--max_queue", type=int, default=8, help="等待推理的最大请求数, 超出时返回429. default: 8")
+parser.add_argument(
+    "-sd", "--speculative_draft_layers", type=int, default=0, help="投机解码的草稿模型使用GPT模型的前N层, 0为关闭. default: 0"
+)
+parser.add_argument("-sk", "--speculative_k", type=int, default=4, help="投机解码每轮草稿token数. default: 4")
+parser.add_argument(
+    "-sw", "--speculative_draft_weights", type=str, default="", help="单独训练的草稿GPT模型路径, 设置后替代截断的草稿模型"
+)
+parser.add_argument("-m", "--models", type=str, default="", help="多模型配置文件(yaml/json), {模型名: {t2s_weights_path, vits_weights_path}}")
+parser.add_argument("-mm", "--max_models", type=int, default=4, help="同时驻留的模型对数. default: 4")
+parser.add_argument("-mb", "--models_memory_mb", type=float, default=0, help="驻留模型对的内存预算(MB), 0为不限制. default: 0")
+parser.add_argument(
+    "-wl", "--warmup_langs", type=str, default="", help="启动时预加载文本前端的语种, 逗号分隔(如 zh,en), all为全部, 默认在首次请求时加载"
+)
 args = parser.parse_args()
 config_path = args.tts_config
 # device = args.device
@@ -142,7 +216,49 @@ if config_path in [None, ""]:
 
 tts_config = TTS_Config(config_path)
 print(tts_config)
-tts_pipeline = TTS(tts_config)
+tts_pipelines = [TTS(tts_config)]
+# 每个副本有自己的配置 (切换权重时会修改版本/权重路径), BERT/CNHuBERT/声码器与第一个副本共享
+for _ in range(max(args.replicas, 1) - 1):
+    tts_pipelines.append(TTS(TTS_Config(config_path), shared_models=tts_pipelines[0].shared_models))
+
+
+def setup_pipeline(pipeline: TTS):
+    if args.continuous_batching > 0:
+        pipeline.enable_continuous_batching(True, max_batch_size=args.continuous_batching)
+    if args.speculative_draft_layers > 0 or args.speculative_draft_weights not in [None, ""]:
+        pipeline.enable_speculative_decoding(
+            True,
+            draft_layers=args.speculative_draft_layers,
+            num_draft_tokens=args.speculative_k,
+            draft_weights_path=args.speculative_draft_weights,
+        )
+
+
+for tts_pipeline in tts_pipelines:
+    setup_pipeline(tts_pipeline)
+tts_pipeline = tts_pipelines[0]
+if args.warmup_langs not in [None, ""]:
+    # 文本前端是进程内共享的, 预加载一次即可
+    print(tts_pipeline.warmup_text_frontends(None if args.warmup_langs == "all" else args.warmup_langs.split(",")))
+# 按名称选择的模型对, 与默认模型共享BERT/CNHuBERT/声码器
+model_registry = ModelRegistry(
+    tts_config,
+    shared_models=tts_pipeline.shared_models,
+    max_models=args.max_models,
+    memory_budget_mb=args.models_memory_mb,
+    concurrency=max(args.workers_per_replica, 1) if args.continuous_batching > 0 else 1,
+    on_load=setup_pipeline,
+)
+if args.models not in [None, ""]:
+    with open(args.models, "r", encoding="utf-8") as f:
+        model_registry.register_from_dict(yaml.safe_load(f))
+# 推理在独立线程中进行, 事件循环只负责收发, 控制接口不会被推理阻塞
+inference_executor = InferenceExecutor(
+    tts_pipelines,
+    max_queue_size=args.max_queue,
+    workers_per_replica=max(args.workers_per_replica, 1),
+    registry=model_registry,
+)
 
 APP = FastAPI()
 
@@ -150,6 +266,7 @@ APP = FastAPI()
 class TTS_Request(BaseModel):
     text: str = None
     text_lang: str = None
+    model: str = None
     ref_audio_path: str = None
     aux_ref_audio_paths: list = None
     prompt_lang: str = None
@@ -169,13 +286,19 @@ class TTS_Request(BaseModel):
     parallel_infer: bool = True
     repetition_penalty: float = 1.35
     sample_steps: int = 32
+    cfm_solver: str = "euler"
+    cfm_schedule: str = "uniform"
     super_sampling: bool = False
+    stream_chunk_size: int = 0
+    loop_detection: bool = True
+    loop_retries: int = 1
+    pipelined: bool = False
 
 
-### modify from https://github.com/RVC-Boss/GPT-SoVITS/pull/894/files
-def pack_ogg(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    with sf.SoundFile(io_buffer, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-        audio_file.write(data)
+def pack_encoded(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
+    encoder = StreamingAudioEncoder(media_type, rate)
+    io_buffer.write(encoder.encode(data))
+    io_buffer.write(encoder.flush())
     return io_buffer
 
 
@@ -190,41 +313,9 @@ def pack_wav(io_buffer: BytesIO, data: np.ndarray, rate: int):
     return io_buffer
 
 
-def pack_aac(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            "s16le",  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            "192k",  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, _ = process.communicate(input=data.tobytes())
-    io_buffer.write(out)
-    return io_buffer
-
-
 def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
-    if media_type == "ogg":
-        io_buffer = pack_ogg(io_buffer, data, rate)
-    elif media_type == "aac":
-        io_buffer = pack_aac(io_buffer, data, rate)
+    if media_type in ["ogg", "aac", "mp3"]:
+        io_buffer = pack_encoded(io_buffer, data, rate, media_type)
     elif media_type == "wav":
         io_buffer = pack_wav(io_buffer, data, rate)
     else:
@@ -233,22 +324,6 @@ def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str)
     return io_buffer
 
 
-# from https://huggingface.co/spaces/coqui/voice-chat-with-mistral/blob/main/app.py
-def wave_header_chunk(frame_input=b"", channels=1, sample_width=2, sample_rate=32000):
-    # This will create a wave header then append the frame input
-    # It should be first on a streaming wav file
-    # Other frames better should not have it (else you will hear some artifacts each chunk start)
-    wav_buf = BytesIO()
-    with wave.open(wav_buf, "wb") as vfout:
-        vfout.setnchannels(channels)
-        vfout.setsampwidth(sample_width)
-        vfout.setframerate(sample_rate)
-        vfout.writeframes(frame_input)
-
-    wav_buf.seek(0)
-    return wav_buf.read()
-
-
 def handle_control(command: str):
     if command == "restart":
         os.execl(sys.executable, sys.executable, *argv)
@@ -261,11 +336,13 @@ def check_params(req: dict):
     text: str = req.get("text", "")
     text_lang: str = req.get("text_lang", "")
     ref_audio_path: str = req.get("ref_audio_path", "")
-    streaming_mode: bool = req.get("streaming_mode", False)
     media_type: str = req.get("media_type", "wav")
     prompt_lang: str = req.get("prompt_lang", "")
     text_split_method: str = req.get("text_split_method", "cut5")
+    model: str = req.get("model", None)
 
+    if model not in [None, ""] and model not in model_registry:
+        return JSONResponse(status_code=400, content={"message": f"model: {model} is not registered"})
     if ref_audio_path in [None, ""]:
         return JSONResponse(status_code=400, content={"message": "ref_audio_path is required"})
     if text in [None, ""]:
@@ -284,15 +361,19 @@ def check_params(req: dict):
             status_code=400,
             content={"message": f"prompt_lang: {prompt_lang} is not supported in version {tts_config.version}"},
         )
-    if media_type not in ["wav", "raw", "ogg", "aac"]:
+    if media_type not in ["wav", "raw", "ogg", "aac", "mp3"]:
         return JSONResponse(status_code=400, content={"message": f"media_type: {media_type} is not supported"})
-    elif media_type == "ogg" and not streaming_mode:
-        return JSONResponse(status_code=400, content={"message": "ogg format is not supported in non-streaming mode"})
 
     if text_split_method not in cut_method_names:
         return JSONResponse(
             status_code=400, content={"message": f"text_split_method:{text_split_method} is not supported"}
         )
+    if req.get("cfm_solver", "euler") not in ["euler", "midpoint", "heun", "rk4"]:
+        return JSONResponse(status_code=400, content={"message": f"cfm_solver: {req['cfm_solver']} is not supported"})
+    if req.get("cfm_schedule", "uniform") not in ["uniform", "sway", "cosine"]:
+        return JSONResponse(
+            status_code=400, content={"message": f"cfm_schedule: {req['cfm_schedule']} is not supported"}
+        )
 
     return None
 
@@ -306,6 +387,7 @@ async def tts_handle(req: dict):
             {
                 "text": "",                   # str.(required) text to be synthesized
                 "text_lang: "",               # str.(required) language of the text to be synthesized
+                "model": "",                  # str.(optional) name of a registered GPT/SoVITS pair
                 "ref_audio_path": "",         # str.(required) reference audio path
                 "aux_ref_audio_paths": [],    # list.(optional) auxiliary reference audio paths for multi-speaker synthesis
                 "prompt_text": "",            # str.(optional) prompt text for the reference audio
@@ -320,12 +402,18 @@ async def tts_handle(req: dict):
                 "speed_factor":1.0,           # float. control the speed of the synthesized audio.
                 "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                 "seed": -1,                   # int. random seed for reproducibility.
-                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "aac".
+                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "aac", "mp3".
                 "streaming_mode": False,      # bool. whether to return a streaming response.
                 "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
                 "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.
                 "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
+                "cfm_solver": "euler",        # str. ODE solver of the V3/V4 CFM.
+                "cfm_schedule": "uniform",    # str. timestep schedule of the V3/V4 CFM.
                 "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                "stream_chunk_size": 0,       # int. with streaming_mode, stream audio every N semantic tokens, 0 to disable.
+                "loop_detection": True,       # bool. stop T2S rows that loop or exceed the length budget of their phonemes.
+                "loop_retries": 1,            # int. decode such sentences again with another seed, up to N times.
+                "pipelined": False,           # bool. overlap text preprocessing / audio encoding with inference.
             }
     returns:
         StreamingResponse: audio stream response.
@@ -341,35 +429,50 @@ async def tts_handle(req: dict):
 
     if streaming_mode or return_fragment:
         req["return_fragment"] = True
+    if not streaming_mode:
+        req["stream_chunk_size"] = 0
+    req["t2s_events"] = []
 
     try:
-        tts_generator = tts_pipeline.run(req)
+        job = inference_executor.submit(req)
+    except ExecutorBusyError as e:
+        return JSONResponse(status_code=429, content={"message": "server is busy", "Exception": str(e)})
+    except ExecutorClosedError as e:
+        return JSONResponse(status_code=503, content={"message": "server is shutting down", "Exception": str(e)})
 
+    try:
         if streaming_mode:
 
-            def streaming_generator(tts_generator: Generator, media_type: str):
-                if_frist_chunk = True
-                for sr, chunk in tts_generator:
-                    if if_frist_chunk and media_type == "wav":
-                        yield wave_header_chunk(sample_rate=sr)
-                        media_type = "raw"
-                        if_frist_chunk = False
-                    yield pack_audio(BytesIO(), chunk, sr, media_type).getvalue()
+            async def streaming_generator(job: InferenceJob, media_type: str):
+                # 每个流一个编码器, 跨分段保持状态, 输出为一个连续的音频流
+                encoder: StreamingAudioEncoder = None
+                try:
+                    async for sr, chunk in job:
+                        if encoder is None:
+                            encoder = StreamingAudioEncoder(media_type, sr)
+                        yield encoder.encode(chunk)
+                    if encoder is not None:
+                        yield encoder.flush()
+                finally:
+                    # 客户端断开时停止推理, 释放推理线程
+                    job.cancel()
 
             # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
             return StreamingResponse(
                 streaming_generator(
-                    tts_generator,
+                    job,
                     media_type,
                 ),
                 media_type=f"audio/{media_type}",
             )
 
         else:
-            sr, audio_data = next(tts_generator)
-            audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
-            return Response(audio_data, media_type=f"audio/{media_type}")
+            sr, audio_data = await job.result()
+            audio_data = (await run_in_threadpool(pack_audio, BytesIO(), audio_data, sr, media_type)).getvalue()
+            headers = {"X-T2S-Events": json.dumps(req["t2s_events"])} if req["t2s_events"] else None
+            return Response(audio_data, media_type=f"audio/{media_type}", headers=headers)
     except Exception as e:
+        job.cancel()
         return JSONResponse(status_code=400, content={"message": "tts failed", "Exception": str(e)})
 
 
@@ -384,6 +487,7 @@ async def control(command: str = None):
 async def tts_get_endpoint(
     text: str = None,
     text_lang: str = None,
+    model: str = None,
     ref_audio_path: str = None,
     aux_ref_audio_paths: list = None,
     prompt_lang: str = None,
@@ -403,11 +507,18 @@ async def tts_get_endpoint(
     parallel_infer: bool = True,
     repetition_penalty: float = 1.35,
     sample_steps: int = 32,
+    cfm_solver: str = "euler",
+    cfm_schedule: str = "uniform",
     super_sampling: bool = False,
+    stream_chunk_size: int = 0,
+    loop_detection: bool = True,
+    loop_retries: int = 1,
+    pipelined: bool = False,
 ):
     req = {
         "text": text,
         "text_lang": text_lang.lower(),
+        "model": model,
         "ref_audio_path": ref_audio_path,
         "aux_ref_audio_paths": aux_ref_audio_paths,
         "prompt_text": prompt_text,
@@ -427,7 +538,13 @@ async def tts_get_endpoint(
         "parallel_infer": parallel_infer,
         "repetition_penalty": float(repetition_penalty),
         "sample_steps": int(sample_steps),
+        "cfm_solver": cfm_solver,
+        "cfm_schedule": cfm_schedule,
         "super_sampling": super_sampling,
+        "stream_chunk_size": int(stream_chunk_size),
+        "loop_detection": loop_detection,
+        "loop_retries": int(loop_retries),
+        "pipelined": pipelined,
     }
     return await tts_handle(req)
 
@@ -441,7 +558,7 @@ async def tts_post_endpoint(request: TTS_Request):
 @APP.get("/set_refer_audio")
 async def set_refer_aduio(refer_audio_path: str = None):
     try:
-        tts_pipeline.set_ref_audio(refer_audio_path)
+        await run_in_threadpool(inference_executor.run_on_all, lambda pipeline: pipeline.set_ref_audio(refer_audio_path))
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "set refer audio failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -466,12 +583,41 @@ async def set_refer_aduio(refer_audio_path: str = None):
 #     return JSONResponse(status_code=200, content={"message": "success"})
 
 
+@APP.get("/models")
+async def list_models():
+    return JSONResponse(status_code=200, content={"models": model_registry.list_models()})
+
+
+@APP.get("/register_model")
+async def register_model(
+    name: str = None, gpt_weights_path: str = None, sovits_weights_path: str = None, preload: bool = False
+):
+    if name in ["", None] or gpt_weights_path in ["", None] or sovits_weights_path in ["", None]:
+        return JSONResponse(
+            status_code=400, content={"message": "name, gpt_weights_path and sovits_weights_path are required"}
+        )
+    try:
+        await run_in_threadpool(model_registry.register, name, gpt_weights_path, sovits_weights_path, preload)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": "register model failed", "Exception": str(e)})
+    return JSONResponse(status_code=200, content={"message": "success"})
+
+
+@APP.get("/unregister_model")
+async def unregister_model(name: str = None):
+    try:
+        await run_in_threadpool(model_registry.unregister, name)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": "unregister model failed", "Exception": str(e)})
+    return JSONResponse(status_code=200, content={"message": "success"})
+
+
 @APP.get("/set_gpt_weights")
 async def set_gpt_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "gpt weight path is required"})
-        tts_pipeline.init_t2s_weights(weights_path)
+        await run_in_threadpool(inference_executor.run_on_all, lambda pipeline: pipeline.init_t2s_weights(weights_path))
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change gpt weight failed", "Exception": str(e)})
 
@@ -483,7 +629,7 @@ async def set_sovits_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "sovits weight path is required"})
-        tts_pipeline.init_vits_weights(weights_path)
+        await run_in_threadpool(inference_executor.run_on_all, lambda pipeline: pipeline.init_vits_weights(weights_path))
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change sovits weight failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
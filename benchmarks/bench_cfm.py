@@ -0,0 +1,130 @@
+"""
+Quality / speed benchmark of the CFM ODE solvers of SoVITS v3/v4 (`CFM.inference`).
+
+Every solver, schedule and step count starts from the same noise and conditioning as a 64-step
+Euler reference, the mel error against that reference measures the discretization error alone.
+The time is one `CFM.inference` call (one T_chunk of the vocoder path), the number of DiT forwards
+is steps * evaluations per step of the solver.
+
+Without `--sovits_model` the CFM is left at its random initialization, which is enough for the
+timing but not for the error: pass the v3/v4 SoVITS weights (or an inference bundle) for that.
+The conditioning (fea, prompt mel) is random either way.
+
+Usage (from the repository root):
+    python benchmarks/bench_cfm.py --sovits_model GPT_SoVITS/pretrained_models/gsv-v4-pretrained/s2Gv4.pth
+    python benchmarks/bench_cfm.py --sovits_model xxx.pth --runs euler:uniform:8 heun:sway:4 rk4:uniform:2 --device cuda --half
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+now_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+from f5_tts.model import DiT  # noqa: E402
+from module.models import CFM  # noqa: E402
+
+DEFAULT_RUNS = [
+    "euler:uniform:32",
+    "euler:uniform:8",
+    "euler:sway:8",
+    "euler:uniform:4",
+    "euler:sway:4",
+    "midpoint:uniform:4",
+    "heun:uniform:4",
+    "heun:sway:4",
+    "heun:sway:3",
+    "heun:cosine:4",
+    "rk4:uniform:2",
+    "rk4:sway:2",
+]
+
+
+def _sync(device: str):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def build_cfm(args) -> CFM:
+    cfm = CFM(100, DiT(**dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)))
+    if args.sovits_model is not None:
+        from process_ckpt import is_inference_bundle, load_inference_bundle, load_sovits_new
+
+        if is_inference_bundle(args.sovits_model):
+            weight = load_inference_bundle(args.sovits_model)[0]
+        else:
+            weight = load_sovits_new(args.sovits_model)["weight"]
+        weight = {key[len("cfm.") :]: value for key, value in weight.items() if key.startswith("cfm.")}
+        print(f"Loading CFM weights from {args.sovits_model}. {cfm.load_state_dict(weight, strict=False)}")
+    cfm = cfm.to(args.device).eval()
+    return cfm.half() if args.half else cfm
+
+
+def run(cfm: CFM, inputs: tuple, seed: int, solver: str, schedule: str, steps: int) -> torch.Tensor:
+    fea, x_lens, prompt = inputs
+    torch.manual_seed(seed)
+    out = cfm.inference(fea, x_lens, prompt, steps, inference_cfg_rate=0, solver=solver, schedule=schedule)
+    return out[:, :, prompt.shape[-1] :].float()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CFM ODE solver benchmark")
+    parser.add_argument("--sovits_model", type=str, default=None, help="v3/v4 SoVITS weights")
+    parser.add_argument("--runs", nargs="+", default=DEFAULT_RUNS, help="solver:schedule:steps")
+    parser.add_argument("--reference_steps", type=int, default=64)
+    parser.add_argument("--prompt_frames", type=int, default=500, help="T_ref, 468 for v3 and 500 for v4")
+    parser.add_argument("--frames", type=int, default=1000, help="T_chunk, 934 for v3 and 1000 for v4")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0, 1])
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--half", action="store_true")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+    cfm = build_cfm(args)
+    dtype = torch.float16 if args.half else torch.float32
+    g = torch.Generator().manual_seed(1234)
+    fea = torch.randn(1, args.frames, 512, generator=g).to(args.device, dtype)
+    prompt = torch.randn(1, 100, args.prompt_frames, generator=g).to(args.device, dtype)
+    inputs = (fea, torch.LongTensor([args.frames]).to(args.device), prompt)
+
+    references = {seed: run(cfm, inputs, seed, "euler", "uniform", args.reference_steps) for seed in args.seeds}
+    scale = torch.stack(list(references.values())).abs().mean().item()
+
+    print(f"reference: euler:uniform:{args.reference_steps}, mean |mel| {scale:.4f}")
+    print(f"{'run':>20} {'nfe':>5} {'time(s)':>9} {'speedup':>8} {'mel MAE':>9} {'rel L2':>8}")
+    baseline = None
+    for spec in args.runs:
+        solver, schedule, steps = spec.split(":")
+        steps = int(steps)
+        run(cfm, inputs, args.seeds[0], solver, schedule, steps)  # warmup
+        _sync(args.device)
+        t0 = time.perf_counter()
+        for _ in range(args.iterations):
+            run(cfm, inputs, args.seeds[0], solver, schedule, steps)
+        _sync(args.device)
+        elapsed = (time.perf_counter() - t0) / args.iterations
+        baseline = baseline or elapsed
+
+        mae = []
+        rel = []
+        for seed, reference in references.items():
+            out = run(cfm, inputs, seed, solver, schedule, steps)
+            mae.append((out - reference).abs().mean().item())
+            rel.append(((out - reference).norm() / reference.norm()).item())
+        nfe = steps * CFM.solver_evals[solver]
+        print(
+            f"{spec:>20} {nfe:>5} {elapsed:>9.3f} {baseline / elapsed:>7.2f}x "
+            f"{sum(mae) / len(mae):>9.4f} {sum(rel) / len(rel):>8.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of one T2S sampling step: `sample()` against `sample_top_k_first()`.
+
+`sample()` sorts the whole vocabulary for top-p and applies the repetition penalty with
+gather/scatter over the full history, so its cost grows with the number of generated tokens.
+`sample_top_k_first()` reads the per-row token counts and only sorts the top-k survivors,
+the history length does not matter. The timed step includes the bookkeeping each loop does
+afterwards (appending to the history / updating the counts).
+
+Usage (from the repository root):
+    python benchmarks/bench_sampler.py
+    python benchmarks/bench_sampler.py --batch_sizes 1 8 --history 50 500 1500 --device cuda
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+now_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+from AR.models.utils import make_token_counts, sample, sample_top_k_first, update_token_counts  # noqa: E402
+
+
+def _sync(device: str):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def time_step(fn, iterations: int, warmup: int, device: str) -> float:
+    for _ in range(warmup):
+        fn()
+    _sync(device)
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    _sync(device)
+    return (time.perf_counter() - t0) / iterations
+
+
+def bench(batch_size: int, history: int, args) -> dict:
+    device = args.device
+    vocab_size = args.vocab_size
+    sampling_kwargs = dict(
+        top_k=args.top_k, top_p=args.top_p, temperature=args.temperature, repetition_penalty=args.repetition_penalty
+    )
+    logits = torch.randn(batch_size, vocab_size, device=device) * 3
+    previous_tokens = torch.randint(0, vocab_size - 1, (batch_size, history), device=device)
+    token_counts = make_token_counts(previous_tokens, vocab_size)
+
+    def step_sample():
+        idx_next = sample(logits.clone(), previous_tokens, **sampling_kwargs)[0]
+        torch.concat([previous_tokens, idx_next], dim=1)
+
+    def step_top_k_first():
+        idx_next = sample_top_k_first(logits.clone(), token_counts, **sampling_kwargs)
+        # 计数只用于计时, 撤销本步的更新, 保持各次迭代的输入一致
+        update_token_counts(token_counts, idx_next)
+        token_counts.scatter_add_(1, idx_next.long(), -torch.ones_like(idx_next, dtype=token_counts.dtype))
+
+    baseline = time_step(step_sample, args.iterations, args.warmup, device)
+    fused = time_step(step_top_k_first, args.iterations, args.warmup, device)
+    return {
+        "batch_size": batch_size,
+        "history": history,
+        "sample_us": baseline * 1e6,
+        "top_k_first_us": fused * 1e6,
+        "speedup": baseline / fused,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="T2S sampler micro-benchmark")
+    parser.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 4, 20])
+    parser.add_argument("--history", nargs="+", type=int, default=[50, 300, 1000, 1500])
+    parser.add_argument("--vocab_size", type=int, default=1025)
+    parser.add_argument("--top_k", type=int, default=15)
+    parser.add_argument("--top_p", type=float, default=0.6)
+    parser.add_argument("--temperature", type=float, default=0.6)
+    parser.add_argument("--repetition_penalty", type=float, default=1.35)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    print(f"{'batch':>6} {'history':>8} {'sample(us)':>12} {'top_k_first(us)':>16} {'speedup':>8}")
+    with torch.no_grad():
+        for batch_size in args.batch_sizes:
+            for history in args.history:
+                r = bench(batch_size, history, args)
+                print(
+                    f"{r['batch_size']:>6} {r['history']:>8} {r['sample_us']:>12.1f} "
+                    f"{r['top_k_first_us']:>16.1f} {r['speedup']:>7.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,579 @@
+"""
+End-to-end CPU benchmark of `TTS.run` with randomly initialized weights.
+
+No pretrained files are needed: every model (T2S, SoVITS, BERT, CNHuBERT, SV, BigVGAN / v4 vocoder)
+is built from the real configs and left at its random initialization, so the numbers measure
+the code, not the checkpoints. Every version runs in its own subprocess, so the peak RSS of one
+version is not polluted by another.
+
+Stages (seconds per `TTS.run` call, exclusive of each other):
+    reference       set_ref_audio: CNHuBERT + ssl quantizer, reference spectrogram, SV embedding
+    text_frontend   text splitting, normalization and g2p of the prompt text and the target text
+    bert            BERT forward passes
+    t2s_prefill     T2STransformer.process_prompt / process_prompt_packed over the whole prompt
+    t2s_decode      the autoregressive loop after the prefill (transformer step, sampling, bookkeeping)
+    decode          SynthesizerTrn.decode (v1/v2/v2Pro) or the CFM path (v3/v4), vocoder excluded
+    vocoder         the HiFiGAN generator of SoVITS, BigVGAN (v3) or the v4 vocoder
+    postprocess     audio_postprocess
+
+Usage (from the repository root):
+    python benchmarks/bench_tts.py --versions v1 v2 v2Pro v3 v4 --output bench.json
+    python benchmarks/bench_tts.py --versions v2 --output new.json --compare bench.json
+
+With `--compare`, the exit code is 1 when a stage, the RTF or the peak RSS got slower / bigger
+than the baseline by more than `--threshold`.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from statistics import mean, median
+
+now_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSIONS = ["v1", "v2", "v2Pro", "v2ProPlus", "v3", "v4"]
+STAGES = [
+    "reference",
+    "text_frontend",
+    "bert",
+    "t2s_prefill",
+    "t2s_decode",
+    "decode",
+    "vocoder",
+    "postprocess",
+]
+
+DEFAULT_TEXT = "先帝创业未半而中道崩殂，今天下三分，益州疲弊，此诚危急存亡之秋也。然侍卫之臣不懈于内，忠志之士忘身于外者，盖追先帝之殊遇，欲报之于陛下也。"
+DEFAULT_PROMPT_TEXT = "这是一段用于性能测试的参考音频。"
+
+# 与官方底模一致的 T2S 配置, v2及之后的版本共用 v2 的音素表
+T2S_CONFIG = {
+    "model": {
+        "vocab_size": 1025,
+        "phoneme_vocab_size": 732,
+        "embedding_dim": 512,
+        "hidden_dim": 512,
+        "head": 16,
+        "linear_units": 2048,
+        "n_layer": 24,
+        "dropout": 0,
+        "EOS": 1024,
+        "random_bert": 0,
+    },
+    "data": {"max_sec": 54},
+}
+SOVITS_CONFIG_FILES = {
+    "v1": "s2.json",
+    "v2": "s2.json",
+    "v2Pro": "s2v2Pro.json",
+    "v2ProPlus": "s2v2ProPlus.json",
+    "v3": "s2.json",
+    "v4": "s2.json",
+}
+# chinese-roberta-wwm-ext-large
+BERT_CONFIG = {
+    "hidden_size": 1024,
+    "num_hidden_layers": 24,
+    "num_attention_heads": 16,
+    "intermediate_size": 4096,
+    "max_position_embeddings": 512,
+    "type_vocab_size": 2,
+}
+
+
+class StageTimer:
+    """
+    Accumulates the wall time of wrapped callables per stage. A stage that is already running
+    is not counted again when one of its functions calls another one of the same stage.
+    """
+
+    def __init__(self, device: str):
+        self.device = device
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.depth = defaultdict(int)
+
+    def sync(self):
+        if "cuda" in self.device:
+            import torch
+
+            torch.cuda.synchronize()
+
+    def wrap(self, owner, name: str, stage: str, on_result=None):
+        fn = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            self.calls[stage] += 1
+            if self.depth[stage] > 0:
+                return fn(*args, **kwargs)
+            self.depth[stage] += 1
+            self.sync()
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                self.sync()
+            finally:
+                self.totals[stage] += time.perf_counter() - t0
+                self.depth[stage] -= 1
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        setattr(owner, name, timed)
+
+    def wrap_module(self, module, stage: str):
+        # nn.Module.__call__ 调用 self.forward, 实例属性优先于类方法
+        self.wrap(module, "forward", stage)
+
+    def reset(self):
+        self.totals.clear()
+        self.calls.clear()
+
+
+def build_tts_class():
+    import torch
+    from BigVGAN.bigvgan import BigVGAN
+    from BigVGAN.env import AttrDict
+    from feature_extractor.cnhubert import CNHubert
+    from module.models import Generator, SynthesizerTrn, SynthesizerTrnV3
+    from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+    from transformers import BertConfig, BertForMaskedLM, BertTokenizerFast, HubertConfig, HubertModel
+    from transformers import Wav2Vec2FeatureExtractor
+    from TTS_infer_pack.TTS import TTS
+    from sv import SV
+    from ERes2NetV2 import ERes2NetV2
+
+    class RandomInitTTS(TTS):
+        """
+        `TTS` whose models are built from the real configs with random weights instead of being
+        loaded from the pretrained files. Everything after model construction is the normal code path.
+        """
+
+        def init_t2s_weights(self, weights_path: str):
+            config = json.loads(json.dumps(T2S_CONFIG))
+            if self.configs.version == "v1":
+                config["model"]["phoneme_vocab_size"] = 512
+            self.configs.hz = 50
+            self.configs.max_sec = config["data"]["max_sec"]
+            t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
+            self.t2s_model = t2s_model.to(self.configs.device).eval()
+            if self.configs.is_half and str(self.configs.device) != "cpu":
+                self.t2s_model = self.t2s_model.half()
+
+        def init_vits_weights(self, weights_path: str):
+            model_version = self.configs.version
+            with open(os.path.join(now_dir, "GPT_SoVITS/configs", SOVITS_CONFIG_FILES[model_version])) as f:
+                hps = json.load(f)
+            hps["model"]["semantic_frame_rate"] = "25hz"
+            hps["model"]["version"] = model_version
+            self.configs.filter_length = hps["data"]["filter_length"]
+            self.configs.segment_size = hps["train"]["segment_size"]
+            self.configs.sampling_rate = hps["data"]["sampling_rate"]
+            self.configs.hop_length = hps["data"]["hop_length"]
+            self.configs.win_length = hps["data"]["win_length"]
+            self.configs.n_speakers = hps["data"]["n_speakers"]
+            self.configs.semantic_frame_rate = hps["model"]["semantic_frame_rate"]
+            self.is_v2pro = model_version in {"v2Pro", "v2ProPlus"}
+            if self.is_v2pro:
+                self.init_sv_model()
+
+            if model_version not in {"v3", "v4"}:
+                vits_model = SynthesizerTrn(
+                    self.configs.filter_length // 2 + 1,
+                    self.configs.segment_size // self.configs.hop_length,
+                    n_speakers=self.configs.n_speakers,
+                    **hps["model"],
+                )
+                self.configs.use_vocoder = False
+            else:
+                vits_model = SynthesizerTrnV3(
+                    self.configs.filter_length // 2 + 1,
+                    self.configs.segment_size // self.configs.hop_length,
+                    n_speakers=self.configs.n_speakers,
+                    **hps["model"],
+                )
+                self.configs.use_vocoder = True
+                self.init_vocoder(model_version)
+                if hasattr(vits_model, "enc_q"):
+                    del vits_model.enc_q
+            self.vits_model = vits_model.to(self.configs.device).eval()
+            if self.configs.is_half and str(self.configs.device) != "cpu":
+                self.vits_model = self.vits_model.half()
+
+        def init_bert_weights(self, base_path: str):
+            # 逐字切分的词表, 与 chinese-roberta 一样每个汉字对应一个 token
+            vocab_path = os.path.join(tempfile.mkdtemp(prefix="bench_bert_"), "vocab.txt")
+            vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+            vocab += [chr(i) for i in range(0x21, 0x7F) if not chr(i).isupper()]
+            vocab += list("，。！？、；：“”‘’（）《》…—·")
+            vocab += [chr(i) for i in range(0x4E00, 0xA000)]
+            with open(vocab_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(vocab) + "\n")
+            self.bert_tokenizer = BertTokenizerFast(vocab_file=vocab_path)
+            bert_model = BertForMaskedLM(BertConfig(vocab_size=len(vocab), **BERT_CONFIG))
+            self.bert_model = bert_model.eval().to(self.configs.device)
+            if self.configs.is_half and str(self.configs.device) != "cpu":
+                self.bert_model = self.bert_model.half()
+
+        def init_cnhuhbert_weights(self, base_path: str):
+            cnhuhbert_model = CNHubert.__new__(CNHubert)
+            torch.nn.Module.__init__(cnhuhbert_model)
+            cnhuhbert_model.model = HubertModel(HubertConfig())
+            cnhuhbert_model.feature_extractor = Wav2Vec2FeatureExtractor()
+            self.cnhuhbert_model = cnhuhbert_model.eval().to(self.configs.device)
+            if self.configs.is_half and str(self.configs.device) != "cpu":
+                self.cnhuhbert_model = self.cnhuhbert_model.half()
+
+        def init_vocoder(self, version: str):
+            if version == "v3":
+                with open(os.path.join(now_dir, "GPT_SoVITS/BigVGAN/configs/bigvgan_v2_24khz_100band_256x.json")) as f:
+                    self.vocoder = BigVGAN(AttrDict(json.load(f)), use_cuda_kernel=False)
+                self.vocoder.remove_weight_norm()
+                self.vocoder_configs.update(sr=24000, T_ref=468, T_chunk=934, upsample_rate=256, overlapped_len=12)
+            else:
+                self.vocoder = Generator(
+                    initial_channel=100,
+                    resblock="1",
+                    resblock_kernel_sizes=[3, 7, 11],
+                    resblock_dilation_sizes=[[1, 3, 5], [1, 3, 5], [1, 3, 5]],
+                    upsample_rates=[10, 6, 2, 2, 2],
+                    upsample_initial_channel=512,
+                    upsample_kernel_sizes=[20, 12, 4, 4, 4],
+                    gin_channels=0,
+                    is_bias=True,
+                )
+                self.vocoder.remove_weight_norm()
+                self.vocoder_configs.update(sr=48000, T_ref=500, T_chunk=1000, upsample_rate=480, overlapped_len=12)
+            self.vocoder = self.vocoder.eval().to(self.configs.device)
+            if self.configs.is_half:
+                self.vocoder = self.vocoder.half()
+
+        def init_sv_model(self):
+            if self.sv_model is not None:
+                return
+            sv_model = SV.__new__(SV)
+            embedding_model = ERes2NetV2(baseWidth=24, scale=4, expansion=4).eval()
+            if self.configs.is_half:
+                embedding_model = embedding_model.half()
+            sv_model.embedding_model = embedding_model.to(self.configs.device)
+            sv_model.is_half = self.configs.is_half
+            self.sv_model = sv_model
+
+    return RandomInitTTS
+
+
+def make_reference_audio(path: str, seconds: float = 5.0, sr: int = 32000):
+    import numpy as np
+    import soundfile as sf
+
+    rng = np.random.RandomState(0)
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    audio = sum(np.sin(k * phase) / k for k in range(1, 8)) * 0.15
+    audio *= 0.5 + 0.5 * np.abs(np.sin(2 * np.pi * 2 * t))
+    audio += 0.01 * rng.randn(len(t))
+    sf.write(path, audio.astype(np.float32), sr)
+
+
+def instrument(tts, timer: StageTimer, counters: dict):
+    def count_tokens(result):
+        _, idx_list = result
+        counters["tokens"] += int(sum(int(idx) for idx in idx_list))
+
+    t2s = tts.t2s_model.model
+    timer.wrap(t2s, "infer_panel_batch_infer", "t2s_total", count_tokens)
+    timer.wrap(t2s, "infer_panel_naive_batched", "t2s_total", count_tokens)
+    timer.wrap(t2s.t2s_transformer, "process_prompt", "t2s_prefill")
+    timer.wrap(t2s.t2s_transformer, "process_prompt_packed", "t2s_prefill")
+    timer.wrap(t2s.t2s_transformer, "decode_next_token_static", "t2s_step")
+
+    timer.wrap(tts, "set_ref_audio", "reference")
+    timer.wrap(tts, "_get_ref_spec", "reference")
+    timer.wrap(tts.text_preprocessor, "preprocess", "text_total")
+    timer.wrap(tts.text_preprocessor, "segment_and_extract_feature_for_text", "text_total")
+    timer.wrap(tts.text_preprocessor, "get_bert_feature", "bert")
+    timer.wrap(tts.text_preprocessor, "get_bert_features_batched", "bert")
+
+    if tts.configs.use_vocoder:
+        timer.wrap(tts, "using_vocoder_synthesis", "decode_total")
+        timer.wrap(tts, "using_vocoder_synthesis_batched_infer", "decode_total")
+        timer.wrap_module(tts.vocoder, "vocoder")
+    else:
+        timer.wrap(tts.vits_model, "decode", "decode_total")
+        timer.wrap_module(tts.vits_model.dec, "vocoder")
+    timer.wrap(tts, "audio_postprocess", "postprocess")
+
+
+def split_stages(totals: dict) -> dict:
+    stages = {
+        "reference": totals["reference"],
+        "text_frontend": max(totals["text_total"] - totals["bert"], 0.0),
+        "bert": totals["bert"],
+        "t2s_prefill": totals["t2s_prefill"],
+        "t2s_decode": max(totals["t2s_total"] - totals["t2s_prefill"], 0.0),
+        "decode": max(totals["decode_total"] - totals["vocoder"], 0.0),
+        "vocoder": totals["vocoder"],
+        "postprocess": totals["postprocess"],
+    }
+    return stages
+
+
+def summarize(values: list) -> dict:
+    return {"median": median(values), "mean": mean(values), "min": min(values), "max": max(values)}
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB, macOS 单位为字节
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+
+def bench_version(version: str, args) -> dict:
+    import torch
+
+    torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+    RandomInitTTS = build_tts_class()
+    from TTS_infer_pack.TTS import TTS_Config
+
+    t0 = time.perf_counter()
+    # TTS_Config 只接受小写的版本名, v2Pro/v2ProPlus 与读取权重时一样通过 update_version 设置
+    configs = TTS_Config(
+        {
+            "version": "v2" if "Pro" in version else version,
+            "custom": {
+                "device": args.device,
+                "is_half": args.half,
+                # 关闭缓存, 每次迭代都完整地处理参考音频与文本
+                "ref_cache_size": 0,
+                "text_cache_max_mb": 0,
+            },
+        }
+    )
+    configs.update_version(version)
+    tts = RandomInitTTS(configs)
+    load_sec = time.perf_counter() - t0
+    tts.configs.max_sec = args.max_tokens / tts.configs.hz
+
+    timer = StageTimer(args.device)
+    counters = defaultdict(int)
+    instrument(tts, timer, counters)
+
+    ref_audio_path = os.path.join(tempfile.mkdtemp(prefix="bench_ref_"), "ref.wav")
+    make_reference_audio(ref_audio_path)
+    inputs = {
+        "text": args.text,
+        "text_lang": args.text_lang,
+        "ref_audio_path": ref_audio_path,
+        "prompt_text": args.prompt_text,
+        "prompt_lang": args.prompt_lang,
+        "top_k": 15,
+        "top_p": 1,
+        "temperature": 1,
+        "text_split_method": args.text_split_method,
+        "batch_size": args.batch_size,
+        "split_bucket": False,
+        "return_fragment": False,
+        "seed": args.seed,
+        "parallel_infer": True,
+        "repetition_penalty": 1.35,
+        "sample_steps": args.sample_steps,
+    }
+
+    runs = []
+    for i in range(args.warmup + args.iterations):
+        # 清空提示缓存, 参考音频与参考文本在每次迭代中都会被重新处理
+        tts.prompt_cache["ref_audio_path"] = None
+        tts.prompt_cache["prompt_text"] = None
+        timer.reset()
+        counters.clear()
+        t_start = time.perf_counter()
+        generator = tts.run(inputs)
+        sr, audio = next(generator)
+        generator.close()
+        total = time.perf_counter() - t_start
+        if i < args.warmup:
+            continue
+        runs.append(
+            {
+                "total": total,
+                "audio_sec": len(audio) / sr,
+                "tokens": counters["tokens"],
+                "steps": timer.calls["t2s_step"],
+                "stages": split_stages(timer.totals),
+            }
+        )
+        print(f"[{version}] iteration {i - args.warmup}: {total:.3f}s, {len(audio) / sr:.2f}s audio", file=sys.stderr)
+
+    t2s_sec = sum(r["stages"]["t2s_prefill"] + r["stages"]["t2s_decode"] for r in runs)
+    decode_sec = sum(r["stages"]["t2s_decode"] for r in runs)
+    tokens = sum(r["tokens"] for r in runs)
+    steps = sum(r["steps"] for r in runs)
+    total_sec = sum(r["total"] for r in runs)
+    audio_sec = sum(r["audio_sec"] for r in runs)
+    return {
+        "iterations": len(runs),
+        "load_sec": load_sec,
+        "stages": {stage: summarize([r["stages"][stage] for r in runs]) for stage in STAGES},
+        "total_sec": summarize([r["total"] for r in runs]),
+        "audio_sec": audio_sec / len(runs),
+        "t2s_tokens": tokens / len(runs),
+        "tokens_per_sec": tokens / t2s_sec if t2s_sec > 0 else 0.0,
+        "per_token_ms": decode_sec / steps * 1000 if steps > 0 else 0.0,
+        "rtf": total_sec / audio_sec if audio_sec > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_info() -> dict:
+    def git(*cmd):
+        try:
+            return subprocess.check_output(["git", *cmd], cwd=now_dir, stderr=subprocess.DEVNULL).decode().strip()
+        except Exception:
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def collect_meta(args) -> dict:
+    import torch
+
+    return {
+        **git_info(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "threads": args.threads,
+        "device": args.device,
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "child")},
+    }
+
+
+def run_child(version: str, args) -> dict:
+    """
+    Benchmarks one version in a fresh interpreter so that peak RSS is per version.
+    """
+    with tempfile.TemporaryDirectory(prefix="bench_tts_") as tmp_dir:
+        out_path = os.path.join(tmp_dir, "result.json")
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", version, "--output", out_path]
+        for key, value in vars(args).items():
+            if key in ("versions", "output", "compare", "child", "threshold", "half"):
+                continue
+            cmd += [f"--{key}", str(value)]
+        if args.half:
+            cmd.append("--half")
+        subprocess.run(cmd, cwd=now_dir, check=True)
+        with open(out_path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints the relative change of every metric and returns the regressions. Stages shorter than
+    5 ms and RSS changes below 20 MB are never flagged, they are within the noise.
+    """
+    regressions = []
+    for version, new in result["results"].items():
+        old = baseline.get("results", {}).get(version)
+        if old is None:
+            continue
+        print(f"\n{version}: {baseline['meta'].get('commit')} -> {result['meta'].get('commit')}")
+        metrics = [(f"stages.{s}", old["stages"][s]["median"], new["stages"][s]["median"], 0.005) for s in STAGES]
+        metrics += [
+            ("total_sec", old["total_sec"]["median"], new["total_sec"]["median"], 0.005),
+            ("per_token_ms", old["per_token_ms"], new["per_token_ms"], 0.05),
+            ("rtf", old["rtf"], new["rtf"], 0.001),
+            ("peak_rss_mb", old["peak_rss_mb"], new["peak_rss_mb"], 20.0),
+        ]
+        for name, old_value, new_value, min_delta in metrics:
+            change = (new_value - old_value) / old_value if old_value > 0 else 0.0
+            regressed = change > threshold and new_value - old_value > min_delta
+            flag = "  REGRESSION" if regressed else ""
+            print(f"  {name:<24}{old_value:>12.4f}{new_value:>12.4f}{change * 100:>+9.1f}%{flag}")
+            if regressed:
+                regressions.append(f"{version}.{name}")
+        # 生成速度越高越好
+        old_tps, new_tps = old["tokens_per_sec"], new["tokens_per_sec"]
+        change = (new_tps - old_tps) / old_tps if old_tps > 0 else 0.0
+        regressed = -change > threshold
+        print(f"  {'tokens_per_sec':<24}{old_tps:>12.4f}{new_tps:>12.4f}{change * 100:>+9.1f}%{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(f"{version}.tokens_per_sec")
+    return regressions
+
+
+def print_table(result: dict):
+    header = "".join(f"{s:>14}" for s in STAGES)
+    print(f"\n{'version':<10}{header}{'tok/s':>10}{'ms/tok':>10}{'RTF':>8}{'RSS MB':>10}")
+    for version, res in result["results"].items():
+        row = "".join(f"{res['stages'][s]['median']:>14.4f}" for s in STAGES)
+        print(
+            f"{version:<10}{row}{res['tokens_per_sec']:>10.1f}{res['per_token_ms']:>10.2f}"
+            f"{res['rtf']:>8.3f}{res['peak_rss_mb']:>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-SoVITS pipeline benchmark with random weights")
+    parser.add_argument("--versions", nargs="+", default=["v1", "v2", "v2Pro", "v3", "v4"], choices=VERSIONS)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--half", action="store_true", default=False)
+    parser.add_argument("--text", type=str, default=DEFAULT_TEXT)
+    parser.add_argument("--text_lang", type=str, default="zh")
+    parser.add_argument("--prompt_text", type=str, default=DEFAULT_PROMPT_TEXT)
+    parser.add_argument("--prompt_lang", type=str, default="zh")
+    parser.add_argument("--text_split_method", type=str, default="cut5")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--max_tokens", type=int, default=150, help="T2S early stop, fixes the decode length")
+    parser.add_argument("--sample_steps", type=int, default=32, help="CFM steps of v3/v4")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", type=str, default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.chdir(now_dir)
+    sys.path.insert(0, now_dir)
+    sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+    if args.child is not None:
+        result = bench_version(args.child, args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    result = {"meta": collect_meta(args), "results": {}}
+    for version in args.versions:
+        result["results"][version] = run_child(version, args)
+    print_table(result)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nresults written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class AudioResultCache:
+    """
+    Synthesized audio keyed by a hash of everything that determines it (text, voice, model, sampling
+    parameters, seed, media type), so a repeated deterministic request is answered without inference.
+
+    The memory tier is an LRU bounded by `max_memory_bytes`. The disk tier keeps one file per entry in
+    `cache_dir` (named `<key>.<ext>`, so a file can be served directly, e.g. as a download link), bounded
+    by `max_disk_bytes` with the same LRU policy. Every entry expires `ttl` seconds after it was written.
+
+    The in-memory index of the disk tier is kept in write order as well; since the ttl is the same for
+    every entry this is also expiry order, and `expire()` only looks at the oldest entries instead of
+    scanning the directory. The directory is scanned once, when the cache is created.
+
+    Args:
+        cache_dir (str): the directory of the disk tier, None disables it.
+        ttl (float): the lifetime of an entry in seconds, 0 for no expiry.
+        max_memory_bytes (int): the budget of the memory tier, 0 disables it.
+        max_disk_bytes (int): the budget of the disk tier, 0 for no limit.
+    """
+
+    def __init__(self, cache_dir: str = None, ttl: float = 86400, max_memory_bytes: int = 64 << 20, max_disk_bytes: int = 0):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        # key -> (data, ext, created)
+        self.memory: OrderedDict = OrderedDict()
+        self.memory_bytes = 0
+        # key -> (ext, size, created), LRU顺序
+        self.disk: OrderedDict = OrderedDict()
+        # key -> created, 写入顺序, 即过期顺序
+        self.expiry: OrderedDict = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan()
+
+    @staticmethod
+    def make_key(**fields) -> str:
+        return hashlib.sha1(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            name, ext = os.path.splitext(entry.name)
+            if not entry.is_file() or ext in ["", ".tmp"]:
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, name, ext[1:], stat.st_size))
+        for created, key, ext, size in sorted(files):
+            self.disk[key] = (ext, size, created)
+            self.expiry[key] = created
+            self.disk_bytes += size
+        self.expire()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl > 0 and now - created > self.ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        self.expire(now)
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None and self._expired(item[2], now):
+                self.memory_bytes -= len(self.memory.pop(key)[0])
+            elif item is not None:
+                self.memory.move_to_end(key)
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            disk_item = self.disk.get(key)
+        if disk_item is not None:
+            ext, _, created = disk_item
+            try:
+                with open(self.path(key, ext), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                with self.lock:
+                    if key in self.disk:
+                        self.disk.move_to_end(key)
+                    self.disk_hits += 1
+                self._put_memory(key, data, ext, created)
+                return data
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def contains(self, key: str) -> bool:
+        """
+        Whether the disk tier has a live file for `key`.
+        """
+        self.expire()
+        with self.lock:
+            return key in self.disk
+
+    def ext(self, key: str) -> Optional[str]:
+        with self.lock:
+            item = self.disk.get(key)
+            return item[0] if item is not None else None
+
+    def put(self, key: str, data: bytes, ext: str) -> Optional[str]:
+        """
+        Store `data`, returns the path of the disk file (None without the disk tier).
+        """
+        created = time.time()
+        self._put_memory(key, data, ext, created)
+        if self.cache_dir is None:
+            return None
+        path = self.path(key, ext)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to save audio cache {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        evicted = []
+        with self.lock:
+            if key in self.disk:
+                self.disk_bytes -= self.disk.pop(key)[1]
+                self.expiry.pop(key, None)
+            self.disk[key] = (ext, len(data), created)
+            self.expiry[key] = created
+            self.disk_bytes += len(data)
+            while self.max_disk_bytes > 0 and self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, item = self.disk.popitem(last=False)
+                self.expiry.pop(old_key, None)
+                self.disk_bytes -= item[1]
+                evicted.append((old_key, item[0]))
+        self._remove_files(evicted)
+        return path
+
+    def expire(self, now: float = None) -> int:
+        """
+        Drop the expired entries of both tiers, returns the number of removed files.
+        """
+        if self.ttl <= 0:
+            return 0
+        now = time.time() if now is None else now
+        evicted = []
+        with self.lock:
+            while self.expiry:
+                key, created = next(iter(self.expiry.items()))
+                if not self._expired(created, now):
+                    break
+                del self.expiry[key]
+                item = self.disk.pop(key, None)
+                if item is not None:
+                    self.disk_bytes -= item[1]
+                    evicted.append((key, item[0]))
+            while self.memory:
+                key, item = next(iter(self.memory.items()))
+                # 内存层按LRU排序, 只清理队首, 其余的在get时检查
+                if not self._expired(item[2], now):
+                    break
+                self.memory.popitem(last=False)
+                self.memory_bytes -= len(item[0])
+        self._remove_files(evicted)
+        return len(evicted)
+
+    def _put_memory(self, key: str, data: bytes, ext: str, created: float):
+        if len(data) > self.max_memory_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= len(self.memory.pop(key)[0])
+            self.memory[key] = (data, ext, created)
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, item = self.memory.popitem(last=False)
+                self.memory_bytes -= len(item[0])
+
+    def _remove_files(self, evicted: list):
+        for key, ext in evicted:
+            try:
+                os.remove(self.path(key, ext))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "memory_items": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_items": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
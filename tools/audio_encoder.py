@@ -0,0 +1,106 @@
+import wave
+from io import BytesIO
+
+import av
+import numpy as np
+
+# media_type: (容器格式, 编码器, 编码器采样率, 默认码率), 采样率为None时沿用输入采样率
+MEDIA_TYPES = {
+    "ogg": ("ogg", "libopus", 48000, 64000),
+    "aac": ("adts", "aac", None, 128000),
+    "mp3": ("mp3", "libmp3lame", None, 128000),
+}
+
+
+class _ChunkBuffer:
+    # 只写不可seek的输出, 复用器写出的数据在每次encode后取走
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class StreamingAudioEncoder:
+    """
+    One encoder per output stream. The muxer and the codec stay open across `encode` calls,
+    so all chunks together form a single valid container (Ogg/Opus, ADTS AAC, MP3)
+    instead of one container, or one ffmpeg process, per chunk.
+
+    "wav" sends the header with the first chunk followed by raw PCM, "raw" is raw PCM.
+
+    Args:
+        media_type (str): "ogg", "aac", "mp3", "wav" or "raw".
+        sample_rate (int): the sampling rate of the input audio.
+        sample_format (str): "s16" for int16 input, "s32" for int32 input.
+        bit_rate (int): the bit rate of the compressed formats, None for the default.
+    """
+
+    def __init__(self, media_type: str, sample_rate: int, sample_format: str = "s16", bit_rate: int = None):
+        self.media_type = media_type
+        self.sample_rate = sample_rate
+        self.sample_format = sample_format
+        self.header_sent = False
+        self.container = None
+
+        if media_type in MEDIA_TYPES:
+            container_format, codec, codec_rate, default_bit_rate = MEDIA_TYPES[media_type]
+            codec_rate = codec_rate or sample_rate
+            self.buffer = _ChunkBuffer()
+            # ogg默认每秒才写出一页, 缩短页时长以降低流式延迟
+            options = {"page_duration": "20000"} if container_format == "ogg" else {}
+            self.container = av.open(self.buffer, mode="w", format=container_format, options=options)
+            self.stream = self.container.add_stream(codec, rate=codec_rate)
+            self.stream.layout = "mono"
+            self.stream.bit_rate = bit_rate or default_bit_rate
+            self.resampler = av.AudioResampler(
+                format=self.stream.codec_context.format.name, layout="mono", rate=codec_rate
+            )
+        elif media_type not in ["wav", "raw"]:
+            raise ValueError(f"media_type: {media_type} is not supported")
+
+    def encode(self, data: np.ndarray) -> bytes:
+        if self.container is None:
+            if self.media_type == "wav" and not self.header_sent:
+                self.header_sent = True
+                return self._wav_header() + data.tobytes()
+            return data.tobytes()
+
+        frame = av.AudioFrame.from_ndarray(data.reshape(1, -1), format=self.sample_format, layout="mono")
+        frame.sample_rate = self.sample_rate
+        self._encode_frames(self.resampler.resample(frame))
+        return self.buffer.drain()
+
+    def flush(self) -> bytes:
+        """
+        Flush the codec and write the container trailer, the encoder can not be used afterwards.
+        """
+        if self.container is None:
+            return b"" if self.header_sent or self.media_type == "raw" else self._wav_header()
+        self._encode_frames(self.resampler.resample(None))
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+        self.container = None
+        self.header_sent = True
+        return self.buffer.drain()
+
+    def _encode_frames(self, frames):
+        for frame in frames:
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+
+    def _wav_header(self) -> bytes:
+        # 数据长度未知, 与 wave_header_chunk 相同写入长度为0的头
+        wav_buf = BytesIO()
+        with wave.open(wav_buf, "wb") as vfout:
+            vfout.setnchannels(1)
+            vfout.setsampwidth(4 if self.sample_format == "s32" else 2)
+            vfout.setframerate(self.sample_rate)
+        return wav_buf.getvalue()
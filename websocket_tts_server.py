@@ -2,14 +2,26 @@ import asyncio
 import websockets
 import json
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
 import torch
-import torchaudio
-from inference_webui import get_tts_wav
-from datetime import datetime, timedelta
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append(os.path.join(now_dir, "GPT_SoVITS"))
+
+from TTS_infer_pack.TTSEngine import TTSEngine
+from datetime import datetime
+from io import BytesIO
 import re
 import uuid
 import aiohttp
 from aiohttp import web
+from tools.audio_cache import AudioResultCache
+from tools.audio_encoder import StreamingAudioEncoder
 
 # 从环境变量获取IP和端口配置
 HTTP_HOST = os.getenv('HTTP_HOST', '0.0.0.0')
@@ -19,13 +31,52 @@ WS_PORT = int(os.getenv('WS_PORT', '8765'))
 PUBLIC_IP = os.getenv('PUBLIC_IP', '43.159.42.232')
 PUBLIC_PORT = int(os.getenv('PUBLIC_PORT', '8766'))
 
-# 固定模型路径（启动时由 inference_webui.py 读取）
+# 模型配置: tts_infer.yaml, 可用环境变量 gpt_path / sovits_path 覆盖其中的权重路径
+TTS_CONFIG_PATH = os.getenv('TTS_CONFIG_PATH', 'GPT_SoVITS/configs/tts_infer.yaml')
 REF_AUDIO_PATH = "output/CanKao/CanKao.wav"
 REF_TEXT_PATH = "output/CanKao/CanKao_text.txt"
 OUTPUT_DIR = "output/tts_results"
 EXPIRE_DAYS = 1
+# 默认每次随机采样, 不使用结果缓存; 设置固定随机种子(>=0)后相同的请求结果相同, 直接从缓存返回
+TTS_SEED = int(os.getenv('TTS_SEED', '-1'))
+AUDIO_CACHE_MEMORY_MB = int(os.getenv('AUDIO_CACHE_MEMORY_MB', '64'))
+# 磁盘缓存(即下载文件目录)上限, 0为不限制
+AUDIO_CACHE_DISK_MB = int(os.getenv('AUDIO_CACHE_DISK_MB', '2048'))
+# 过期检查间隔(秒), 只检查最早写入的文件, 不遍历目录
+CLEANUP_INTERVAL = int(os.getenv('CLEANUP_INTERVAL', '60'))
+# 采样参数, 同时参与缓存键的计算
+SYNTH_PARAMS = {
+    "text_split_method": "不切",
+    "top_k": 20,
+    "top_p": 0.6,
+    "temperature": 0.6,
+    "speed_factor": 1.0,
+    "sample_steps": 8,
+    "super_sampling": False,
+    "fragment_interval": 0.3,
+}
+# 流式推理每帧音频时长(毫秒)
+STREAM_FRAME_MS = int(os.getenv('STREAM_FRAME_MS', '200'))
+STREAM_FORMATS = ["pcm", "wav", "mp3", "opus"]
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 模型在第一次推理时加载 (或由 main 预热), 导入本模块不加载任何模型
+tts_engine = TTSEngine(
+    TTS_CONFIG_PATH,
+    t2s_weights_path=os.getenv('gpt_path'),
+    vits_weights_path=os.getenv('sovits_path'),
+    device="cuda" if torch.cuda.is_available() else "cpu",
+    is_half=eval(os.getenv('is_half', 'True')) and torch.cuda.is_available(),
+)
+# 只有一个推理线程: TTS 实例不可重入, 请求在此串行推理; 推理不在事件循环中进行, 不会阻塞其他连接
+tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+# 下载文件以缓存键命名, 下载目录即磁盘缓存
+audio_cache = AudioResultCache(
+    OUTPUT_DIR,
+    ttl=EXPIRE_DAYS * 86400,
+    max_memory_bytes=AUDIO_CACHE_MEMORY_MB << 20,
+    max_disk_bytes=AUDIO_CACHE_DISK_MB << 20,
+)
 
 def read_ref_text():
     if not os.path.exists(REF_TEXT_PATH):
@@ -47,86 +98,183 @@ def generate_unique_filename():
     # 时间戳+随机串
     now = datetime.now().strftime('%Y%m%d_%H%M%S')
     rand = str(uuid.uuid4())[:8]
-    file_id = f"{now}_{rand}"
-    output_path = os.path.join(OUTPUT_DIR, f"{file_id}.wav")
-    return file_id, output_path
+    return f"{now}_{rand}"
 
-def run_tts(text):
+def make_cache_key(text, media):
+    """随机种子时返回 None, 结果不可复用"""
+    if TTS_SEED < 0:
+        return None
+    ref_stat = os.stat(REF_AUDIO_PATH)
+    return audio_cache.make_key(
+        text=text,
+        ref_audio=[REF_AUDIO_PATH, ref_stat.st_size, ref_stat.st_mtime],
+        ref_text=read_ref_text(),
+        model=[tts_engine.configs.t2s_weights_path, tts_engine.configs.vits_weights_path],
+        params=SYNTH_PARAMS,
+        seed=TTS_SEED,
+        media=media,
+    )
+
+def synthesize(text, return_fragment=True):
     ref_text = read_ref_text()
     lang = detect_language(text)
     ref_lang = detect_language(ref_text)
     print(f"[TTS] 使用参考文本: {ref_text}（{ref_lang}）")
     print(f"[TTS] 开始生成语音: {text}（{lang}）")
+    # 逐个返回 (采样率, int16音频), return_fragment 时每句返回一次, 否则只返回一次完整音频
+    yield from tts_engine.synthesize(
+        text,
+        lang,
+        REF_AUDIO_PATH,
+        prompt_text=ref_text,
+        prompt_lang=ref_lang,
+        return_fragment=return_fragment,
+        seed=TTS_SEED,
+        **SYNTH_PARAMS,
+    )
+
+def cached_stream(cache_key):
+    # 流式结果以wav缓存, 命中时按请求的格式重新编码, 各格式共用一份缓存
+    data = audio_cache.get(cache_key) if cache_key is not None else None
+    if data is None:
+        return None
+    audio_int16, sr = sf.read(BytesIO(data), dtype="int16")
+    print(f"[TTS] 命中缓存: {cache_key}")
+    return [(sr, audio_int16)]
+
+def run_tts_stream(text, fmt, frame_ms, emit, cancelled):
+    """在推理线程中运行: 合成音频, 按帧编码后通过 emit 交给事件循环发送; cancelled 被设置后在下一帧停止"""
+    frame_count = 0
+    total_samples = 0
+    sr = None
+    encoder = None
+    cache_key = make_cache_key(text, "pcm")
+    cached = cached_stream(cache_key)
+    chunks = []
+    fragments = cached if cached is not None else synthesize(text)
+    try:
+        for sr, audio_int16 in fragments:
+            if cancelled.is_set():
+                break
+            if cached is None and cache_key is not None:
+                chunks.append(audio_int16)
+            if encoder is None:
+                emit(("start", sr))
+                # 整个流共用一个编码器, 所有帧拼接后是一个连续的音频流
+                encoder = StreamingAudioEncoder("ogg" if fmt == "opus" else "raw" if fmt == "pcm" else fmt, sr)
+            frame_len = max(int(sr * frame_ms / 1000), 1)
+            for i in range(0, len(audio_int16), frame_len):
+                if cancelled.is_set():
+                    break
+                frame = encoder.encode(audio_int16[i : i + frame_len])
+                if frame:
+                    emit(("frame", frame))
+                    frame_count += 1
+            total_samples += len(audio_int16)
+    finally:
+        # 关闭生成器, 推理在当前分段结束后停止
+        if cached is None:
+            fragments.close()
+    if cancelled.is_set():
+        print(f"[TTS] 客户端已断开, 停止合成: {text}")
+        return sr, total_samples, frame_count
+    if encoder is not None:
+        frame = encoder.flush()
+        if frame:
+            emit(("frame", frame))
+            frame_count += 1
+    if chunks:
+        buffer = BytesIO()
+        sf.write(buffer, np.concatenate(chunks), sr, format="WAV", subtype="PCM_16")
+        audio_cache.put(cache_key, buffer.getvalue(), "wav")
+    return sr, total_samples, frame_count
+
+async def stream_tts(websocket, text, fmt, frame_ms):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def emit(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭, 没有人再消费结果
+            cancelled.set()
 
-    file_id, output_path = generate_unique_filename()
+    future = loop.run_in_executor(tts_executor, run_tts_stream, text, fmt, frame_ms, emit, cancelled)
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(queue.put_nowait, ("done", None)))
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "done":
+                break
+            if kind == "start":
+                await websocket.send(json.dumps({
+                    "指令": "流式开始",
+                    "参数": {
+                        "推理文本": text,
+                        "格式": fmt,
+                        "采样率": value if fmt != "opus" else 48000,
+                        "声道": 1,
+                        "位深": 16,
+                    }
+                }, ensure_ascii=False))
+            else:
+                await websocket.send(value)
+    finally:
+        # 客户端断开 (send 抛出异常) 或任务被取消时停止推理, 释放推理线程
+        cancelled.set()
+    sr, total_samples, frame_count = future.result()
+    return total_samples / sr if sr else 0, frame_count
+
+def run_tts(text):
+    # 下载链接模式: 进程内直接编码为mp3, 以缓存键为文件名, 相同请求直接返回已有文件
+    cache_key = make_cache_key(text, "mp3")
+    if cache_key is not None:
+        data = None if audio_cache.contains(cache_key) else audio_cache.get(cache_key)
+        if data is not None:
+            # 仅内存中还有, 文件已被淘汰, 重新写出
+            audio_cache.put(cache_key, data, "mp3")
+        if audio_cache.contains(cache_key):
+            file_size = os.path.getsize(audio_cache.path(cache_key, "mp3"))
+            print(f"[TTS] 命中缓存: {cache_key}, 文件大小: {file_size} 字节")
+            return cache_key, file_size, text
 
     try:
-        tts_gen = get_tts_wav(
-            ref_wav_path=REF_AUDIO_PATH,
-            prompt_text=ref_text,
-            prompt_language=ref_lang,
-            text=text,
-            text_language=lang,
-            how_to_cut="不切",
-            top_k=20,
-            top_p=0.6,
-            temperature=0.6,
-            ref_free=False,
-            speed=1.0,
-            if_freeze=False,
-            inp_refs=None,
-            sample_steps=8,
-            if_sr=False,
-            pause_second=0.3,
-        )
-        sr, audio_int16 = next(tts_gen)
-        torchaudio.save(output_path, torch.tensor(audio_int16).unsqueeze(0).to(torch.int16), sample_rate=sr)
-        # wav转mp3
-        mp3_path = output_path.replace('.wav', '.mp3')
-        ffmpeg_cmd = f'ffmpeg -y -i "{output_path}" -codec:a libmp3lame -qscale:a 2 "{mp3_path}"'
-        print(f"[DEBUG] ffmpeg转码: {ffmpeg_cmd}")
-        os.system(ffmpeg_cmd)
-        # 检查mp3存在
-        if not os.path.exists(mp3_path):
-            raise RuntimeError(f"ffmpeg转码失败: {output_path} -> {mp3_path}")
-        os.remove(output_path)
+        sr, audio_int16 = next(synthesize(text, return_fragment=False))
+        buffer = BytesIO()
+        # 与流式接口使用同一个进程内编码器
+        encoder = StreamingAudioEncoder("mp3", sr)
+        buffer.write(encoder.encode(audio_int16))
+        buffer.write(encoder.flush())
+        file_id = cache_key if cache_key is not None else generate_unique_filename()
+        mp3_path = audio_cache.put(file_id, buffer.getvalue(), "mp3")
+        if mp3_path is None:
+            raise OSError(f"音频保存失败: {file_id}")
         file_size = os.path.getsize(mp3_path)
         print(f"[TTS] 推理完成，音频保存至: {mp3_path}, 文件大小: {file_size} 字节")
-        return os.path.splitext(os.path.basename(mp3_path))[0], file_size, text
+        return file_id, file_size, text
     except Exception as e:
         print(f"[TTS] 推理失败: {str(e)}")
-        if os.path.exists(output_path):
-            os.remove(output_path)
         raise
 
 async def cleanup_expired_files():
     while True:
-        now = datetime.now()
-        for filename in os.listdir(OUTPUT_DIR):
-            file_path = os.path.join(OUTPUT_DIR, filename)
-            if os.path.isfile(file_path):
-                creation_time = datetime.fromtimestamp(os.path.getctime(file_path))
-                if now - creation_time > timedelta(days=EXPIRE_DAYS):
-                    try:
-                        os.remove(file_path)
-                        print(f"[Cleanup] 删除过期文件: {file_path}")
-                    except Exception as e:
-                        print(f"[Cleanup] 删除文件 {file_path} 失败: {str(e)}")
-        await asyncio.sleep(24 * 3600)
+        # 缓存索引按写入时间排序, 只检查最早的文件
+        removed = audio_cache.expire()
+        if removed:
+            print(f"[Cleanup] 删除过期文件 {removed} 个, 缓存状态: {audio_cache.stats()}")
+        await asyncio.sleep(CLEANUP_INTERVAL)
 
 async def download_handler(request):
     file_id = request.match_info['file_id']
-    file_path = os.path.join(OUTPUT_DIR, f"{file_id}.mp3")
+    # 只提供缓存索引中的文件, 过期判断不访问文件系统
+    if audio_cache.ext(file_id) != "mp3" or not audio_cache.contains(file_id):
+        return web.Response(status=404, text="文件不存在或已过期")
+    file_path = audio_cache.path(file_id, "mp3")
     print(f"[DEBUG] 下载文件: {file_path}")
     if not os.path.exists(file_path):
         return web.Response(status=404, text="文件不存在或已过期")
-    creation_time = datetime.fromtimestamp(os.path.getctime(file_path))
-    if datetime.now() - creation_time > timedelta(days=EXPIRE_DAYS):
-        try:
-            os.remove(file_path)
-        except:
-            pass
-        return web.Response(status=404, text="文件不存在或已过期")
     return web.FileResponse(file_path)
 
 async def handle_connection(websocket):
@@ -169,7 +317,9 @@ async def handle_connection(websocket):
                     }, ensure_ascii=False))
                     continue
                 try:
-                    mp3_id, file_size, text = run_tts(param)
+                    mp3_id, file_size, text = await asyncio.get_running_loop().run_in_executor(
+                        tts_executor, run_tts, param
+                    )
                     download_url = f"http://{PUBLIC_IP}:{PUBLIC_PORT}/download/{mp3_id}"
                     await websocket.send(json.dumps({
                         "指令": "推理结果",
@@ -188,6 +338,43 @@ async def handle_connection(websocket):
                         "指令": "错误",
                         "参数": f"推理失败: {str(e)}"
                     }, ensure_ascii=False))
+            elif cmd == "流式推理":
+                # 参数为文本, 或 {"文本": "...", "格式": "pcm/wav/mp3/opus", "帧时长": 200}
+                if isinstance(param, str):
+                    param = {"文本": param}
+                text = param.get("文本") if isinstance(param, dict) else None
+                fmt = param.get("格式", "pcm") if isinstance(param, dict) else "pcm"
+                if not text or not isinstance(text, str):
+                    await websocket.send(json.dumps({
+                        "指令": "错误",
+                        "参数": "文本不能为空，且必须为字符串"
+                    }, ensure_ascii=False))
+                    continue
+                if fmt not in STREAM_FORMATS:
+                    await websocket.send(json.dumps({
+                        "指令": "错误",
+                        "参数": f"不支持的格式: {fmt}, 可选: {'/'.join(STREAM_FORMATS)}"
+                    }, ensure_ascii=False))
+                    continue
+                try:
+                    frame_ms = int(param.get("帧时长", STREAM_FRAME_MS))
+                    duration, frame_count = await stream_tts(websocket, text, fmt, frame_ms)
+                    await websocket.send(json.dumps({
+                        "指令": "流式结束",
+                        "参数": {
+                            "状态": "成功",
+                            "推理文本": text,
+                            "音频时长": round(duration, 3),
+                            "帧数": frame_count
+                        }
+                    }, ensure_ascii=False))
+                    print(f"[Server] 流式推理完成: {frame_count} 帧, {duration:.2f} 秒")
+                except Exception as e:
+                    print(f"[Server] 流式推理失败: {str(e)}")
+                    await websocket.send(json.dumps({
+                        "指令": "错误",
+                        "参数": f"推理失败: {str(e)}"
+                    }, ensure_ascii=False))
             else:
                 await websocket.send(json.dumps({
                     "指令": "错误",
@@ -201,6 +388,10 @@ async def handle_connection(websocket):
             }, ensure_ascii=False))
 
 async def main():
+    # 启动时加载模型, 避免第一个请求等待
+    await asyncio.get_running_loop().run_in_executor(tts_executor, tts_engine.load)
+    print(f"[Server] 模型加载完成: {tts_engine.configs.t2s_weights_path}, {tts_engine.configs.vits_weights_path}")
+
     # HTTP服务
     app = web.Application()
     app.add_routes([